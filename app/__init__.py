@@ -16,10 +16,14 @@ def create_app():
     # Use config key rather than app.secret_key directly:
     app.config["SECRET_KEY"] = os.getenv("FLASK_SECRET_KEY", "this-should-be-changed")
 
-    # Initialize databases (users.db and wiki.db)
-    from app.database_setup import init_user_db, init_wiki_db
+    # Initialize databases (users.db, wiki.db, jobs.db, documents.db and retrieval_state.db)
+    from app.database_setup import init_user_db, init_wiki_db, init_jobs_db, init_docs_db
+    from retrieval_state import init_retrieval_state
     init_user_db()
     init_wiki_db()
+    init_jobs_db()
+    init_docs_db()
+    init_retrieval_state()
 
     # Import and register blueprints
     from app.auth import auth_bp
@@ -27,11 +31,26 @@ def create_app():
     from app.wiki import wiki_bp
     from app.sources import sources_bp
     from app.main import main_bp
+    from app.jobs import jobs_bp, start_ingestion_workers
 
     app.register_blueprint(auth_bp)
     app.register_blueprint(docs_bp)
     app.register_blueprint(wiki_bp)
     app.register_blueprint(sources_bp)
     app.register_blueprint(main_bp)
+    app.register_blueprint(jobs_bp)
+
+    # Refuse to start when EMBEDDING_DIMENSIONS does not match the stored vectors
+    from database import check_active_dimensions
+    check_active_dimensions()
+
+    # Background workers for queued document ingestion (resumes interrupted jobs)
+    start_ingestion_workers()
+
+    # Optionally pay the first request's loading costs before taking traffic
+    from config import WARM_UP
+    if WARM_UP:
+        from warmup import warm_up
+        warm_up()
 
     return app
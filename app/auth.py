@@ -1,16 +1,17 @@
 import os
 import datetime
-import sqlite3
 from flask import Blueprint, render_template, request, redirect, url_for, flash, session
 from werkzeug.security import generate_password_hash, check_password_hash
 
 # We now import the USERS_DB constant from database_setup
 from app.database_setup import USERS_DB
+from sqlite_pool import get_connection
+from retrieval_state import delete_state
 
 auth_bp = Blueprint('auth', __name__)
 
 def get_user(username):
-    with sqlite3.connect(USERS_DB) as conn:
+    with get_connection(USERS_DB) as conn:
         cur = conn.cursor()
         cur.execute("SELECT id, username, password FROM users WHERE username = ?", (username,))
         row = cur.fetchone()
@@ -20,7 +21,7 @@ def get_user(username):
 
 def register_user(username, password):
     hashed = generate_password_hash(password)
-    with sqlite3.connect(USERS_DB) as conn:
+    with get_connection(USERS_DB) as conn:
         cur = conn.cursor()
         cur.execute(
             "INSERT INTO users (username, password, created_at) VALUES (?, ?, ?)",
@@ -63,5 +64,6 @@ def login():
 @auth_bp.route("/logout")
 def logout():
     session.pop("user", None)
+    delete_state(session.pop("state_key", None))
     flash("Logged out.", "info")
     return redirect(url_for("auth.login"))
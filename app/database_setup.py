@@ -1,13 +1,22 @@
+import os
+import json
 import sqlite3
 
+from sqlite_pool import get_connection
+
 USERS_DB = "users.db"
 WIKI_DB = "wiki.db"
+JOBS_DB = "jobs.db"
+DOCS_DB = "documents.db"
+
+# Document metadata was kept in this JSON file before the catalog existed
+LEGACY_METADATA_FILE = os.path.join("uploads", "metadata.json")
 
 def init_user_db():
     """
     Creates the 'users' table in users.db if it does not exist.
     """
-    with sqlite3.connect(USERS_DB) as conn:
+    with get_connection(USERS_DB) as conn:
         cur = conn.cursor()
         cur.execute("""
             CREATE TABLE IF NOT EXISTS users (
@@ -22,9 +31,9 @@ def init_user_db():
 def init_wiki_db():
     """
     Creates the 'wiki' table in wiki.db if it does not exist,
-    and adds a 'last_edited_by' column if missing.
+    adds a 'last_edited_by' column if missing and indexes 'updated_at'.
     """
-    with sqlite3.connect(WIKI_DB) as conn:
+    with get_connection(WIKI_DB) as conn:
         cur = conn.cursor()
         cur.execute("""
             CREATE TABLE IF NOT EXISTS wiki (
@@ -40,5 +49,100 @@ def init_wiki_db():
             cur.execute("ALTER TABLE wiki ADD COLUMN last_edited_by TEXT")
         except:
             pass
+        # get_all_wiki_pages lists pages by most recent update
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_wiki_updated_at ON wiki (updated_at)")
 
         conn.commit()
+
+def init_jobs_db():
+    """
+    Creates the 'jobs' table in jobs.db if it does not exist.
+    Each row tracks one queued document ingestion and the last stage it finished.
+    """
+    with get_connection(JOBS_DB) as conn:
+        cur = conn.cursor()
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS jobs (
+                id TEXT PRIMARY KEY,
+                doc_id TEXT NOT NULL,
+                file_path TEXT NOT NULL,
+                metadata TEXT NOT NULL,
+                status TEXT NOT NULL,
+                stage TEXT,
+                current_stage TEXT,
+                error TEXT,
+                worker_pid INTEGER,
+                created_at TEXT NOT NULL,
+                updated_at TEXT NOT NULL
+            )
+        """)
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_jobs_status_created ON jobs (status, created_at)")
+        conn.commit()
+
+def init_docs_db():
+    """
+    Creates the 'documents' catalog in documents.db if it does not exist and
+    imports uploads/metadata.json into it the first time it runs.
+    """
+    with get_connection(DOCS_DB) as conn:
+        cur = conn.cursor()
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS documents (
+                doc_id TEXT PRIMARY KEY,
+                title TEXT NOT NULL,
+                uploader TEXT,
+                upload_time TEXT NOT NULL,
+                upload_display TEXT,
+                folder TEXT DEFAULT '',
+                filename TEXT NOT NULL,
+                ext TEXT DEFAULT '',
+                metadata TEXT NOT NULL
+            )
+        """)
+        # Added for duplicate detection; older catalogs get the column here
+        try:
+            cur.execute("ALTER TABLE documents ADD COLUMN content_hash TEXT")
+        except sqlite3.OperationalError:
+            pass
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_documents_upload_time ON documents (upload_time)")
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_documents_folder ON documents (folder, upload_time)")
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_documents_uploader ON documents (uploader, upload_time)")
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_documents_content_hash ON documents (content_hash)")
+        conn.commit()
+    migrate_metadata_json()
+
+def migrate_metadata_json():
+    """
+    One-time import of the legacy uploads/metadata.json into the catalog. The file is
+    renamed afterwards so the import does not run again.
+    """
+    if not os.path.exists(LEGACY_METADATA_FILE):
+        return
+    with open(LEGACY_METADATA_FILE, "r") as f:
+        records = json.load(f)
+    with get_connection(DOCS_DB) as conn:
+        cur = conn.cursor()
+        cur.executemany(
+            "INSERT OR IGNORE INTO documents "
+            "(doc_id, title, uploader, upload_time, upload_display, folder, filename, ext, metadata, content_hash) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            [document_row(record) for record in records if record.get("doc_id")]
+        )
+        conn.commit()
+    os.replace(LEGACY_METADATA_FILE, LEGACY_METADATA_FILE + ".migrated")
+    print(f"Imported {len(records)} documents from {LEGACY_METADATA_FILE} into {DOCS_DB}.")
+
+def document_row(record):
+    """Maps a document record to a row of the 'documents' table."""
+    return (
+        record["doc_id"],
+        record.get("title", ""),
+        record.get("uploader"),
+        record.get("upload_time", ""),
+        record.get("upload_display"),
+        record.get("folder", ""),
+        record.get("filename", ""),
+        record.get("ext", ""),
+        json.dumps(record),
+        record.get("content_hash")
+    )
@@ -2,43 +2,120 @@ import os
 import uuid
 import datetime
 import json
-import sqlite3
+import re
 from flask import Blueprint, render_template, request, redirect, url_for, flash, send_from_directory, session
-from chunk_and_embed import chunk_and_embed_file, generate_document_title
-from database import collection, chroma_client, embedding_function
+from chunk_and_embed import (
+    partition_file, file_hash, build_chunks, embed_chunks, index_chunks, delete_document_chunks,
+    generate_document_title
+)
+from database import get_embedding_model_key
+from sqlite_pool import get_connection
+from metrics import trace
+from app.database_setup import DOCS_DB, document_row
+from app.jobs import (
+    create_job, update_job, pending_stages, save_stage_output, load_stage_output, complete_job
+)
 
 docs_bp = Blueprint('docs', __name__)
 
 UPLOAD_FOLDER = "uploads"
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
-METADATA_FILE = os.path.join(UPLOAD_FOLDER, "metadata.json")
-
-if not os.path.exists(METADATA_FILE):
-    with open(METADATA_FILE, "w") as f:
-        json.dump([], f)
-
-def update_metadata(record):
-    with open(METADATA_FILE, "r") as f:
-        data = json.load(f)
-    data.append(record)
-    with open(METADATA_FILE, "w") as f:
-        json.dump(data, f, indent=2)
-
-def remove_metadata(doc_id):
-    with open(METADATA_FILE, "r") as f:
-        data = json.load(f)
-    updated_data = [d for d in data if not (d.get("doc_id") == doc_id)]
-    with open(METADATA_FILE, "w") as f:
-        json.dump(updated_data, f, indent=2)
-
-def process_document(file_path, doc_id, extra_metadata):
+DOCUMENTS_PER_PAGE = 50
+
+def save_document(record):
+    """Inserts a document into the catalog, replacing any earlier record with the same doc_id."""
+    with get_connection(DOCS_DB) as conn:
+        cur = conn.cursor()
+        cur.execute(
+            "INSERT OR REPLACE INTO documents "
+            "(doc_id, title, uploader, upload_time, upload_display, folder, filename, ext, metadata, content_hash) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            document_row(record)
+        )
+        conn.commit()
+
+def find_document_by_hash(content_hash):
+    """Returns the doc_id of a catalogued document with this content hash, or None."""
+    with get_connection(DOCS_DB) as conn:
+        cur = conn.cursor()
+        cur.execute("SELECT doc_id FROM documents WHERE content_hash = ? LIMIT 1", (content_hash,))
+        row = cur.fetchone()
+    return row[0] if row else None
+
+def remove_document(doc_id):
+    with get_connection(DOCS_DB) as conn:
+        cur = conn.cursor()
+        cur.execute("DELETE FROM documents WHERE doc_id = ?", (doc_id,))
+        conn.commit()
+
+def title_filename(file_path, title):
+    """The filename an uploaded file gets once its title is generated."""
+    sanitized_title = re.sub(r'[^a-zA-Z0-9_-]', '_', title)
+    return sanitized_title + os.path.splitext(file_path)[1].lower()
+
+def rename_to_title(file_path, filename):
     """
-    Previously run in a separate thread, but now done inline
-    so we can flash a message when it's truly finished.
+    Renames an uploaded file to filename and returns the new path. A file that
+    was already renamed before the job was interrupted is left where it is.
     """
-    chunk_and_embed_file(file_path, doc_id, extra_metadata=extra_metadata)
-    extra_metadata["doc_id"] = doc_id
-    update_metadata(extra_metadata)
+    new_file_path = os.path.join(os.path.dirname(file_path), filename)
+    if not os.path.exists(file_path) and os.path.exists(new_file_path):
+        return new_file_path
+    os.rename(file_path, new_file_path)
+    return new_file_path
+
+def process_document(job):
+    """
+    Runs the ingestion stages of a queued upload that have not finished yet.
+    Each stage checkpoints its output, so a job interrupted by a restart
+    resumes from the last finished stage instead of starting over.
+    """
+    job_id = job["id"]
+    doc_id = job["doc_id"]
+    file_path = job["file_path"]
+    extra_metadata = job["metadata"]
+
+    with trace("ingest_job", job_id=job_id, doc_id=doc_id):
+        for stage in pending_stages(job):
+            update_job(job_id, current_stage=stage)
+
+            if stage == "partition":
+                save_stage_output(job_id, stage, partition_file(file_path))
+
+            elif stage == "summarize":
+                elements = load_stage_output(job_id, "partition")
+                chunks = build_chunks(file_path, elements)
+                # A filename differing from the file's means the title was generated before an interruption
+                if extra_metadata["filename"] == os.path.basename(file_path):
+                    # The title comes from the extracted text and summaries, not a second partition pass
+                    try:
+                        title = generate_document_title(file_path, [chunk["text"] for chunk in chunks])
+                    except Exception:
+                        title = extra_metadata["title"]
+                    extra_metadata["title"] = title
+                    extra_metadata["filename"] = title_filename(file_path, title)
+                    # The new name is persisted before the file moves, so a retry finishes the same rename
+                    update_job(job_id, metadata=extra_metadata)
+                file_path = rename_to_title(file_path, extra_metadata["filename"])
+                update_job(job_id, file_path=file_path)
+                save_stage_output(job_id, stage, chunks)
+
+            elif stage == "embed":
+                chunks = load_stage_output(job_id, "summarize")
+                save_stage_output(job_id, stage, {"model": get_embedding_model_key(), "vectors": embed_chunks(chunks)})
+
+            elif stage == "index":
+                chunks = load_stage_output(job_id, "summarize")
+                embedded = load_stage_output(job_id, "embed")
+                if not isinstance(embedded, dict):
+                    # Checkpoints from before re-indexing existed hold a bare list of vectors of an unknown model
+                    embedded = {"model": get_embedding_model_key(), "vectors": embed_chunks(chunks)}
+                # Vectors of a model the active collection has moved away from are embedded again
+                index_chunks(doc_id, chunks, embedded["vectors"], embedded["model"], extra_metadata=extra_metadata)
+                save_document(dict(extra_metadata, doc_id=doc_id))
+                save_stage_output(job_id, stage, {"chunks": len(chunks)})
+
+    complete_job(job_id)
 
 @docs_bp.route("/upload_page", methods=["GET", "POST"])
 def upload_page():
@@ -59,38 +136,26 @@ def upload_page():
         temp_file_path = os.path.join(folder, temp_filename)
         file.save(temp_file_path)
 
-        try:
-            title = generate_document_title(temp_file_path)
-        except Exception:
-            title = file.filename
-
-        import re
-        sanitized_title = re.sub(r'[^a-zA-Z0-9_-]', '_', title)
-        ext = os.path.splitext(file.filename)[1].lower()
-        new_filename = sanitized_title + ext
-        new_file_path = os.path.join(folder, new_filename)
-        os.rename(temp_file_path, new_file_path)
-
         doc_id = str(uuid.uuid4())
         uploader = session.get("user", "unknown")
         upload_time = now.isoformat()
         upload_display = now.strftime("%H:%M")
+        ext = os.path.splitext(file.filename)[1].lower()
+        # The title and filename are replaced once the partition stage generates a title
         extra_metadata = {
-            "title": title,
+            "title": file.filename,
             "uploader": uploader,
             "upload_time": upload_time,
             "upload_display": upload_display,
             "folder": relative_folder,
-            "filename": new_filename,
-            "ext": ext
+            "filename": temp_filename,
+            "ext": ext,
+            "content_hash": file_hash(temp_file_path)
         }
 
-        try:
-            # Process synchronously so we know it's fully done
-            process_document(new_file_path, doc_id, extra_metadata)
-            flash(f"Document '{title}' has finished uploading and embedding!", "success")
-        except Exception as e:
-            flash(f"Error processing document: {str(e)}", "error")
+        # Ingestion runs in the background worker pool; progress is at /jobs/<job_id>
+        job_id = create_job(doc_id, temp_file_path, extra_metadata)
+        flash(f"Document '{file.filename}' has been queued for processing (job {job_id}).", "success")
 
         # Move the user directly to the Documents tab in Knowledge
         return redirect(url_for("main.knowledge"))
@@ -101,11 +166,8 @@ def document_delete(doc_id):
     if "user" not in session:
         return redirect(url_for("auth.login"))
     try:
-        results = collection.get(where={"doc_id": doc_id})
-        if results and "ids" in results:
-            to_delete = results["ids"]
-            collection.delete(ids=to_delete)
-        remove_metadata(doc_id)
+        delete_document_chunks(doc_id)
+        remove_document(doc_id)
         flash("Document deleted successfully.", "success")
         return redirect(url_for("main.knowledge"))
     except Exception as e:
@@ -121,11 +183,28 @@ def uploaded_file(filename):
     absolute_path = os.path.join(os.getcwd(), UPLOAD_FOLDER)
     return send_from_directory(absolute_path, filename)
 
-def get_all_documents():
-    with open(METADATA_FILE, "r") as f:
-        docs = json.load(f)
-    # Sort by full upload timestamp (ISO format) descending
-    docs = sorted(docs, key=lambda x: x.get("upload_time", ""), reverse=True)
+def get_documents(page=1, per_page=DOCUMENTS_PER_PAGE, folder=None, uploader=None, ext=None):
+    """
+    Returns one page of the catalog, newest first, and the total number of
+    documents matching the filters.
+    """
+    conditions = []
+    params = []
+    for column, value in (("folder", folder), ("uploader", uploader), ("ext", ext)):
+        if value:
+            conditions.append(f"{column} = ?")
+            params.append(value)
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+
+    with get_connection(DOCS_DB) as conn:
+        cur = conn.cursor()
+        cur.execute(f"SELECT COUNT(*) FROM documents {where}", params)
+        total = cur.fetchone()[0]
+        cur.execute(
+            f"SELECT metadata FROM documents {where} ORDER BY upload_time DESC LIMIT ? OFFSET ?",
+            params + [per_page, (max(page, 1) - 1) * per_page]
+        )
+        docs = [json.loads(row[0]) for row in cur.fetchall()]
     for doc in docs:
         ext = doc.get("ext", "")
         # For PDFs and DOCX files, show a link in the UI
@@ -133,4 +212,14 @@ def get_all_documents():
             doc["display"] = "link"
         else:
             doc["display"] = "text"
-    return docs
+    return docs, total
+
+def get_document_filters():
+    """Returns the distinct folders, uploaders and extensions for the catalog filter controls."""
+    filters = {}
+    with get_connection(DOCS_DB) as conn:
+        cur = conn.cursor()
+        for column in ("folder", "uploader", "ext"):
+            cur.execute(f"SELECT DISTINCT {column} FROM documents WHERE {column} IS NOT NULL AND {column} != '' ORDER BY {column}")
+            filters[column] = [row[0] for row in cur.fetchall()]
+    return filters
@@ -0,0 +1,218 @@
+import os
+import json
+import uuid
+import shutil
+import datetime
+import threading
+import psutil
+from flask import Blueprint, jsonify, session
+
+from app.database_setup import JOBS_DB
+from config import INGEST_WORKERS, JOB_POLL_INTERVAL, JOBS_DIR
+from sqlite_pool import get_connection
+
+jobs_bp = Blueprint('jobs', __name__)
+
+# Ingestion stages in the order they run
+JOB_STAGES = ["partition", "summarize", "embed", "index"]
+
+_workers = []
+_workers_lock = threading.Lock()
+_wakeup = threading.Event()
+
+JOB_COLUMNS = "id, doc_id, file_path, metadata, status, stage, current_stage, error, created_at, updated_at"
+
+def _now():
+    return datetime.datetime.utcnow().isoformat()
+
+def _row_to_job(row):
+    return {
+        "id": row[0],
+        "doc_id": row[1],
+        "file_path": row[2],
+        "metadata": json.loads(row[3]),
+        "status": row[4],
+        "stage": row[5],
+        "current_stage": row[6],
+        "error": row[7],
+        "created_at": row[8],
+        "updated_at": row[9]
+    }
+
+def create_job(doc_id, file_path, metadata):
+    job_id = str(uuid.uuid4())
+    now = _now()
+    with get_connection(JOBS_DB) as conn:
+        cur = conn.cursor()
+        cur.execute(
+            "INSERT INTO jobs (id, doc_id, file_path, metadata, status, created_at, updated_at) "
+            "VALUES (?, ?, ?, ?, 'queued', ?, ?)",
+            (job_id, doc_id, file_path, json.dumps(metadata), now, now)
+        )
+        conn.commit()
+    _wakeup.set()
+    return job_id
+
+def get_job(job_id):
+    with get_connection(JOBS_DB) as conn:
+        cur = conn.cursor()
+        cur.execute(f"SELECT {JOB_COLUMNS} FROM jobs WHERE id = ?", (job_id,))
+        row = cur.fetchone()
+        if row:
+            return _row_to_job(row)
+    return None
+
+def get_active_jobs():
+    with get_connection(JOBS_DB) as conn:
+        cur = conn.cursor()
+        cur.execute(
+            f"SELECT {JOB_COLUMNS} FROM jobs WHERE status IN ('queued', 'running', 'failed') "
+            "ORDER BY created_at DESC"
+        )
+        return [_row_to_job(row) for row in cur.fetchall()]
+
+def update_job(job_id, **fields):
+    if "metadata" in fields:
+        fields["metadata"] = json.dumps(fields["metadata"])
+    fields["updated_at"] = _now()
+    assignments = ", ".join(f"{name} = ?" for name in fields)
+    with get_connection(JOBS_DB) as conn:
+        cur = conn.cursor()
+        cur.execute(f"UPDATE jobs SET {assignments} WHERE id = ?", (*fields.values(), job_id))
+        conn.commit()
+
+def pending_stages(job):
+    """Returns the stages of a job that still have to run."""
+    if not job["stage"]:
+        return list(JOB_STAGES)
+    return JOB_STAGES[JOB_STAGES.index(job["stage"]) + 1:]
+
+def job_progress(job):
+    """Reports each stage as 'done', 'running', 'failed' or 'pending'."""
+    remaining = pending_stages(job)
+    progress = {}
+    for stage in JOB_STAGES:
+        if stage not in remaining:
+            progress[stage] = "done"
+        elif stage == job["current_stage"] and job["status"] in ("running", "failed"):
+            progress[stage] = job["status"]
+        else:
+            progress[stage] = "pending"
+    return progress
+
+def save_stage_output(job_id, stage, data):
+    """Checkpoints a stage's output and marks the stage as finished."""
+    job_dir = os.path.join(JOBS_DIR, job_id)
+    os.makedirs(job_dir, exist_ok=True)
+    path = os.path.join(job_dir, f"{stage}.json")
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(data, f)
+    os.replace(tmp_path, path)
+    update_job(job_id, stage=stage, current_stage=None)
+
+def load_stage_output(job_id, stage):
+    with open(os.path.join(JOBS_DIR, job_id, f"{stage}.json"), "r") as f:
+        return json.load(f)
+
+def complete_job(job_id):
+    update_job(job_id, status="done", current_stage=None, error=None)
+    shutil.rmtree(os.path.join(JOBS_DIR, job_id), ignore_errors=True)
+
+def fail_job(job_id, error):
+    update_job(job_id, status="failed", error=error)
+
+def retry_job(job_id):
+    update_job(job_id, status="queued", error=None)
+    _wakeup.set()
+
+def claim_next_job():
+    """Atomically moves the oldest queued job to 'running' and returns it."""
+    with get_connection(JOBS_DB) as conn:
+        cur = conn.cursor()
+        # Take the write lock before reading so two workers cannot claim the same job
+        cur.execute("BEGIN IMMEDIATE")
+        cur.execute(f"SELECT {JOB_COLUMNS} FROM jobs WHERE status = 'queued' ORDER BY created_at LIMIT 1")
+        row = cur.fetchone()
+        if row:
+            cur.execute(
+                "UPDATE jobs SET status = 'running', worker_pid = ?, updated_at = ? WHERE id = ?",
+                (os.getpid(), _now(), row[0])
+            )
+    if not row:
+        return None
+    job = _row_to_job(row)
+    job["status"] = "running"
+    return job
+
+def requeue_interrupted_jobs():
+    """
+    Puts jobs that were running in a process that no longer exists back in the queue,
+    so they resume from their last finished stage.
+    """
+    with get_connection(JOBS_DB) as conn:
+        cur = conn.cursor()
+        cur.execute("SELECT id, worker_pid FROM jobs WHERE status = 'running'")
+        for job_id, pid in cur.fetchall():
+            if pid is None or pid == os.getpid() or not psutil.pid_exists(pid):
+                cur.execute(
+                    "UPDATE jobs SET status = 'queued', worker_pid = NULL, updated_at = ? WHERE id = ?",
+                    (_now(), job_id)
+                )
+        conn.commit()
+
+def _worker_loop():
+    # Imported here because app.docs enqueues jobs through this module.
+    from app.docs import process_document
+    while True:
+        job = claim_next_job()
+        if job is None:
+            _wakeup.wait(timeout=JOB_POLL_INTERVAL)
+            _wakeup.clear()
+            continue
+        try:
+            process_document(job)
+        except Exception as e:
+            print(f"[{_now()}] Ingestion job {job['id']} failed: {e}")
+            fail_job(job["id"], str(e))
+
+def start_ingestion_workers(concurrency=INGEST_WORKERS):
+    """Starts the background ingestion worker pool once per process."""
+    with _workers_lock:
+        if _workers:
+            return
+        requeue_interrupted_jobs()
+        for i in range(concurrency):
+            worker = threading.Thread(target=_worker_loop, name=f"ingest-worker-{i}", daemon=True)
+            worker.start()
+            _workers.append(worker)
+
+@jobs_bp.route("/jobs/<job_id>")
+def job_status(job_id):
+    if "user" not in session:
+        return jsonify({"error": "Unauthorized"}), 401
+    job = get_job(job_id)
+    if not job:
+        return jsonify({"error": "Job not found"}), 404
+    return jsonify({
+        "id": job["id"],
+        "doc_id": job["doc_id"],
+        "title": job["metadata"].get("title"),
+        "status": job["status"],
+        "stages": job_progress(job),
+        "error": job["error"],
+        "created_at": job["created_at"],
+        "updated_at": job["updated_at"]
+    })
+
+@jobs_bp.route("/jobs/<job_id>/retry", methods=["POST"])
+def job_retry(job_id):
+    if "user" not in session:
+        return jsonify({"error": "Unauthorized"}), 401
+    job = get_job(job_id)
+    if not job:
+        return jsonify({"error": "Job not found"}), 404
+    if job["status"] != "failed":
+        return jsonify({"error": "Only failed jobs can be retried"}), 400
+    retry_job(job_id)
+    return jsonify({"id": job_id, "status": "queued"})
@@ -1,10 +1,16 @@
 import os
 import json
-from flask import Blueprint, render_template, request, jsonify, redirect, url_for, flash, session
-from database import collection, chroma_client, embedding_function
-from query import generate_answer
-from app.docs import get_all_documents
+from flask import (
+    Blueprint, render_template, request, jsonify, redirect, url_for, flash, session,
+    Response, stream_with_context
+)
+from chroma_restart import restart_chroma_db
+from query import generate_answer, prepare_answer, remember_query, stream_answer
+from scopes import parse_scopes, ScopeError
+from app.docs import get_documents, get_document_filters, DOCUMENTS_PER_PAGE
 from app.wiki import get_all_wiki_pages
+from metrics import render_metrics
+from app.jobs import get_active_jobs, job_progress
 
 main_bp = Blueprint('main', __name__)
 
@@ -21,16 +27,66 @@ def query():
     data = request.json
     if not data or "question" not in data:
         return jsonify({"error": "No question provided"}), 400
+    try:
+        scopes = parse_scopes(data.get("scopes"))
+    except ScopeError as e:
+        return jsonify({"error": str(e)}), 400
 
     question = data["question"]
-    answer = generate_answer(question)
+    answer = generate_answer(question, scopes)
     return jsonify({"answer": answer})
 
+def sse_event(event, data):
+    """Formats one Server-Sent Event with a JSON payload."""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+@main_bp.route("/query/stream", methods=["POST"])
+def query_stream():
+    """
+    Streams an answer as Server-Sent Events: a 'sources' event once retrieval
+    is done, 'token' events as the answer is generated, then a 'done' event.
+    """
+    if "user" not in session:
+        return jsonify({"error": "Unauthorized"}), 401
+    data = request.json
+    if not data or "question" not in data:
+        return jsonify({"error": "No question provided"}), 400
+    try:
+        scopes = parse_scopes(data.get("scopes"))
+    except ScopeError as e:
+        return jsonify({"error": str(e)}), 400
+
+    # Retrieval runs before the response starts, so the state key is set in the session cookie
+    prepared = prepare_answer(data["question"], scopes)
+    remember_query(prepared)
+
+    def events():
+        yield sse_event("sources", prepared["sources"] or [])
+        parts = []
+        try:
+            for text in stream_answer(prepared):
+                parts.append(text)
+                yield sse_event("token", {"text": text})
+        except Exception as e:
+            yield sse_event("error", {"error": str(e)})
+            return
+        yield sse_event("done", {"answer": "".join(parts).strip()})
+
+    return Response(
+        stream_with_context(events()),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@main_bp.route("/metrics")
+def metrics():
+    """Prometheus scrape endpoint for stage latencies, OpenAI usage and cache hit rates."""
+    return Response(render_metrics(), mimetype="text/plain; version=0.0.4")
+
 @main_bp.route("/restart_chroma", methods=["POST"])
 def restart_chroma():
     try:
-        collection.delete()
-        new_collection = chroma_client.get_or_create_collection(name="rag_chunks", embedding_function=embedding_function)
+        restart_chroma_db()
         flash("Chroma collection has been restarted.", "success")
         return redirect(url_for("main.knowledge"))
     except Exception as e:
@@ -41,9 +97,19 @@ def restart_chroma():
 def knowledge():
     if "user" not in session:
         return redirect(url_for("auth.login"))
-    docs = get_all_documents()
+    page = request.args.get("page", 1, type=int)
+    filters = {key: request.args.get(key, "") for key in ("folder", "uploader", "ext")}
+    docs, total = get_documents(page=page, **filters)
+    page_count = max(1, -(-total // DOCUMENTS_PER_PAGE))
     pages = get_all_wiki_pages()
-    return render_template("knowledge.html", docs=docs, pages=pages)
+    jobs = get_active_jobs()
+    for job in jobs:
+        job["stages"] = job_progress(job)
+    return render_template(
+        "knowledge.html", docs=docs, pages=pages, jobs=jobs,
+        doc_total=total, doc_page=page, doc_page_count=page_count,
+        filters=filters, filter_options=get_document_filters()
+    )
     
 @main_bp.errorhandler(500)
 def internal_error(error):
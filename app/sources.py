@@ -3,6 +3,7 @@ import json
 import re
 from flask import Blueprint, render_template, session, redirect, url_for, flash
 from app.wiki import get_wiki_page
+from retrieval_state import load_state
 import markdown  # For wiki content
 from markupsafe import Markup
 
@@ -18,8 +19,9 @@ def sources():
     if "user" not in session:
         return redirect(url_for("auth.login"))
 
-    last_sources = session.get("last_sources")
-    last_query = session.get("last_query")
+    state = load_state(session.get("state_key"))
+    last_sources = state.get("last_sources")
+    last_query = state.get("last_query")
     if not last_sources:
         flash("No source information available.", "info")
         return redirect(url_for("main.index"))
@@ -47,4 +49,6 @@ def sources():
                 source["full_text"] = "Wiki page not found."
         sources_list.append(source)
 
-    return render_template("sources.html", sources=sources_list, last_query=last_query)
+    return render_template(
+        "sources.html", sources=sources_list, last_query=last_query, last_answer=state.get("last_answer")
+    )
@@ -1,19 +1,22 @@
 import os
+import re
+import hashlib
 import datetime
-import sqlite3
 from flask import Blueprint, render_template, request, redirect, url_for, flash, session
 from markupsafe import Markup
 import markdown
 
-from chunk_and_embed import embed_text
-from database import collection
+from chunk_and_embed import iter_chunks, embed_chunks, add_chunks, update_chunk_metadata, delete_chunks
+from database import get_collection, get_embedding_model_key
+from metrics import timed, trace
 # We now import the WIKI_DB constant from database_setup
 from app.database_setup import WIKI_DB
+from sqlite_pool import get_connection
 
 wiki_bp = Blueprint('wiki', __name__)
 
 def get_all_wiki_pages():
-    with sqlite3.connect(WIKI_DB) as conn:
+    with get_connection(WIKI_DB) as conn:
         cur = conn.cursor()
         cur.execute("SELECT id, title, folder, updated_at, last_edited_by FROM wiki ORDER BY updated_at DESC")
         rows = cur.fetchall()
@@ -29,7 +32,7 @@ def get_all_wiki_pages():
     return pages
 
 def get_wiki_page(page_id):
-    with sqlite3.connect(WIKI_DB) as conn:
+    with get_connection(WIKI_DB) as conn:
         cur = conn.cursor()
         cur.execute("SELECT id, title, content, folder, updated_at, last_edited_by FROM wiki WHERE id = ?", (page_id,))
         row = cur.fetchone()
@@ -47,7 +50,7 @@ def get_wiki_page(page_id):
 def save_wiki_page(title, content, folder, page_id=None):
     now = datetime.datetime.utcnow().strftime("%Y-%m-%d %H:%M")
     editor = session.get("user", "unknown")
-    with sqlite3.connect(WIKI_DB) as conn:
+    with get_connection(WIKI_DB) as conn:
         cur = conn.cursor()
         if page_id:
             cur.execute(
@@ -64,21 +67,118 @@ def save_wiki_page(title, content, folder, page_id=None):
             conn.commit()
             return cur.lastrowid
 
+HEADING_RE = re.compile(r"^#{1,6}\s+\S")
+
+def markdown_pieces(content):
+    """Yields heading and paragraph pieces of a markdown page, ignoring '#' lines inside code fences."""
+    paragraph = []
+    in_fence = False
+
+    def flush():
+        text = "\n".join(paragraph).strip()
+        paragraph.clear()
+        if text:
+            return {"category": "NarrativeText", "text": text, "page": None}
+        return None
+
+    for line in content.splitlines():
+        if line.strip().startswith("```"):
+            in_fence = not in_fence
+        if not in_fence and HEADING_RE.match(line):
+            piece = flush()
+            if piece:
+                yield piece
+            yield {"category": "Title", "text": line.strip(), "page": None}
+        elif not in_fence and not line.strip():
+            piece = flush()
+            if piece:
+                yield piece
+        else:
+            paragraph.append(line)
+    piece = flush()
+    if piece:
+        yield piece
+
+def wiki_section_chunks(wiki_id, title, content):
+    """
+    Splits a wiki page into token-bounded chunks by markdown heading. Each chunk's
+    id is derived from a hash of its text, so unchanged sections keep their id.
+    """
+    chunks = []
+    seen = {}
+    for index, chunk in enumerate(iter_chunks(markdown_pieces(content))):
+        section_hash = hashlib.sha256(chunk["text"].encode("utf-8")).hexdigest()
+        occurrence = seen.get(section_hash, 0)
+        seen[section_hash] = occurrence + 1
+        chunk_id = f"wiki-{wiki_id}-{section_hash[:16]}" + (f"-{occurrence}" if occurrence else "")
+        metadata = {
+            "type": "wiki",
+            "title": title,
+            "wiki_id": wiki_id,
+            "section_index": index,
+            "section_hash": section_hash,
+            "n_tokens": chunk["n_tokens"]
+        }
+        if chunk["section"]:
+            metadata["section"] = chunk["section"]
+        chunks.append({"id": chunk_id, "text": chunk["text"], "n_tokens": chunk["n_tokens"], "metadata": metadata})
+    return chunks
+
+def get_wiki_chunk_ids(wiki_id):
+    """Returns the ids of every stored chunk of a wiki page, including the legacy whole-page id."""
+    collection = get_collection()
+    stored = collection.get(where={"$or": [{"wiki_id": wiki_id}, {"wiki_id": str(wiki_id)}]}, include=["metadatas"])
+    chunk_ids = dict(zip(stored["ids"], stored["metadatas"]))
+    legacy_id = f"wiki-{wiki_id}"
+    if legacy_id not in chunk_ids and collection.get(ids=[legacy_id])["ids"]:
+        chunk_ids[legacy_id] = {}
+    return chunk_ids
+
 def embed_wiki_page(wiki_id, title, content):
-    vector = embed_text(content)
-    embedding_id = f"wiki-{wiki_id}"
+    """
+    Embeds a wiki page section by section. Only sections whose content hash changed
+    are embedded and added; removed sections are deleted, and unchanged sections
+    only get their metadata refreshed when the title or position changed.
+    """
+    wiki_id = int(wiki_id)
+    with trace("wiki_embed", wiki_id=wiki_id):
+        _embed_wiki_sections(wiki_id, title, content)
+
+def _embed_wiki_sections(wiki_id, title, content):
+    with timed("wiki_split"):
+        chunks = wiki_section_chunks(wiki_id, title, content)
+        existing = get_wiki_chunk_ids(wiki_id)
+
+    new_chunks = [chunk for chunk in chunks if chunk["id"] not in existing]
+    moved_chunks = [
+        chunk for chunk in chunks
+        if chunk["id"] in existing and existing[chunk["id"]] != chunk["metadata"]
+    ]
+    current_ids = {chunk["id"] for chunk in chunks}
+    removed_ids = [chunk_id for chunk_id in existing if chunk_id not in current_ids]
+
     try:
-        collection.delete(ids=[embedding_id])
+        delete_chunks(removed_ids)
     except Exception as e:
         print(f"Warning: could not delete existing wiki embedding: {e}")
-    metadata = {"type": "wiki", "title": title, "wiki_id": wiki_id}
-    collection.add(
-        documents=[content],
-        embeddings=[vector],
-        ids=[embedding_id],
-        metadatas=[metadata]
+    update_chunk_metadata(
+        [chunk["id"] for chunk in moved_chunks],
+        [chunk["text"] for chunk in moved_chunks],
+        [chunk["metadata"] for chunk in moved_chunks]
+    )
+    if new_chunks:
+        model_key = get_embedding_model_key()
+        add_chunks(
+            [chunk["text"] for chunk in new_chunks],
+            embed_chunks(new_chunks),
+            [chunk["id"] for chunk in new_chunks],
+            [chunk["metadata"] for chunk in new_chunks],
+            model_key
+        )
+    print(
+        f"Wiki page '{title}' (ID: {wiki_id}) embedded: {len(new_chunks)} new, "
+        f"{len(chunks) - len(new_chunks)} unchanged, {len(removed_ids)} removed sections."
     )
-    print(f"Wiki page '{title}' (ID: {wiki_id}) embedded successfully.")
 
 @wiki_bp.route("/wiki/view/<int:page_id>")
 def wiki_view(page_id):
@@ -137,12 +237,11 @@ def wiki_delete(page_id):
     if not page:
         flash("Wiki page not found.", "error")
         return redirect(url_for("main.knowledge"))
-    embedding_id = f"wiki-{page_id}"
     try:
-        collection.delete(ids=[embedding_id])
+        delete_chunks(list(get_wiki_chunk_ids(page_id)))
     except Exception as e:
         print(f"Warning: could not delete existing wiki embedding: {e}")
-    with sqlite3.connect(WIKI_DB) as conn:
+    with get_connection(WIKI_DB) as conn:
         cur = conn.cursor()
         cur.execute("DELETE FROM wiki WHERE id = ?", (page_id,))
         conn.commit()
@@ -0,0 +1,103 @@
+# asgi.py
+"""
+ASGI entry point. The chat endpoints (/query and /query/stream) are served by
+native async handlers, so a single process can keep hundreds of questions in
+flight while they wait on OpenAI. Every other route is served by the Flask app
+through a WSGI adapter.
+
+Run with:
+    uvicorn asgi:app --host 0.0.0.0 --port 5782
+"""
+import asyncio
+
+import flask
+from asgiref.wsgi import WsgiToAsgi
+from starlette.applications import Starlette
+from starlette.responses import JSONResponse, StreamingResponse
+from starlette.routing import Mount, Route
+
+from app import create_app
+from app.main import sse_event
+from query import generate_answer_async, prepare_answer_async, remember_query, stream_answer_async
+from scopes import parse_scopes, ScopeError
+
+flask_app = create_app()
+
+def open_flask_session(request):
+    """Loads the Flask session for a Starlette request using the app's session interface."""
+    with flask_app.test_request_context("/", headers={"Cookie": request.headers.get("cookie", "")}):
+        return flask_app.session_interface.open_session(flask_app, flask.request)
+
+def save_flask_session(flask_session, response):
+    """Writes the Flask session back and copies its Set-Cookie headers onto a Starlette response."""
+    flask_response = flask_app.response_class()
+    with flask_app.test_request_context("/"):
+        flask_app.session_interface.save_session(flask_app, flask_session, flask_response)
+    for value in flask_response.headers.getlist("Set-Cookie"):
+        response.headers.append("set-cookie", value)
+    return response
+
+async def read_question(request):
+    """
+    Returns (question, scopes, error_response) for a query request; error_response
+    is a 400 when the question is missing or the scopes are malformed.
+    """
+    try:
+        data = await request.json()
+    except Exception:
+        data = None
+    if not data or "question" not in data:
+        return None, None, JSONResponse({"error": "No question provided"}, status_code=400)
+    try:
+        scopes = parse_scopes(data.get("scopes"))
+    except ScopeError as e:
+        return None, None, JSONResponse({"error": str(e)}, status_code=400)
+    return data["question"], scopes, None
+
+async def query(request):
+    flask_session = open_flask_session(request)
+    if "user" not in flask_session:
+        return JSONResponse({"error": "Unauthorized"}, status_code=401)
+    question, scopes, error = await read_question(request)
+    if error is not None:
+        return error
+
+    answer = await generate_answer_async(question, flask_session, scopes)
+    return save_flask_session(flask_session, JSONResponse({"answer": answer}))
+
+async def query_stream(request):
+    flask_session = open_flask_session(request)
+    if "user" not in flask_session:
+        return JSONResponse({"error": "Unauthorized"}, status_code=401)
+    question, scopes, error = await read_question(request)
+    if error is not None:
+        return error
+
+    # Retrieval runs before the response starts, so the state key is set in the session cookie
+    prepared = await prepare_answer_async(question, scopes)
+    await asyncio.to_thread(remember_query, prepared, flask_session)
+
+    async def events():
+        yield sse_event("sources", prepared["sources"] or [])
+        parts = []
+        try:
+            async for text in stream_answer_async(prepared, flask_session):
+                parts.append(text)
+                yield sse_event("token", {"text": text})
+        except Exception as e:
+            yield sse_event("error", {"error": str(e)})
+            return
+        yield sse_event("done", {"answer": "".join(parts).strip()})
+
+    response = StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+    return save_flask_session(flask_session, response)
+
+app = Starlette(routes=[
+    Route("/query", query, methods=["POST"]),
+    Route("/query/stream", query_stream, methods=["POST"]),
+    Mount("/", app=WsgiToAsgi(flask_app)),
+])
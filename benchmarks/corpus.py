@@ -0,0 +1,211 @@
+# Synthetic PDF, DOCX, TXT and XLSX documents for the benchmarks. Files are written by
+# hand (minimal but valid PDF / OOXML), so no document-authoring packages are needed.
+import os
+import random
+import zipfile
+from xml.sax.saxutils import escape
+
+WORDS = (
+    "fund portfolio equity bond yield duration credit spread liquidity allocation benchmark "
+    "volatility risk return dividend hedge currency exposure mandate custody settlement "
+    "compliance regulation disclosure fee performance index derivative swap option future "
+    "maturity coupon rating issuer sector emerging market treasury inflation rebalancing "
+    "drawdown attribution valuation subscription redemption prospectus investor client"
+).split()
+
+# Documents per format and pages (or sheet blocks) per document
+SIZES = {
+    "small": {"docs": 2, "pages": 2},
+    "medium": {"docs": 4, "pages": 10},
+    "large": {"docs": 8, "pages": 40},
+}
+FORMATS = ("pdf", "docx", "txt", "xlsx")
+PARAGRAPHS_PER_PAGE = 6
+
+def sentence(rng: random.Random) -> str:
+    words = [rng.choice(WORDS) for _ in range(rng.randint(8, 18))]
+    # An identifier per sentence gives the lexical index something exact to match
+    words.insert(rng.randrange(len(words)), f"REF{rng.randrange(10 ** 6):06d}")
+    text = " ".join(words)
+    return text[0].upper() + text[1:] + "."
+
+def paragraph(rng: random.Random) -> str:
+    return " ".join(sentence(rng) for _ in range(rng.randint(3, 6)))
+
+def document_pages(rng: random.Random, pages: int):
+    """Returns [(heading, [paragraphs])] for each page."""
+    return [
+        (f"Section {page + 1}: {rng.choice(WORDS).capitalize()} {rng.choice(WORDS)}",
+         [paragraph(rng) for _ in range(PARAGRAPHS_PER_PAGE)])
+        for page in range(pages)
+    ]
+
+def write_txt(path, pages):
+    with open(path, "w") as f:
+        for heading, paragraphs in pages:
+            f.write(heading + "\n\n" + "\n\n".join(paragraphs) + "\n\n")
+
+def _wrap(text, width=90):
+    lines, line = [], ""
+    for word in text.split():
+        if line and len(line) + len(word) + 1 > width:
+            lines.append(line)
+            line = word
+        else:
+            line = f"{line} {word}".strip()
+    if line:
+        lines.append(line)
+    return lines
+
+def _pdf_escape(text):
+    return text.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+
+def write_pdf(path, pages):
+    """Writes one PDF page per synthetic page, with Helvetica text lines."""
+    objects = [
+        "<< /Type /Catalog /Pages 2 0 R >>",
+        None,  # Page tree, filled in once the page object numbers are known
+        "<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>",
+    ]
+    page_refs = []
+    for heading, paragraphs in pages:
+        lines = [heading, ""]
+        for text in paragraphs:
+            lines.extend(_wrap(text) + [""])
+        stream = "BT /F1 9 Tf 40 800 Td 11 TL " + " ".join(
+            f"({_pdf_escape(line)}) Tj T*" for line in lines[:70]
+        ) + " ET"
+        objects.append(f"<< /Length {len(stream)} >>\nstream\n{stream}\nendstream")
+        objects.append(
+            f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] "
+            f"/Resources << /Font << /F1 3 0 R >> >> /Contents {len(objects)} 0 R >>"
+        )
+        page_refs.append(f"{len(objects)} 0 R")
+    objects[1] = f"<< /Type /Pages /Kids [{' '.join(page_refs)}] /Count {len(page_refs)} >>"
+
+    out = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(len(out))
+        out += f"{number} 0 obj\n{body}\nendobj\n".encode("latin-1")
+    xref = len(out)
+    out += f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n".encode("latin-1")
+    for offset in offsets:
+        out += f"{offset:010d} 00000 n \n".encode("latin-1")
+    out += f"trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF\n".encode("latin-1")
+    with open(path, "wb") as f:
+        f.write(out)
+
+DOCX_CONTENT_TYPES = """<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">
+<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>
+<Default Extension="xml" ContentType="application/xml"/>
+<Override PartName="/word/document.xml" ContentType="application/vnd.openxmlformats-officedocument.wordprocessingml.document.main+xml"/>
+<Override PartName="/word/styles.xml" ContentType="application/vnd.openxmlformats-officedocument.wordprocessingml.styles+xml"/>
+</Types>"""
+
+DOCX_RELS = """<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">
+<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" Target="word/document.xml"/>
+</Relationships>"""
+
+DOCX_DOCUMENT_RELS = """<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">
+<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/styles" Target="styles.xml"/>
+</Relationships>"""
+
+DOCX_STYLES = """<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<w:styles xmlns:w="http://schemas.openxmlformats.org/wordprocessingml/2006/main">
+<w:style w:type="paragraph" w:default="1" w:styleId="Normal"><w:name w:val="Normal"/></w:style>
+<w:style w:type="paragraph" w:styleId="Heading1"><w:name w:val="heading 1"/><w:basedOn w:val="Normal"/></w:style>
+</w:styles>"""
+
+def write_docx(path, pages):
+    body = []
+    for heading, paragraphs in pages:
+        body.append(f'<w:p><w:pPr><w:pStyle w:val="Heading1"/></w:pPr><w:r><w:t>{escape(heading)}</w:t></w:r></w:p>')
+        body.extend(f"<w:p><w:r><w:t>{escape(text)}</w:t></w:r></w:p>" for text in paragraphs)
+    document = (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<w:document xmlns:w="http://schemas.openxmlformats.org/wordprocessingml/2006/main"><w:body>'
+        + "".join(body) + "</w:body></w:document>"
+    )
+    with zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED) as z:
+        z.writestr("[Content_Types].xml", DOCX_CONTENT_TYPES)
+        z.writestr("_rels/.rels", DOCX_RELS)
+        z.writestr("word/_rels/document.xml.rels", DOCX_DOCUMENT_RELS)
+        z.writestr("word/styles.xml", DOCX_STYLES)
+        z.writestr("word/document.xml", document)
+
+XLSX_CONTENT_TYPES = """<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">
+<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>
+<Default Extension="xml" ContentType="application/xml"/>
+<Override PartName="/xl/workbook.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>
+<Override PartName="/xl/worksheets/sheet1.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>
+</Types>"""
+
+XLSX_RELS = """<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">
+<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" Target="xl/workbook.xml"/>
+</Relationships>"""
+
+XLSX_WORKBOOK = """<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">
+<sheets><sheet name="Holdings" sheetId="1" r:id="rId1"/></sheets>
+</workbook>"""
+
+XLSX_WORKBOOK_RELS = """<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">
+<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet" Target="worksheets/sheet1.xml"/>
+</Relationships>"""
+
+def write_xlsx(path, rng: random.Random, pages: int):
+    """Writes a holdings-style sheet with 20 rows per page of size."""
+    def cell(ref, value):
+        if isinstance(value, str):
+            return f'<c r="{ref}" t="inlineStr"><is><t>{escape(value)}</t></is></c>'
+        return f'<c r="{ref}"><v>{value}</v></c>'
+
+    header = ["Security", "Sector", "Reference", "Weight", "Yield"]
+    rows = [header] + [
+        [f"{rng.choice(WORDS).capitalize()} {rng.choice(WORDS)}", rng.choice(WORDS),
+         f"REF{rng.randrange(10 ** 6):06d}", round(rng.uniform(0.1, 5.0), 2), round(rng.uniform(0.0, 9.0), 2)]
+        for _ in range(pages * 20)
+    ]
+    xml_rows = "".join(
+        f'<row r="{r}">' + "".join(cell(f"{'ABCDE'[c]}{r}", value) for c, value in enumerate(row)) + "</row>"
+        for r, row in enumerate(rows, start=1)
+    )
+    sheet = (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main">'
+        f"<sheetData>{xml_rows}</sheetData></worksheet>"
+    )
+    with zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED) as z:
+        z.writestr("[Content_Types].xml", XLSX_CONTENT_TYPES)
+        z.writestr("_rels/.rels", XLSX_RELS)
+        z.writestr("xl/workbook.xml", XLSX_WORKBOOK)
+        z.writestr("xl/_rels/workbook.xml.rels", XLSX_WORKBOOK_RELS)
+        z.writestr("xl/worksheets/sheet1.xml", sheet)
+
+def build_corpus(directory: str, size: str = "small", formats=FORMATS, seed: int = 0):
+    """
+    Writes a synthetic corpus under directory and returns (files, sentences): the file
+    descriptions ({"path", "format", "size"}) and sample sentences to derive questions from.
+    """
+    rng = random.Random(f"{seed}-{size}")
+    spec = SIZES[size]
+    os.makedirs(directory, exist_ok=True)
+    files, sentences = [], []
+    for fmt in formats:
+        for i in range(spec["docs"]):
+            path = os.path.join(directory, f"{size}-{fmt}-{i:03d}.{fmt}")
+            if fmt == "xlsx":
+                write_xlsx(path, rng, spec["pages"])
+            else:
+                pages = document_pages(rng, spec["pages"])
+                {"pdf": write_pdf, "docx": write_docx, "txt": write_txt}[fmt](path, pages)
+                sentences.extend(paragraphs[0].split(". ")[0] for _, paragraphs in pages)
+            files.append({"path": path, "format": fmt, "size": size})
+    return files, sentences
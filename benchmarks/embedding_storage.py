@@ -0,0 +1,133 @@
+#!/usr/bin/env python
+# Embedding size benchmark: memory, disk and recall@K of reduced dimensions (Matryoshka
+# truncation) and float16/int8 storage of the NumPy index, against full-size float32 vectors. Ground truth is
+# exact cosine search over the full-size vectors; every configuration is searched exactly
+# too, so the recall loss comes from the vectors alone, not from HNSW.
+#
+# Vectors come from an embedding cache of real text-embedding-3 vectors when one is given,
+# otherwise from a synthetic clustered corpus whose variance decays over the dimensions
+# (recall on synthetic vectors is only indicative).
+#
+#   python benchmarks/embedding_storage.py --cache-db embedding_cache.db --queries 200
+#   python benchmarks/embedding_storage.py --vectors 20000 --chroma --output storage.json
+import os
+import sys
+import json
+import shutil
+import sqlite3
+import argparse
+import tempfile
+
+import numpy as np
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, REPO_DIR)
+
+from quantization import STORAGE_DTYPES, truncate, quantize_int8, dequantize_int8, bytes_per_vector
+
+def load_cached_vectors(path: str, model: str, limit: int) -> np.ndarray:
+    """Full-size vectors of one model from an embedding cache database."""
+    conn = sqlite3.connect(path)
+    rows = conn.execute("SELECT vector FROM embeddings WHERE model = ? LIMIT ?", (model, limit)).fetchall()
+    conn.close()
+    return np.asarray([np.frombuffer(blob, dtype=np.float32) for (blob,) in rows], dtype=np.float32)
+
+def synthetic_vectors(n: int, dimensions: int, seed: int = 0) -> np.ndarray:
+    """Clustered unit vectors whose leading components carry most of the variance."""
+    rng = np.random.default_rng(seed)
+    scale = 1.0 / np.sqrt(1.0 + np.arange(dimensions) / 64.0)
+    centers = rng.standard_normal((max(n // 50, 8), dimensions)) * scale
+    vectors = centers[rng.integers(len(centers), size=n)] + 0.6 * rng.standard_normal((n, dimensions)) * scale
+    return truncate(vectors, dimensions)
+
+def stored(vectors: np.ndarray, dtype: str) -> np.ndarray:
+    """The vectors as they come back from the given storage format."""
+    if dtype == "float16":
+        return vectors.astype(np.float16).astype(np.float32)
+    if dtype == "int8":
+        return dequantize_int8(*quantize_int8(vectors))
+    return vectors
+
+def top_k(corpus: np.ndarray, queries: np.ndarray, k: int) -> np.ndarray:
+    scores = queries @ corpus.T
+    return np.argpartition(-scores, k, axis=1)[:, :k]
+
+def recall(found: np.ndarray, truth: np.ndarray) -> float:
+    k = truth.shape[1]
+    return float(np.mean([len(set(a) & set(b)) / k for a, b in zip(found, truth)]))
+
+def directory_size(path: str) -> int:
+    return sum(os.path.getsize(os.path.join(root, name)) for root, _, files in os.walk(path) for name in files)
+
+def chroma_disk_bytes(vectors: np.ndarray) -> int:
+    """Size on disk of a persistent Chroma collection (HNSW, cosine) holding the vectors."""
+    import chromadb
+    path = tempfile.mkdtemp(prefix="rag-storage-")
+    try:
+        client = chromadb.PersistentClient(path=path)
+        collection = client.create_collection("bench", metadata={"hnsw:space": "cosine"})
+        for start in range(0, len(vectors), 5000):
+            batch = vectors[start:start + 5000]
+            collection.add(ids=[str(i) for i in range(start, start + len(batch))], embeddings=batch.tolist())
+        del collection, client
+        return directory_size(path)
+    finally:
+        shutil.rmtree(path, ignore_errors=True)
+
+def run(args) -> dict:
+    if args.cache_db:
+        vectors = load_cached_vectors(args.cache_db, args.model, args.vectors + args.queries)
+        source = f"{args.cache_db} ({args.model})"
+        if len(vectors) <= args.queries:
+            sys.exit(f"Only {len(vectors)} vectors of {args.model} in {args.cache_db}.")
+    else:
+        vectors = synthetic_vectors(args.vectors + args.queries, args.full_dimensions)
+        source = "synthetic"
+    vectors = truncate(vectors, vectors.shape[1])
+    corpus, queries = vectors[args.queries:], vectors[:args.queries]
+    full = corpus.shape[1]
+    truth = top_k(corpus, queries, args.k)
+    print(f"{len(corpus)} vectors of {full} dimensions ({source}), {len(queries)} queries, recall@{args.k}")
+
+    results = []
+    for dimensions in [d for d in [full] + args.dimensions if d <= full]:
+        reduced_corpus, reduced_queries = truncate(corpus, dimensions), truncate(queries, dimensions)
+        chroma_bytes = chroma_disk_bytes(reduced_corpus) if args.chroma else None
+        for dtype in STORAGE_DTYPES:
+            found = top_k(stored(reduced_corpus, dtype), reduced_queries, args.k)
+            row = {
+                "dimensions": dimensions,
+                "dtype": dtype,
+                f"recall@{args.k}": round(recall(found, truth), 4),
+                "memory_mb": round(bytes_per_vector(dimensions, dtype) * len(corpus) / 2 ** 20, 2),
+            }
+            # Chroma always stores float32, so its size only depends on the dimensions
+            if chroma_bytes is not None and dtype == "float32":
+                row["chroma_disk_mb"] = round(chroma_bytes / 2 ** 20, 2)
+            results.append(row)
+            chroma = f", Chroma {row['chroma_disk_mb']} MB" if "chroma_disk_mb" in row else ""
+            print(f"  {dimensions:>5} {dtype:<8} recall {row[f'recall@{args.k}']:.4f}  "
+                  f"NumPy index {row['memory_mb']} MB{chroma}")
+    return {"source": source, "vectors": len(corpus), "queries": len(queries), "k": args.k, "results": results}
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Compare embedding dimensions and storage formats.")
+    parser.add_argument("--cache-db", help="Take vectors from this embedding cache instead of generating them")
+    parser.add_argument("--model", default="text-embedding-3-large", help="Model key of the cached vectors")
+    parser.add_argument("--vectors", type=int, default=10000, help="Corpus vectors")
+    parser.add_argument("--queries", type=int, default=200, help="Query vectors, held out from the corpus")
+    parser.add_argument("--full-dimensions", type=int, default=3072, help="Size of synthetic vectors")
+    parser.add_argument("--dimensions", type=lambda value: [int(d) for d in value.split(",")],
+                        default=[1536, 1024, 512, 256], help="Reduced sizes to compare, comma separated")
+    parser.add_argument("--k", type=int, default=10, help="K of recall@K")
+    parser.add_argument("--chroma", action="store_true", help="Also measure the size of a Chroma collection per size")
+    parser.add_argument("--output", help="Write the results as JSON to this file")
+    return parser.parse_args()
+
+if __name__ == "__main__":
+    args = parse_args()
+    results = run(args)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
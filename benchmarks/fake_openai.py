@@ -0,0 +1,126 @@
+# Deterministic, offline stand-ins for the OpenAI sync and async clients. Embeddings are
+# derived from a hash of the input text and every call sleeps for a configurable latency,
+# so benchmarks measure our own overhead plus a realistic, reproducible network delay.
+import time
+import asyncio
+import hashlib
+from types import SimpleNamespace
+
+import numpy as np
+
+class FakeOpenAIStats:
+    def __init__(self):
+        self.embedding_requests = 0
+        self.embedding_inputs = 0
+        self.chat_requests = 0
+
+    def as_dict(self):
+        return dict(vars(self))
+
+def fake_vector(text: str, dimensions: int) -> list:
+    """A unit vector seeded by the text, so equal texts always get equal embeddings."""
+    seed = int.from_bytes(hashlib.sha256(text.encode("utf-8")).digest()[:8], "little")
+    vector = np.random.default_rng(seed).standard_normal(dimensions).astype(np.float32)
+    return (vector / np.linalg.norm(vector)).tolist()
+
+def message_text(message) -> str:
+    """The text of a chat message, whose content may be a list of text and image parts."""
+    content = message["content"]
+    if isinstance(content, str):
+        return content
+    return " ".join(part.get("text", "") for part in content if part.get("type") == "text")
+
+def fake_completion(messages) -> str:
+    prompt = message_text(messages[-1])
+    return "Synthetic answer: " + " ".join(prompt.split()[:40])
+
+def fake_usage(messages, text):
+    prompt_tokens = sum(len(message_text(m).split()) for m in messages)
+    return SimpleNamespace(prompt_tokens=prompt_tokens, completion_tokens=len(text.split()))
+
+class _Embeddings:
+    def __init__(self, owner):
+        self._owner = owner
+
+    def create(self, input, model, dimensions=None, **kwargs):
+        owner = self._owner
+        texts = [input] if isinstance(input, str) else list(input)
+        owner.stats.embedding_requests += 1
+        owner.stats.embedding_inputs += len(texts)
+        time.sleep(owner.embedding_latency + owner.embedding_latency_per_input * len(texts))
+        return owner._embedding_response(texts, model, dimensions)
+
+class _ChatCompletions:
+    def __init__(self, owner):
+        self._owner = owner
+
+    def create(self, model, messages, stream=False, **kwargs):
+        owner = self._owner
+        owner.stats.chat_requests += 1
+        time.sleep(owner.chat_latency)
+        text = fake_completion(messages)
+        if stream:
+            return iter(owner._stream_chunks(text, fake_usage(messages, text)))
+        return SimpleNamespace(
+            choices=[SimpleNamespace(message=SimpleNamespace(content=text))], usage=fake_usage(messages, text)
+        )
+
+class FakeOpenAI:
+    """
+    Implements the subset of the OpenAI client used by the app: embeddings.create
+    and chat.completions.create (optionally streamed). Latencies are in seconds.
+    """
+
+    def __init__(self, dimensions=3072, embedding_latency=0.05, embedding_latency_per_input=0.0,
+                 chat_latency=0.3, stats=None):
+        self.dimensions = dimensions
+        self.embedding_latency = embedding_latency
+        self.embedding_latency_per_input = embedding_latency_per_input
+        self.chat_latency = chat_latency
+        self.stats = stats or FakeOpenAIStats()
+        self.embeddings = _Embeddings(self)
+        self.chat = SimpleNamespace(completions=_ChatCompletions(self))
+
+    def embed(self, texts) -> list:
+        """Embedding-function interface (a callable over a list of texts), as used by Chroma."""
+        return [d.embedding for d in self.embeddings.create(input=list(texts), model="fake").data]
+
+    def _embedding_response(self, texts, model, dimensions):
+        dims = dimensions or self.dimensions
+        data = [SimpleNamespace(index=i, embedding=fake_vector(text, dims)) for i, text in enumerate(texts)]
+        usage = SimpleNamespace(prompt_tokens=sum(len(text.split()) for text in texts))
+        return SimpleNamespace(data=data, model=model, usage=usage)
+
+    @staticmethod
+    def _stream_chunks(text, usage):
+        for word in text.split(" "):
+            delta = SimpleNamespace(content=word + " ")
+            yield SimpleNamespace(choices=[SimpleNamespace(delta=delta)], usage=None)
+        # Like stream_options={"include_usage": True}: a last chunk with usage and no choices
+        yield SimpleNamespace(choices=[], usage=usage)
+
+class _AsyncChatCompletions:
+    def __init__(self, owner):
+        self._owner = owner
+
+    async def create(self, model, messages, stream=False, **kwargs):
+        owner = self._owner
+        owner.stats.chat_requests += 1
+        await asyncio.sleep(owner.chat_latency)
+        text = fake_completion(messages)
+        if stream:
+            async def chunks():
+                for chunk in FakeOpenAI._stream_chunks(text, fake_usage(messages, text)):
+                    yield chunk
+            return chunks()
+        return SimpleNamespace(
+            choices=[SimpleNamespace(message=SimpleNamespace(content=text))], usage=fake_usage(messages, text)
+        )
+
+class FakeAsyncOpenAI:
+    """Async counterpart of FakeOpenAI for the ASGI code path; shares its settings and stats."""
+
+    def __init__(self, sync_client: FakeOpenAI):
+        self.chat_latency = sync_client.chat_latency
+        self.stats = sync_client.stats
+        self.chat = SimpleNamespace(completions=_AsyncChatCompletions(self))
@@ -0,0 +1,33 @@
+# Offline stand-in for the tiktoken encoder, whose BPE ranks are downloaded on first use.
+# Text is split into pieces of at most four word characters (or one other character),
+# about the size of a cl100k_base token, so chunk and context sizes stay realistic.
+import re
+import threading
+
+PIECE = re.compile(r"\s?\w{1,4}|\s?[^\w\s]|\s+")
+
+class FakeEncoder:
+    """Implements the encode, decode and decode_bytes methods the app calls on the encoder."""
+
+    def __init__(self):
+        self._ids = {}
+        self._pieces = []
+        self._lock = threading.Lock()
+
+    def _id(self, piece: str) -> int:
+        token = self._ids.get(piece)
+        if token is None:
+            with self._lock:
+                token = self._ids.setdefault(piece, len(self._pieces))
+                if token == len(self._pieces):
+                    self._pieces.append(piece)
+        return token
+
+    def encode(self, text: str, **kwargs) -> list:
+        return [self._id(piece) for piece in PIECE.findall(text)]
+
+    def decode(self, tokens) -> str:
+        return "".join(self._pieces[token] for token in tokens)
+
+    def decode_bytes(self, tokens) -> bytes:
+        return self.decode(tokens).encode("utf-8")
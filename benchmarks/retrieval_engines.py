@@ -0,0 +1,116 @@
+#!/usr/bin/env python
+# Vector search latency of the Chroma and NumPy retrieval engines on the same synthetic
+# collection, unscoped and with a folder scope, plus the recall@K of Chroma's approximate
+# HNSW search against the exact NumPy results. Chroma and the NumPy index live in a
+# temporary directory; no OpenAI calls are made.
+#
+#   python benchmarks/retrieval_engines.py --sizes 1000,10000,50000 --queries 200
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+
+import numpy as np
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, BENCH_DIR)
+sys.path.insert(0, REPO_DIR)
+
+from run_benchmarks import percentiles
+
+FOLDERS = 10  # The scoped queries search one folder, about a tenth of the chunks
+
+def fill_collection(name, size, dimensions, rng):
+    """Creates the collection as the active one and adds size random unit vectors."""
+    from database import write_active_index, get_collection
+    from config import EMBEDDINGS_MODEL
+    write_active_index({"collection": name, "model": EMBEDDINGS_MODEL, "dimensions": dimensions})
+    collection = get_collection()
+    for start in range(0, size, 2000):
+        n = min(2000, size - start)
+        vectors = rng.standard_normal((n, dimensions)).astype(np.float32)
+        vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+        collection.add(
+            ids=[f"chunk-{start + i}" for i in range(n)],
+            embeddings=vectors,
+            documents=[f"chunk {start + i}" for i in range(n)],
+            metadatas=[
+                {"type": "document", "doc_id": f"doc-{(start + i) // 10}", "folder": f"folder-{(start + i) % FOLDERS}"}
+                for i in range(n)
+            ]
+        )
+    return collection
+
+def time_engine(engine, queries, k, where):
+    from retrieval import vector_search
+    seconds, results = [], []
+    for query in queries:
+        start = time.perf_counter()
+        items = vector_search(query, k, where, engine=engine)
+        seconds.append(time.perf_counter() - start)
+        results.append([item["id"] for item in items])
+    return seconds, results
+
+def recall(approximate, exact) -> float:
+    return float(np.mean([len(set(a) & set(e)) / len(e) for a, e in zip(approximate, exact) if e]))
+
+def run(args) -> dict:
+    from numpy_index import rebuild_numpy_index
+    rng = np.random.default_rng(args.seed)
+    report = {}
+    for size in args.sizes:
+        start = time.perf_counter()
+        fill_collection(f"bench_{size}", size, args.dimensions, rng)
+        fill_s = time.perf_counter() - start
+        start = time.perf_counter()
+        rebuild_numpy_index()
+        build_s = time.perf_counter() - start
+        queries = rng.standard_normal((args.queries, args.dimensions)).astype(np.float32).tolist()
+        entry = {"chunks": size, "chroma_fill_s": round(fill_s, 2), "numpy_build_s": round(build_s, 2)}
+        print(f"{size} chunks of {args.dimensions} dimensions (Chroma fill {fill_s:.1f}s, NumPy build {build_s:.1f}s)")
+        for scope, where in (("unscoped", None), ("folder", {"folder": "folder-3"})):
+            # One untimed query per engine loads the index into memory
+            for engine in ("chroma", "numpy"):
+                time_engine(engine, queries[:1], args.k, where)
+            chroma_s, chroma_ids = time_engine("chroma", queries, args.k, where)
+            numpy_s, numpy_ids = time_engine("numpy", queries, args.k, where)
+            entry[scope] = {
+                "chroma": percentiles(chroma_s),
+                "numpy": percentiles(numpy_s),
+                f"chroma_recall@{args.k}": round(recall(chroma_ids, numpy_ids), 4),
+            }
+            print(f"  {scope:<9} chroma p50 {entry[scope]['chroma']['p50_ms']} ms, p95 {entry[scope]['chroma']['p95_ms']} ms"
+                  f" | numpy p50 {entry[scope]['numpy']['p50_ms']} ms, p95 {entry[scope]['numpy']['p95_ms']} ms"
+                  f" | chroma recall@{args.k} {entry[scope][f'chroma_recall@{args.k}']}")
+        report[str(size)] = entry
+    return report
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Compare Chroma and NumPy vector search latency.")
+    parser.add_argument("--sizes", type=lambda value: [int(n) for n in value.split(",")], default=[1000, 10000],
+                        help="Collection sizes in chunks, comma separated")
+    parser.add_argument("--dimensions", type=int, default=3072, help="Embedding dimensions")
+    parser.add_argument("--queries", type=int, default=100, help="Timed queries per engine and scope")
+    parser.add_argument("--k", type=int, default=20, help="Results per query (RERANK_CANDIDATES is 20)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="Write the results as JSON to this file")
+    return parser.parse_args()
+
+if __name__ == "__main__":
+    args = parse_args()
+    os.environ.setdefault("OPENAI_API_KEY", "sk-offline-benchmark")
+    os.environ.setdefault("ANONYMIZED_TELEMETRY", "False")
+    work_dir = tempfile.mkdtemp(prefix="rag-engines-")
+    os.chdir(work_dir)
+    try:
+        results = run(args)
+    finally:
+        os.chdir(REPO_DIR)
+        shutil.rmtree(work_dir, ignore_errors=True)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
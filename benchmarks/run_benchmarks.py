@@ -0,0 +1,249 @@
+#!/usr/bin/env python
+# Offline ingestion and retrieval benchmark. OpenAI is replaced by a deterministic fake
+# with configurable latency and tiktoken by an encoder that needs no downloaded ranks,
+# PDFs are partitioned with the "fast" strategy (no layout model), the corpus is synthetic,
+# and all state (Chroma, SQLite databases, caches) lives in a temporary directory.
+#
+#   python benchmarks/run_benchmarks.py --sizes small,medium --queries 50 --output bench.json
+#   python benchmarks/run_benchmarks.py --compare bench.json
+import os
+import io
+import sys
+import json
+import time
+import uuid
+import shutil
+import random
+import argparse
+import platform
+import resource
+import tempfile
+import subprocess
+import contextlib
+
+import numpy as np
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, BENCH_DIR)
+sys.path.insert(0, REPO_DIR)
+
+from corpus import build_corpus, FORMATS, SIZES
+from fake_openai import FakeOpenAI, FakeAsyncOpenAI
+from fake_tokenizer import FakeEncoder
+
+def peak_rss_mb() -> float:
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+def percentiles(seconds) -> dict:
+    if not seconds:
+        return {}
+    ms = np.asarray(seconds) * 1000
+    return {
+        "count": len(seconds),
+        "mean_ms": round(float(ms.mean()), 2),
+        "p50_ms": round(float(np.percentile(ms, 50)), 2),
+        "p95_ms": round(float(np.percentile(ms, 95)), 2),
+        "p99_ms": round(float(np.percentile(ms, 99)), 2),
+    }
+
+def git_commit() -> str:
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=REPO_DIR, stderr=subprocess.DEVNULL
+        ).decode().strip()
+    except Exception:
+        return ""
+
+def install_fakes(fake):
+    """Points every OpenAI client the app uses at the fake, and the shared encoder at FakeEncoder."""
+    import chunk_and_embed
+    import database
+    import query
+    import tokenizer
+    tokenizer._encoder = FakeEncoder()
+    # The app creates its clients on first use; setting them first means they never are
+    chunk_and_embed._client = fake
+    query._client = fake
+    query._async_client = FakeAsyncOpenAI(fake)
+    database.get_embedding_function()._inner = fake.embed
+
+def ingest(files):
+    import chunk_and_embed
+    from database import get_collection
+    collection = get_collection()
+    result = {"docs": 0, "chunks": 0, "seconds": 0.0, "per_format": {}}
+    latencies = []
+    for entry in files:
+        before = collection.count()
+        start = time.perf_counter()
+        # chunk_and_embed prints every chunk; keep the report readable
+        with contextlib.redirect_stdout(io.StringIO()):
+            chunk_and_embed.chunk_and_embed_file(
+                entry["path"], str(uuid.uuid4()),
+                {"title": os.path.basename(entry["path"]), "ext": "." + entry["format"]}
+            )
+        elapsed = time.perf_counter() - start
+        chunks = collection.count() - before
+        latencies.append(elapsed)
+        stats = result["per_format"].setdefault(entry["format"], {"docs": 0, "chunks": 0, "seconds": 0.0})
+        for totals in (result, stats):
+            totals["docs"] += 1
+            totals["chunks"] += chunks
+            totals["seconds"] += elapsed
+    result["seconds"] = round(result["seconds"], 3)
+    result["chunks_per_s"] = round(result["chunks"] / result["seconds"], 2) if result["seconds"] else 0.0
+    result["docs_per_min"] = round(result["docs"] * 60 / result["seconds"], 2) if result["seconds"] else 0.0
+    result["doc_latency"] = percentiles(latencies)
+    for stats in result["per_format"].values():
+        stats["seconds"] = round(stats["seconds"], 3)
+    return result
+
+def measure_queries(sentences, n_queries, seed):
+    """Times retrieval alone (prepare_answer) and full answers (generate_answer) on distinct questions."""
+    import flask
+    from query import prepare_answer, generate_answer
+    from retrieval_state import init_retrieval_state
+    # Without create_app, the state database generate_answer writes to is created here
+    init_retrieval_state()
+    rng = random.Random(seed)
+    sample = [rng.choice(sentences) for _ in range(n_queries)]
+
+    retrieval = []
+    for i, text in enumerate(sample):
+        start = time.perf_counter()
+        prepare_answer(f"What does the documentation say about {text}? ({i})")
+        retrieval.append(time.perf_counter() - start)
+
+    # generate_answer keeps its retrieval state under a key in the Flask session
+    app = flask.Flask("benchmark")
+    app.secret_key = "benchmark"
+    answers = []
+    for i, text in enumerate(sample):
+        with app.test_request_context("/query"):
+            start = time.perf_counter()
+            generate_answer(f"Summarize what is known about {text}. ({i})")
+            answers.append(time.perf_counter() - start)
+    return percentiles(retrieval), percentiles(answers)
+
+def reset_collection():
+    from chunk_and_embed import delete_chunks
+    from database import get_collection
+    ids = get_collection().get(include=[])["ids"]
+    for start in range(0, len(ids), 5000):
+        delete_chunks(ids[start:start + 5000])
+
+def run(args):
+    workdir = tempfile.mkdtemp(prefix="rag-bench-")
+    state_dir = os.path.join(workdir, "state")
+    os.makedirs(state_dir)
+    # The app uses paths relative to the working directory for Chroma and its databases
+    os.chdir(state_dir)
+    os.environ.setdefault("OPENAI_API_KEY", "sk-offline-benchmark")
+    os.environ.setdefault("ANONYMIZED_TELEMETRY", "False")
+    # hi_res downloads a layout model on first use; read before config is first imported
+    os.environ.setdefault("PDF_PARTITION_STRATEGY", "fast")
+
+    fake = FakeOpenAI(
+        dimensions=args.dimensions,
+        embedding_latency=args.embedding_latency,
+        embedding_latency_per_input=args.embedding_latency_per_input,
+        chat_latency=args.chat_latency
+    )
+    import_start = time.perf_counter()
+    install_fakes(fake)
+    import_seconds = time.perf_counter() - import_start
+
+    results = {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "git_commit": git_commit(),
+        "python": platform.python_version(),
+        "settings": vars(args).copy(),
+        "import_seconds": round(import_seconds, 3),
+        "sizes": {},
+    }
+    results["settings"].pop("compare", None)
+
+    try:
+        for size in args.sizes:
+            files, sentences = build_corpus(os.path.join(workdir, "corpus"), size, args.formats, args.seed)
+            print(f"[{size}] ingesting {len(files)} documents...")
+            ingestion = ingest(files)
+            print(f"[{size}] {ingestion['chunks']} chunks, {ingestion['chunks_per_s']} chunks/s, "
+                  f"{ingestion['docs_per_min']} docs/min")
+            retrieval, answers = measure_queries(sentences or ["fund fees"], args.queries, args.seed)
+            print(f"[{size}] retrieval p50 {retrieval['p50_ms']} ms, p95 {retrieval['p95_ms']} ms, "
+                  f"p99 {retrieval['p99_ms']} ms; answer p50 {answers['p50_ms']} ms")
+            results["sizes"][size] = {"ingestion": ingestion, "retrieval": retrieval, "answer": answers}
+            reset_collection()
+    finally:
+        os.chdir(REPO_DIR)
+        if not args.keep:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    results["openai_calls"] = fake.stats.as_dict()
+    results["peak_rss_mb"] = peak_rss_mb()
+    print(f"Peak RSS: {results['peak_rss_mb']} MB")
+    return results
+
+# Metrics compared between runs, with whether higher values are better
+COMPARED_METRICS = [
+    (("ingestion", "chunks_per_s"), True),
+    (("ingestion", "docs_per_min"), True),
+    (("retrieval", "p50_ms"), False),
+    (("retrieval", "p95_ms"), False),
+    (("retrieval", "p99_ms"), False),
+    (("answer", "p50_ms"), False),
+    (("answer", "p95_ms"), False),
+]
+
+def compare(previous, current):
+    print(f"\nCompared with {previous.get('git_commit') or 'previous run'} ({previous.get('timestamp')}):")
+    for size, sections in current["sizes"].items():
+        old_sections = previous.get("sizes", {}).get(size)
+        if not old_sections:
+            continue
+        for (section, metric), higher_is_better in COMPARED_METRICS:
+            old = old_sections.get(section, {}).get(metric)
+            new = sections.get(section, {}).get(metric)
+            if not old or new is None:
+                continue
+            change = (new - old) / old * 100
+            better = change > 0 if higher_is_better else change < 0
+            print(f"  {size:>6} {section + '.' + metric:<24} {old:>10} -> {new:>10} "
+                  f"({change:+.1f}%{', better' if better and abs(change) >= 1 else ''})")
+    old_rss = previous.get("peak_rss_mb")
+    if old_rss:
+        print(f"  peak_rss_mb {old_rss} -> {current['peak_rss_mb']}")
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Offline ingestion and retrieval benchmarks.")
+    parser.add_argument("--sizes", default="small,medium",
+                        type=lambda value: value.split(","), help=f"Comma-separated, from {list(SIZES)}")
+    parser.add_argument("--formats", default=",".join(FORMATS), type=lambda value: value.split(","))
+    parser.add_argument("--queries", type=int, default=50, help="Questions timed per corpus size")
+    parser.add_argument("--dimensions", type=int, default=3072, help="Fake embedding dimensions")
+    parser.add_argument("--embedding-latency", type=float, default=0.05, help="Seconds per embeddings request")
+    parser.add_argument("--embedding-latency-per-input", type=float, default=0.0, help="Extra seconds per input text")
+    parser.add_argument("--chat-latency", type=float, default=0.3, help="Seconds per chat completion")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default="benchmark_results.json", help="Where to write the JSON results")
+    parser.add_argument("--compare", help="A previous results file to compare against")
+    parser.add_argument("--keep", action="store_true", help="Keep the temporary directory")
+    return parser.parse_args()
+
+if __name__ == "__main__":
+    args = parse_args()
+    # run() changes the working directory, so resolve paths first
+    args.output = os.path.abspath(args.output)
+    if args.compare:
+        args.compare = os.path.abspath(args.compare)
+    results = run(args)
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"Results written to {args.output}")
+    if args.compare:
+        with open(args.compare) as f:
+            compare(json.load(f), results)
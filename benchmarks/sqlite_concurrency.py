@@ -0,0 +1,124 @@
+#!/usr/bin/env python
+# Read/write throughput of the wiki and users tables under concurrent requests, comparing
+# a new rollback-journal connection per call (the old helpers) with the pooled WAL layer.
+#
+#   python benchmarks/sqlite_concurrency.py --threads 8 --ops 2000 --write-ratio 0.1
+import os
+import sys
+import time
+import random
+import sqlite3
+import argparse
+import tempfile
+import threading
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import sqlite_pool
+
+WIKI_PAGES = 500
+USERS = 200
+
+def legacy_connect(path):
+    return sqlite3.connect(path, timeout=sqlite_pool.BUSY_TIMEOUT)
+
+def create_schema(path, journal_mode):
+    conn = sqlite3.connect(path)
+    conn.execute(f"PRAGMA journal_mode={journal_mode}")
+    conn.execute("""
+        CREATE TABLE wiki (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            title TEXT NOT NULL,
+            content TEXT NOT NULL,
+            folder TEXT DEFAULT '',
+            updated_at TEXT NOT NULL,
+            last_edited_by TEXT
+        )
+    """)
+    conn.execute("""
+        CREATE TABLE users (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            username TEXT UNIQUE NOT NULL,
+            password TEXT NOT NULL,
+            created_at TEXT NOT NULL
+        )
+    """)
+    if journal_mode == "WAL":
+        conn.execute("CREATE INDEX idx_wiki_updated_at ON wiki (updated_at)")
+    conn.executemany(
+        "INSERT INTO wiki (title, content, folder, updated_at, last_edited_by) VALUES (?, ?, ?, ?, ?)",
+        [(f"Page {i}", "lorem ipsum " * 200, f"folder{i % 10}", f"2024-01-01 00:{i % 60:02d}", "bench")
+         for i in range(WIKI_PAGES)]
+    )
+    conn.executemany(
+        "INSERT INTO users (username, password, created_at) VALUES (?, ?, ?)",
+        [(f"user{i}", "hash", "2024-01-01") for i in range(USERS)]
+    )
+    conn.commit()
+    conn.close()
+
+def worker(connect, path, ops, write_ratio, latencies, seed):
+    rng = random.Random(seed)
+    for i in range(ops):
+        write = rng.random() < write_ratio
+        start = time.perf_counter()
+        with connect(path) as conn:
+            cur = conn.cursor()
+            if write:
+                cur.execute(
+                    "UPDATE wiki SET content = ?, updated_at = ?, last_edited_by = ? WHERE id = ?",
+                    ("edited " * 200, f"2024-02-01 {i % 24:02d}:00", "bench", rng.randint(1, WIKI_PAGES))
+                )
+                conn.commit()
+            elif i % 2:
+                cur.execute("SELECT id, title, folder, updated_at, last_edited_by FROM wiki ORDER BY updated_at DESC")
+                cur.fetchall()
+            else:
+                cur.execute("SELECT id, username, password FROM users WHERE username = ?", (f"user{rng.randrange(USERS)}",))
+                cur.fetchone()
+        if connect is legacy_connect:
+            conn.close()
+        latencies[write].append(time.perf_counter() - start)
+
+def run(mode, threads, ops, write_ratio):
+    workdir = tempfile.mkdtemp()
+    path = os.path.join(workdir, "bench.db")
+    if mode == "legacy":
+        create_schema(path, "DELETE")
+        connect = legacy_connect
+    else:
+        create_schema(path, "WAL")
+        connect = sqlite_pool.get_connection
+
+    latencies = {False: [], True: []}
+
+    def target(seed):
+        worker(connect, path, ops, write_ratio, latencies, seed)
+        if mode == "pooled":
+            sqlite_pool.close_connections()
+
+    pool = [threading.Thread(target=target, args=(seed,)) for seed in range(threads)]
+    start = time.perf_counter()
+    for thread in pool:
+        thread.start()
+    for thread in pool:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    reads, writes = sorted(latencies[False]), sorted(latencies[True])
+    p95 = lambda values: values[int(len(values) * 0.95)] * 1000 if values else 0.0
+    print(
+        f"{mode:>7}: {(len(reads) + len(writes)) / elapsed:8.0f} ops/s | "
+        f"reads {len(reads) / elapsed:8.0f}/s p95 {p95(reads):6.2f} ms | "
+        f"writes {len(writes) / elapsed:7.0f}/s p95 {p95(writes):6.2f} ms"
+    )
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--ops", type=int, default=1000, help="Operations per thread")
+    parser.add_argument("--write-ratio", type=float, default=0.1)
+    args = parser.parse_args()
+    print(f"{args.threads} threads x {args.ops} ops, {args.write_ratio:.0%} writes")
+    for mode in ("legacy", "pooled"):
+        run(mode, args.threads, args.ops, args.write_ratio)
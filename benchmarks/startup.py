@@ -0,0 +1,136 @@
+#!/usr/bin/env python
+# Worker startup benchmark. Each scenario runs in a fresh interpreter and reports the wall
+# time until the app (or an ingestion module) is importable and ready, plus which heavy
+# dependencies got imported along the way. With --baseline, the same scenarios run against
+# another git revision, e.g. the one before imports became lazy.
+#
+#   python benchmarks/startup.py --runs 5
+#   python benchmarks/startup.py --runs 5 --baseline HEAD~1
+import os
+import sys
+import json
+import shutil
+import tarfile
+import argparse
+import tempfile
+import subprocess
+import statistics
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+
+HEAVY_MODULES = ["chromadb", "openai", "tiktoken", "unstructured", "PIL", "pypdf", "onnxruntime", "numpy"]
+
+# Runs inside the child interpreter; prints one JSON line
+CHILD = r"""
+import json, os, sys, time
+start = time.perf_counter()
+scenario = sys.argv[1]
+result = {}
+if scenario in ("create_app", "create_app_warm"):
+    from app import create_app
+    create_app()
+    result["ready_s"] = time.perf_counter() - start
+    if scenario == "create_app_warm":
+        try:
+            from warmup import warm_up
+        except ImportError:
+            # Revisions without a warm-up hook load everything at import already
+            warm_up = None
+        if warm_up is not None:
+            warm_start = time.perf_counter()
+            warm_up()
+            result["warm_up_s"] = time.perf_counter() - warm_start
+        result["ready_s"] = time.perf_counter() - start
+elif scenario == "import_ingest":
+    import chunk_and_embed
+    result["ready_s"] = time.perf_counter() - start
+result["loaded"] = [m for m in json.loads(sys.argv[2]) if m in sys.modules]
+print("RESULT " + json.dumps(result), flush=True)
+# Skip interpreter teardown (ingestion worker threads, Chroma) so it is not measured
+os._exit(0)
+"""
+
+SCENARIOS = {
+    "create_app": "Import the app and call create_app()",
+    "create_app_warm": "create_app() followed by warm_up()",
+    "import_ingest": "Import chunk_and_embed, as ingestion CLIs do",
+}
+
+def run_once(code_dir, scenario, state_dir=None):
+    workdir = state_dir or tempfile.mkdtemp(prefix="rag-startup-")
+    python_path = os.pathsep.join(filter(None, [code_dir, os.environ.get("PYTHONPATH")]))
+    env = dict(os.environ, PYTHONPATH=python_path, ANONYMIZED_TELEMETRY="False")
+    env.setdefault("OPENAI_API_KEY", "sk-offline-benchmark")
+    try:
+        output = subprocess.run(
+            [sys.executable, "-c", CHILD, scenario, json.dumps(HEAVY_MODULES)],
+            cwd=workdir, env=env, capture_output=True, text=True, timeout=600
+        )
+    finally:
+        if state_dir is None:
+            shutil.rmtree(workdir, ignore_errors=True)
+    for line in output.stdout.splitlines():
+        if line.startswith("RESULT "):
+            return json.loads(line[len("RESULT "):])
+    raise RuntimeError(f"{scenario} failed in {code_dir}:\n{output.stderr[-2000:]}")
+
+def measure(code_dir, runs, state_dir=None):
+    results = {}
+    for scenario in SCENARIOS:
+        samples = [run_once(code_dir, scenario, state_dir) for _ in range(runs)]
+        results[scenario] = {
+            "median_s": round(statistics.median(s["ready_s"] for s in samples), 3),
+            "min_s": round(min(s["ready_s"] for s in samples), 3),
+            "loaded": samples[-1]["loaded"],
+        }
+        warm = [s["warm_up_s"] for s in samples if "warm_up_s" in s]
+        if warm:
+            results[scenario]["warm_up_median_s"] = round(statistics.median(warm), 3)
+    return results
+
+def export_revision(revision, directory):
+    """Writes the tree of a git revision to directory."""
+    archive = subprocess.run(["git", "archive", "--format=tar", revision], cwd=REPO_DIR,
+                             capture_output=True, check=True).stdout
+    archive_path = os.path.join(directory, "tree.tar")
+    with open(archive_path, "wb") as f:
+        f.write(archive)
+    with tarfile.open(archive_path) as tar:
+        tar.extractall(directory)
+    os.remove(archive_path)
+
+def report(label, results):
+    print(f"\n{label}")
+    for scenario, stats in results.items():
+        warm = f", warm-up {stats['warm_up_median_s']}s" if "warm_up_median_s" in stats else ""
+        print(f"  {scenario:<16} median {stats['median_s']:>6}s (min {stats['min_s']}s{warm})")
+        print(f"  {'':<16} loaded: {', '.join(stats['loaded']) or '-'}")
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Measure worker and CLI startup time.")
+    parser.add_argument("--runs", type=int, default=5, help="Fresh interpreters per scenario")
+    parser.add_argument("--baseline", help="A git revision to compare against, e.g. HEAD~1")
+    parser.add_argument("--state-dir", help="Run in this directory (e.g. a copy of real data) instead of an empty one")
+    parser.add_argument("--output", help="Write the results as JSON to this file")
+    return parser.parse_args()
+
+if __name__ == "__main__":
+    args = parse_args()
+    results = {"current": measure(REPO_DIR, args.runs, args.state_dir)}
+    report("Working tree", results["current"])
+    if args.baseline:
+        baseline_dir = tempfile.mkdtemp(prefix="rag-baseline-")
+        try:
+            export_revision(args.baseline, baseline_dir)
+            results["baseline"] = measure(baseline_dir, args.runs, args.state_dir)
+        finally:
+            shutil.rmtree(baseline_dir, ignore_errors=True)
+        report(f"Baseline {args.baseline}", results["baseline"])
+        print("\nChange (working tree vs baseline):")
+        for scenario in SCENARIOS:
+            old, new = results["baseline"][scenario]["median_s"], results["current"][scenario]["median_s"]
+            print(f"  {scenario:<16} {old}s -> {new}s ({(new - old) / old * 100:+.1f}%)")
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
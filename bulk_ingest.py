@@ -0,0 +1,206 @@
+#!/usr/bin/env python
+# Bulk ingestion of a directory tree. Partitioning (CPU-bound) runs in a process pool
+# while summarization, embedding and indexing (waiting on OpenAI and Chroma) run in a
+# thread pool, so the two overlap. Progress is appended to a manifest, so an interrupted
+# run resumes where it stopped, and files whose content is already indexed are skipped.
+#
+#   python bulk_ingest.py /path/to/archive --partition-workers 8 --io-workers 4
+import os
+import sys
+import json
+import time
+import uuid
+import shutil
+import argparse
+import datetime
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+# Worker processes only import this module and partitioning, never Chroma or OpenAI
+from partitioning import partition_file, file_hash
+
+SUPPORTED_EXTENSIONS = {".pdf", ".docx", ".xlsx", ".txt", ".png", ".jpg", ".jpeg"}
+
+def find_files(root):
+    """Yields every supported file under root, in a stable order."""
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames.sort()
+        for filename in sorted(filenames):
+            if os.path.splitext(filename)[1].lower() in SUPPORTED_EXTENSIONS:
+                yield os.path.join(dirpath, filename)
+
+def document_id(content_hash):
+    """Doc ids derive from the content, so re-ingesting a file replaces its partial chunks."""
+    return str(uuid.uuid5(uuid.NAMESPACE_URL, f"sha256:{content_hash}"))
+
+def partition_worker(file_path):
+    """
+    Runs in a worker process and returns the elements to the I/O stage. They are also
+    in the partition cache, except PyPDF2 fallback results, which are never cached.
+    """
+    return partition_file(file_path)
+
+class Manifest:
+    """
+    Append-only JSON-lines record of processed files. The last entry per content hash
+    wins; 'done' and 'skipped' files are not processed again, 'failed' ones are retried.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.entries = {}
+        self._lock = threading.Lock()
+        if os.path.exists(path):
+            with open(path, "r") as f:
+                for line in f:
+                    line = line.strip()
+                    if not line:
+                        continue
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        # A line cut short by an interruption
+                        continue
+                    self.entries[entry["content_hash"]] = entry
+
+    def finished(self, content_hash):
+        entry = self.entries.get(content_hash)
+        return entry is not None and entry["status"] in ("done", "skipped")
+
+    def record(self, file_path, content_hash, status, **fields):
+        entry = {
+            "path": file_path, "content_hash": content_hash, "status": status,
+            "time": datetime.datetime.utcnow().isoformat(), **fields
+        }
+        with self._lock:
+            self.entries[content_hash] = entry
+            with open(self.path, "a") as f:
+                f.write(json.dumps(entry) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+
+def ingest_file(root, file_path, content_hash, uploader, elements=None):
+    """Copies a partitioned file into uploads, indexes its elements and adds it to the document catalog."""
+    from chunk_and_embed import chunk_and_embed_file
+    from app.docs import save_document
+
+    now = datetime.datetime.utcnow()
+    relative_folder = os.path.join("bulk", os.path.relpath(os.path.dirname(file_path), root))
+    relative_folder = os.path.normpath(relative_folder)
+    os.makedirs(os.path.join("uploads", relative_folder), exist_ok=True)
+    filename = os.path.basename(file_path)
+    shutil.copy2(file_path, os.path.join("uploads", relative_folder, filename))
+
+    doc_id = document_id(content_hash)
+    metadata = {
+        "title": os.path.splitext(filename)[0],
+        "uploader": uploader,
+        "upload_time": now.isoformat(),
+        "upload_display": now.strftime("%H:%M"),
+        "folder": relative_folder,
+        "filename": filename,
+        "ext": os.path.splitext(filename)[1].lower(),
+        "content_hash": content_hash
+    }
+    chunks = chunk_and_embed_file(file_path, doc_id, metadata, elements)
+    save_document(dict(metadata, doc_id=doc_id))
+    return doc_id, chunks
+
+def run(args):
+    from app.database_setup import init_docs_db
+    from app.docs import find_document_by_hash
+    init_docs_db()
+
+    root = os.path.abspath(args.root)
+    manifest = Manifest(args.manifest)
+    pending = []
+    seen = set()
+    skipped = 0
+    for file_path in find_files(root):
+        content_hash = file_hash(file_path)
+        if manifest.finished(content_hash) or content_hash in seen:
+            skipped += 1
+            continue
+        if find_document_by_hash(content_hash):
+            manifest.record(file_path, content_hash, "skipped", reason="already indexed")
+            skipped += 1
+            continue
+        seen.add(content_hash)
+        pending.append((file_path, content_hash))
+    print(f"{len(pending)} files to ingest, {skipped} skipped (already indexed or duplicates).")
+    if not pending:
+        return
+
+    total = len(pending)
+    progress = {"done": 0, "failed": 0, "chunks": 0}
+    progress_lock = threading.Lock()
+    start = time.perf_counter()
+
+    def report(file_path, status, detail):
+        with progress_lock:
+            progress[status] += 1
+            finished = progress["done"] + progress["failed"]
+            print(f"[{finished}/{total}] {status}: {os.path.relpath(file_path, root)} ({detail})")
+
+    def ingest(file_path, content_hash, elements):
+        file_start = time.perf_counter()
+        try:
+            doc_id, chunks = ingest_file(root, file_path, content_hash, args.uploader, elements)
+        except Exception as e:
+            manifest.record(file_path, content_hash, "failed", stage="ingest", error=str(e))
+            report(file_path, "failed", e)
+            return
+        elapsed = round(time.perf_counter() - file_start, 2)
+        manifest.record(file_path, content_hash, "done", doc_id=doc_id, chunks=chunks, seconds=elapsed)
+        with progress_lock:
+            progress["chunks"] += chunks
+        report(file_path, "done", f"{chunks} chunks, {elapsed}s")
+
+    # Spawned (not forked) workers start clean instead of inheriting Chroma's threads and clients
+    spawn = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=args.partition_workers, mp_context=spawn) as partition_pool, \
+            ThreadPoolExecutor(max_workers=args.io_workers) as io_pool:
+        partitions = {
+            partition_pool.submit(partition_worker, file_path): (file_path, content_hash)
+            for file_path, content_hash in pending
+        }
+
+        def partitioned(future):
+            file_path, content_hash = partitions[future]
+            try:
+                elements = future.result()
+            except Exception as e:
+                manifest.record(file_path, content_hash, "failed", stage="partition", error=str(e))
+                report(file_path, "failed", e)
+                return
+            # Hand over to the I/O stage as soon as this file is partitioned
+            io_pool.submit(ingest, file_path, content_hash, elements)
+
+        for future in list(partitions):
+            future.add_done_callback(partitioned)
+        partition_pool.shutdown(wait=True)
+
+    elapsed = time.perf_counter() - start
+    print(
+        f"Ingested {progress['done']} files ({progress['chunks']} chunks) in {elapsed:.1f}s, "
+        f"{progress['failed']} failed. Manifest: {args.manifest}"
+    )
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Bulk-ingest a directory tree into the knowledge base.")
+    parser.add_argument("root", help="Directory to ingest recursively")
+    parser.add_argument("--manifest", default="bulk_ingest_manifest.jsonl",
+                        help="Progress manifest; re-running with the same manifest resumes")
+    parser.add_argument("--partition-workers", type=int, default=os.cpu_count() or 2,
+                        help="Processes partitioning documents")
+    parser.add_argument("--io-workers", type=int, default=4,
+                        help="Threads summarizing, embedding and indexing partitioned documents")
+    parser.add_argument("--uploader", default="bulk-ingest", help="Uploader name recorded in the catalog")
+    return parser.parse_args(argv)
+
+if __name__ == "__main__":
+    args = parse_args()
+    if not os.path.isdir(args.root):
+        sys.exit(f"Not a directory: {args.root}")
+    run(args)
@@ -1,18 +1,26 @@
 #!/usr/bin/env python
 
-from database import chroma_client, collection, embedding_function
+from database import get_collection, get_active_index, collection_write_lock
+from query_cache import invalidate_answer_cache
+from lexical_index import clear_lexical_index
+from dedup import clear_dedup_index
+from numpy_index import active_numpy_index
 
-def restart_chroma_db():
-    try:
-        print("Deleting all items from the existing collection...")
-        collection.delete()  # Delete all items in the collection
-        print("Existing collection data deleted.")
-    except Exception as e:
-        print(f"Error deleting collection data: {e}")
-
-    # Recreate (or get) the collection using the embedding function.
-    new_collection = chroma_client.get_or_create_collection(name="rag_chunks", embedding_function=embedding_function)
-    print("Chroma collection 'rag_chunks' has been restarted successfully.")
+def restart_chroma_db(batch_size: int = 5000):
+    """Deletes every chunk from the active collection and clears the lexical index."""
+    with collection_write_lock():
+        collection = get_collection()
+        print(f"Deleting all items from collection '{collection.name}'...")
+        # Deleting by id keeps the collection itself, which other processes may hold open
+        ids = collection.get(include=[])["ids"]
+        for start in range(0, len(ids), batch_size):
+            collection.delete(ids=ids[start:start + batch_size])
+        print(f"Deleted {len(ids)} items.")
+        clear_lexical_index()
+        clear_dedup_index()
+        active_numpy_index().clear()
+    invalidate_answer_cache()
+    print(f"Chroma collection '{get_active_index()['collection']}' has been restarted successfully.")
 
 if __name__ == "__main__":
     restart_chroma_db()
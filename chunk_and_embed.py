@@ -1,58 +1,53 @@
 import os
 import uuid
 from typing import List
-import datetime
-from openai import OpenAI
-from unstructured.partition.pdf import partition_pdf
-from unstructured.partition.docx import partition_docx
-from unstructured.partition.text import partition_text
-from unstructured.partition.xlsx import partition_xlsx
-import base64
-from PIL import Image
-import io
-import tiktoken  # For tokenization
-
-from database import collection
-from config import OPENAI_API_KEY, EMBEDDINGS_MODEL, CHAT_MODEL
-
-client = OpenAI(api_key=OPENAI_API_KEY)
-
-encoder = tiktoken.get_encoding("cl100k_base")
-
-def truncate_to_8100_tokens(text: str) -> str:
-    tokens = encoder.encode(text)
-    if len(tokens) > 8100:
-        tokens = tokens[:8100]
-    return encoder.decode(tokens)
-
-def extract_image_base64(file_path: str) -> str:
-    """Extracts image as reduced-resolution base64 to avoid huge tokens."""
-    try:
-        img = Image.open(file_path)
-        img.thumbnail((400, 400))
-        buffer = io.BytesIO()
-        img.save(buffer, format="JPEG", quality=50)
-        return base64.b64encode(buffer.getvalue()).decode('utf-8')
-    except Exception as e:
-        with open(file_path, "rb") as f:
-            data = f.read()
-        return base64.b64encode(data).decode('utf-8')
+from concurrent.futures import ThreadPoolExecutor
+
+from database import (
+    get_collection, get_active_index, get_embedding_model_key, embedding_model_key, collection_write_lock
+)
+from embedding_cache import cached_embed
+from query_cache import invalidate_answer_cache
+from lexical_index import add_to_lexical_index, delete_from_lexical_index
+from numpy_index import active_numpy_index
+from dedup import assign_chunks, release_document, tracked_chunks, forget_chunks
+from metrics import timed, trace, record_openai
+from partitioning import partition_file, file_hash
+from images import image_base64, get_cached_summaries, put_cached_summary
+from tokenizer import get_encoder, char_boundary
+from config import (
+    OPENAI_API_KEY, EMBEDDINGS_MODEL, CHAT_MODEL,
+    EMBEDDING_BATCH_MAX_TOKENS, EMBEDDING_BATCH_MAX_ITEMS, CHROMA_ADD_BATCH_SIZE,
+    SUMMARY_CONCURRENCY, CHUNK_MAX_TOKENS, CHUNK_OVERLAP_TOKENS, DEDUP_ENABLED
+)
+
+_client = None
+
+def get_client():
+    """The OpenAI client for summaries, titles and embeddings, created on first use."""
+    global _client
+    if _client is None:
+        from openai import OpenAI
+        _client = OpenAI(api_key=OPENAI_API_KEY)
+    return _client
 
 def summarize_chunk(content: str, chunk_type="text") -> str:
+    """Summarizes text or a table, or describes an image given as base64 JPEG."""
     if chunk_type == "text":
         prompt = f"Summarize the following text:\n{content}"
     elif chunk_type == "table":
         prompt = f"Summarize the following table:\n{content}"
     elif chunk_type == "image":
-        prompt = (
-            "You are an assistant that can interpret images from textual descriptions.\n"
-            "Below is the base64 content of an image from a user document. Summarize or "
-            "describe what it contains in a concise manner:\n" + content
-        )
+        # Sent as an image input; the downscaled JPEG costs a fixed, small number of tokens
+        prompt = [
+            {"type": "text", "text": "This image is from a user document. Summarize or describe "
+                                     "what it contains in a concise manner."},
+            {"type": "image_url", "image_url": {"url": f"data:image/jpeg;base64,{content}", "detail": "low"}},
+        ]
     else:
         prompt = f"Summarize:\n{content}"
 
-    response = client.chat.completions.create(
+    response = get_client().chat.completions.create(
         model=CHAT_MODEL,
         messages=[
             {"role": "system", "content": "You are a helpful assistant."},
@@ -60,172 +55,352 @@ def summarize_chunk(content: str, chunk_type="text") -> str:
         ],
         temperature=0.0
     )
+    record_openai("summarize", CHAT_MODEL, response.usage)
     return response.choices[0].message.content.strip()
 
 def embed_text(text: str) -> List[float]:
-    embedding_response = client.embeddings.create(
-        input=text,
-        model=EMBEDDINGS_MODEL
-    )
-    vector = embedding_response.data[0].embedding
-    return vector
+    return embed_texts([text])[0]
 
-def generate_document_title(file_path: str) -> str:
-    ext = os.path.splitext(file_path)[1].lower()
-    content = ""
-    if ext == ".txt":
-        with open(file_path, "r", encoding="utf-8") as f:
-            content = f.read(500)
-    elif ext == ".pdf":
-        try:
-            elements = partition_pdf(
-                file_path,
-                infer_table_structure=True,
-                strategy="hi_res",
-                max_characters=20000,
-                combine_text_under_n_chars=10000,
-                new_after_n_chars=16000
-            )
-            for el in elements:
-                if el.text.strip():
-                    content += el.text + " "
-                if len(content) > 500:
-                    break
-        except Exception as e:
-            # Fallback to PyPDF2
-            try:
-                from PyPDF2 import PdfReader
-                reader = PdfReader(file_path)
-                extracted_text = ""
-                for page in reader.pages:
-                    page_text = page.extract_text()
-                    if page_text:
-                        extracted_text += page_text + " "
-                content = extracted_text[:500]
-            except Exception:
-                content = "Document"
-    elif ext == ".docx":
-        elements = partition_docx(file_path)
-        for el in elements:
-            if hasattr(el, 'category') and el.category == "Image":
-                image_data = extract_image_base64(file_path)
-                summary = summarize_chunk(image_data, chunk_type="image")
-                content += " " + summary
-            else:
-                content += " " + el.text
-            if len(content) > 500:
+def batch_by_tokens(texts: List[str], token_counts: List[int] = None):
+    """
+    Yields (start, end) index ranges over texts so that each range stays under
+    EMBEDDING_BATCH_MAX_TOKENS and EMBEDDING_BATCH_MAX_ITEMS. Known token counts
+    can be passed in to avoid encoding the texts again.
+    """
+    encoder = get_encoder()
+    start = 0
+    batch_tokens = 0
+    for i, text in enumerate(texts):
+        n_tokens = token_counts[i] if token_counts and token_counts[i] is not None else len(encoder.encode(text))
+        if i > start and (batch_tokens + n_tokens > EMBEDDING_BATCH_MAX_TOKENS
+                          or i - start >= EMBEDDING_BATCH_MAX_ITEMS):
+            yield start, i
+            start = i
+            batch_tokens = 0
+        batch_tokens += n_tokens
+    if start < len(texts):
+        yield start, len(texts)
+
+def embed_texts(texts: List[str], token_counts: List[int] = None,
+                model: str = None, dimensions: int = None) -> List[List[float]]:
+    """
+    Embeds texts, preserving order. Cached vectors are reused and only the
+    remaining texts are sent, one embeddings request per token-bounded batch.
+    The active collection's model is used unless another one is given.
+    """
+    if model is None:
+        active = get_active_index()
+        model, dimensions = active["model"], active.get("dimensions")
+    counts = dict(zip(texts, token_counts)) if token_counts else {}
+    with timed("embed"):
+        return cached_embed(
+            embedding_model_key(model, dimensions),
+            texts,
+            lambda missing: _request_embeddings(missing, [counts.get(text) for text in missing], model, dimensions)
+        )
+
+def _request_embeddings(texts: List[str], token_counts: List[int] = None,
+                        model: str = EMBEDDINGS_MODEL, dimensions: int = None) -> List[List[float]]:
+    vectors = []
+    extra = {"dimensions": dimensions} if dimensions else {}
+    for start, end in batch_by_tokens(texts, token_counts):
+        embedding_response = get_client().embeddings.create(
+            input=texts[start:end],
+            model=model,
+            **extra
+        )
+        record_openai("embedding", model, embedding_response.usage, inputs=end - start)
+        data = sorted(embedding_response.data, key=lambda d: d.index)
+        vectors.extend(d.embedding for d in data)
+    return vectors
+
+def add_chunks(documents: List[str], vectors: List[List[float]], ids: List[str], metadatas: List[dict],
+               model_key: str):
+    """
+    Writes already-embedded chunks to Chroma in bulk add calls, the lexical index and the NumPy index.
+    model_key is the embedding space the vectors were made in (get_embedding_model_key before
+    embedding). It is compared with the active one under the write lock, so vectors of the
+    previous model never land in a collection reindex.py has just switched to; they are
+    embedded again instead.
+    """
+    while True:
+        with collection_write_lock():
+            if model_key == get_embedding_model_key():
+                collection = get_collection()
+                with timed("chroma_write"):
+                    for start in range(0, len(documents), CHROMA_ADD_BATCH_SIZE):
+                        end = start + CHROMA_ADD_BATCH_SIZE
+                        collection.add(
+                            documents=documents[start:end],
+                            embeddings=vectors[start:end],
+                            ids=ids[start:end],
+                            metadatas=metadatas[start:end]
+                        )
+                with timed("lexical_write"):
+                    add_to_lexical_index(ids, documents, metadatas)
+                with timed("numpy_index_write"):
+                    active_numpy_index().add(ids, documents, vectors, metadatas)
                 break
+        # Embedded outside the lock, which a collection switch waits for
+        print(f"The active embedding model changed from {model_key}; embedding {len(documents)} chunks again.")
+        model_key = get_embedding_model_key()
+        vectors = embed_texts(documents, [metadata.get("n_tokens") for metadata in metadatas])
+    invalidate_answer_cache()
+
+def update_chunk_metadata(ids: List[str], documents: List[str], metadatas: List[dict]):
+    """Replaces the metadata of stored chunks without re-embedding them."""
+    if not ids:
+        return
+    with collection_write_lock():
+        get_collection().update(ids=ids, metadatas=metadatas)
+        add_to_lexical_index(ids, documents, metadatas)
+        active_numpy_index().update_metadata(ids, metadatas)
+    invalidate_answer_cache()
+
+def delete_chunks(ids: List[str]):
+    """Removes chunks from Chroma, the lexical index and the NumPy index by id."""
+    if not ids:
+        return
+    with timed("chroma_delete"), collection_write_lock():
+        get_collection().delete(ids=ids)
+        delete_from_lexical_index(ids)
+        active_numpy_index().delete(ids)
+        forget_chunks(ids)
+    invalidate_answer_cache()
+
+def delete_document_chunks(doc_id: str):
+    """
+    Removes a document's chunks. Chunks it shares with other documents through
+    deduplication stay stored and are handed over to one of those documents.
+    """
+    stored = get_collection().get(where={"doc_id": doc_id}, include=[])["ids"]
+    orphaned, reassigned = release_document(doc_id)
+    # Chunks stored before deduplication existed (or while it was disabled) have no references
+    untracked = set(stored) - tracked_chunks(stored)
+    delete_chunks(sorted(set(orphaned) | untracked))
+    handover = [chunk_id for chunk_id in stored if chunk_id in reassigned]
+    if handover:
+        shared = get_collection().get(ids=handover, include=["documents"])
+        update_chunk_metadata(
+            shared["ids"], shared["documents"],
+            [dict(reassigned[chunk_id], chunk_id=chunk_id) for chunk_id in shared["ids"]]
+        )
+
+def store_chunks(documents: List[str], ids: List[str], metadatas: List[dict]):
+    """Embeds the given chunks in batches and writes them to Chroma in bulk add calls."""
+    if not documents:
+        return
+    model_key = get_embedding_model_key()
+    add_chunks(documents, embed_texts(documents), ids, metadatas, model_key)
+
+def generate_document_title(file_path: str, texts: List[str] = None) -> str:
+    """
+    Generates a title from text that ingestion has already extracted, such as
+    element texts or chunk summaries. Without texts, the file's cached partition
+    is used, so a file is never partitioned just to name it.
+    """
+    if texts is None:
+        texts = [el["text"] for el in partition_file(file_path)]
+
+    content = ""
+    for text in texts:
+        if text.strip():
+            content += text + " "
+        if len(content) > 500:
+            break
 
     if not content:
         content = "Document"
 
     prompt = f"Generate a concise and appropriate title for the following document content:\n{content}\nTitle:"
-    response = client.chat.completions.create(
-        model=CHAT_MODEL,
-        messages=[
-            {"role": "system", "content": "You are a creative assistant."},
-            {"role": "user", "content": prompt},
-        ],
-        temperature=0.5
-    )
+    with timed("title"):
+        response = get_client().chat.completions.create(
+            model=CHAT_MODEL,
+            messages=[
+                {"role": "system", "content": "You are a creative assistant."},
+                {"role": "user", "content": prompt},
+            ],
+            temperature=0.5
+        )
+    record_openai("title", CHAT_MODEL, response.usage)
     title = response.choices[0].message.content.strip()
     return title
 
-def chunk_and_embed_file(file_path: str, doc_id: str, extra_metadata=None):
+def summarize_many(tasks: List[tuple]) -> List[str]:
+    """
+    Summarizes (content, chunk_type) pairs with at most SUMMARY_CONCURRENCY
+    requests in flight. Results are returned in the same order as tasks.
+    """
+    if not tasks:
+        return []
+    with timed("summarize"), ThreadPoolExecutor(max_workers=min(SUMMARY_CONCURRENCY, len(tasks))) as pool:
+        return list(pool.map(lambda task: summarize_chunk(*task), tasks))
+
+def iter_chunks(pieces, max_tokens: int = CHUNK_MAX_TOKENS, overlap_tokens: int = CHUNK_OVERLAP_TOKENS):
+    """
+    Streams token-bounded chunks from an iterable of {"category", "text", "page"} pieces.
+
+    Consecutive text pieces are packed together up to max_tokens, and each chunk
+    repeats the last overlap_tokens tokens of the previous one. A Title piece
+    starts a new section, and table/image summaries always form their own chunks.
+    Every piece is encoded exactly once, and only the current window of tokens
+    is held in memory. Yields {"text", "n_tokens", "page", "section"} dicts.
+    """
+    encoder = get_encoder()
+    separator = encoder.encode("\n\n")
+    step = max(1, max_tokens - overlap_tokens)
+    buffer = []
+    buffer_page = None
+    section = None
+    fresh = False  # Whether the buffer holds tokens not yet emitted in a chunk
+
+    def make_chunk(tokens, page):
+        return {"text": encoder.decode(tokens), "n_tokens": len(tokens), "page": page, "section": section}
+
+    for piece in pieces:
+        text = piece["text"]
+        if not text.strip():
+            continue
+        standalone = piece["category"] in ("Table", "Image")
+        if piece["category"] == "Title" or standalone:
+            if fresh:
+                yield make_chunk(buffer, buffer_page)
+            buffer, buffer_page, fresh = [], None, False
+            if piece["category"] == "Title":
+                section = text.strip().lstrip("#").strip()[:200]
+
+        tokens = encoder.encode(text)
+        if buffer:
+            buffer.extend(separator)
+        else:
+            buffer_page = piece.get("page")
+        buffer.extend(tokens)
+        fresh = True
+
+        while len(buffer) >= max_tokens:
+            end = char_boundary(encoder, buffer, max_tokens)
+            start = char_boundary(encoder, buffer, min(step, end))
+            yield make_chunk(buffer[:end], buffer_page)
+            buffer = buffer[start:]
+            buffer_page = piece.get("page")
+            fresh = len(buffer) > end - start
+
+        if standalone:
+            if fresh:
+                yield make_chunk(buffer, buffer_page)
+            buffer, buffer_page, fresh = [], None, False
+
+    if fresh:
+        yield make_chunk(buffer, buffer_page)
+
+def build_chunks(file_path: str, elements: List[dict]) -> List[dict]:
+    """
+    Turns partitioned elements into the chunks to embed. Tables and images are
+    summarized concurrently, then everything is streamed through iter_chunks.
+    """
     file_ext = os.path.splitext(file_path)[1].lower()
-    docs_to_embed = []
-
-    if file_ext == ".pdf":
-        try:
-            elements = partition_pdf(
-                file_path,
-                infer_table_structure=True,
-                strategy="hi_res",
-                max_characters=20000,
-                combine_text_under_n_chars=10000,
-                new_after_n_chars=16000
-            )
-        except Exception as e:
-            # Log fallback usage
-            print(f"[{datetime.datetime.utcnow().isoformat()}] FALLBACK triggered for PDF: unstructured partition failed with error: {e}")
-            try:
-                from PyPDF2 import PdfReader
-                reader = PdfReader(file_path)
-                extracted_text = ""
-                for page in reader.pages:
-                    page_text = page.extract_text()
-                    if page_text:
-                        extracted_text += page_text + " "
-                class DummyElement:
-                    category = "Text"
-                    text = extracted_text
-                elements = [DummyElement()]
-            except Exception as e2:
-                raise Exception("Error processing PDF using both methods: " + str(e) + " | " + str(e2))
-
-        for el in elements:
-            if el.category == "Table":
-                summary = summarize_chunk(el.text, chunk_type="table")
-                docs_to_embed.append(summary)
-            elif el.category == "Image":
-                image_data = extract_image_base64(file_path)
-                summary = summarize_chunk(image_data, chunk_type="image")
-                docs_to_embed.append(summary)
-            else:
-                docs_to_embed.append(el.text)
-
-    elif file_ext == ".docx":
-        elements = partition_docx(file_path)
-        combined_text = ""
-        for el in elements:
-            if hasattr(el, 'category') and el.category == "Image":
-                image_data = extract_image_base64(file_path)
-                summary = summarize_chunk(image_data, chunk_type="image")
-                combined_text += "\n" + summary
-            else:
-                combined_text += "\n" + el.text
-        docs_to_embed.append(combined_text)
-
-    elif file_ext == ".xlsx":
-        elements = partition_xlsx(file_path)
-        for el in elements:
-            if el.category == "Table":
-                summary = summarize_chunk(el.text, chunk_type="table")
-                docs_to_embed.append(summary)
+
+    tasks = []
+    task_positions = {}
+    for i, el in enumerate(elements):
+        if el["category"] == "Table" and file_ext != ".docx":
+            task_positions[i] = len(tasks)
+            tasks.append((el["text"], "table"))
+
+    # Images are summarized once per content hash across the whole corpus
+    image_hashes = [el["image_hash"] for el in elements if el["category"] == "Image" and el.get("image_hash")]
+    image_summaries = get_cached_summaries(image_hashes)
+    new_hashes = [h for h in dict.fromkeys(image_hashes) if h not in image_summaries]
+    image_task_start = len(tasks)
+    tasks.extend((image_base64(h), "image") for h in new_hashes)
+
+    summaries = summarize_many(tasks)
+    for image_hash, summary in zip(new_hashes, summaries[image_task_start:]):
+        put_cached_summary(image_hash, summary, CHAT_MODEL)
+        image_summaries[image_hash] = summary
+
+    def pieces():
+        for i, el in enumerate(elements):
+            if i in task_positions:
+                yield {"category": el["category"], "text": summaries[task_positions[i]], "page": el.get("page")}
+            elif el["category"] == "Image":
+                yield {"category": "Image", "text": image_summaries.get(el.get("image_hash"), ""), "page": el.get("page")}
             else:
-                docs_to_embed.append(el.text)
+                yield el
 
-    elif file_ext == ".txt":
-        elements = partition_text(file_path)
-        for el in elements:
-            docs_to_embed.append(el.text)
+    with timed("chunk"):
+        chunks = list(iter_chunks(pieces()))
 
-    elif file_ext in [".png", ".jpg", ".jpeg"]:
-        b64_str = extract_image_base64(file_path)
-        summary = summarize_chunk(b64_str, chunk_type="image")
-        docs_to_embed.append(summary)
+    print(f"Extracted text for document {file_path}:")
+    for i, chunk in enumerate(chunks):
+        preview = chunk["text"][:200] + ("..." if len(chunk["text"]) > 200 else "")
+        print(f"Chunk {i+1} ({chunk['n_tokens']} tokens): {preview}")
 
+    return chunks
+
+def index_chunks(doc_id: str, chunks: List[dict], vectors: List[List[float]], model_key: str, extra_metadata=None):
+    """
+    Writes a document's chunks, embedded in the model_key space (see add_chunks), to Chroma. Any chunks already stored for
+    doc_id are removed first, so re-running this step never leaves duplicates.
+    With deduplication enabled, a chunk with the same text as one already stored
+    is not written again but recorded as a reference to that chunk.
+    """
     if extra_metadata is None:
         extra_metadata = {}
 
-    print(f"Extracted text for document {file_path}:")
-    for i, chunk in enumerate(docs_to_embed):
-        preview = chunk[:200] + ("..." if len(chunk) > 200 else "")
-        print(f"Chunk {i+1}: {preview}")
+    delete_document_chunks(doc_id)
 
-    # Embed each chunk, truncating to 8100 tokens if needed
-    for content in docs_to_embed:
-        if not content.strip():
-            continue
-        content = truncate_to_8100_tokens(content)
-
-        vector = embed_text(content)
+    ids, metadatas = [], []
+    for chunk in chunks:
         chunk_id = str(uuid.uuid4())
-        metadata = {"doc_id": doc_id, "chunk_id": chunk_id}
+        metadata = {"type": "document", "doc_id": doc_id, "chunk_id": chunk_id, "n_tokens": chunk["n_tokens"]}
+        # Chroma rejects None metadata values
+        if chunk.get("page") is not None:
+            metadata["page"] = chunk["page"]
+        if chunk.get("section"):
+            metadata["section"] = chunk["section"]
         metadata.update(extra_metadata)
-        collection.add(
-            documents=[content],
-            embeddings=[vector],
-            ids=[chunk_id],
-            metadatas=[metadata]
-        )
+        ids.append(chunk_id)
+        metadatas.append(metadata)
+    texts = [chunk["text"] for chunk in chunks]
+
+    if DEDUP_ENABLED and chunks:
+        matches = assign_chunks(doc_id, texts, ids, metadatas)
+        # A referenced chunk can be missing from Chroma if the job storing it failed after
+        # recording it; store it from this copy instead of leaving a dangling reference
+        new_ids = {chunk_id for chunk_id, match in zip(ids, matches) if match is None}
+        referenced = sorted({match for match in matches if match} - new_ids)
+        present = set(get_collection().get(ids=referenced, include=[])["ids"]) if referenced else set()
+        present |= new_ids
+        keep, restored = [], set()
+        for i, match in enumerate(matches):
+            if match is None:
+                keep.append(i)
+            elif match not in present and match not in restored:
+                ids[i] = metadatas[i]["chunk_id"] = match
+                restored.add(match)
+                keep.append(i)
+        print(f"Deduplication: storing {len(keep)} of {len(chunks)} chunks, "
+              f"{len(chunks) - len(keep)} refer to chunks already stored.")
+        texts, vectors = [texts[i] for i in keep], [vectors[i] for i in keep]
+        ids, metadatas = [ids[i] for i in keep], [metadatas[i] for i in keep]
+
+    add_chunks(texts, vectors, ids, metadatas, model_key)
+
+def embed_chunks(chunks: List[dict]) -> List[List[float]]:
+    """Embeds chunk dicts, reusing the token counts computed while chunking."""
+    return embed_texts([chunk["text"] for chunk in chunks], [chunk["n_tokens"] for chunk in chunks])
+
+def chunk_and_embed_file(file_path: str, doc_id: str, extra_metadata=None, elements: List[dict] = None) -> int:
+    """
+    Partitions (unless its elements are given), chunks, embeds and indexes one file.
+    Returns the number of chunks stored.
+    """
+    with trace("ingest", doc_id=doc_id, file=os.path.basename(file_path)):
+        if elements is None:
+            elements = partition_file(file_path)
+        chunks = build_chunks(file_path, elements)
+        model_key = get_embedding_model_key()
+        vectors = embed_chunks(chunks)
+        index_chunks(doc_id, chunks, vectors, model_key, extra_metadata)
+    return len(chunks)
@@ -5,5 +5,86 @@ load_dotenv()
 
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY", "")
 EMBEDDINGS_MODEL = "text-embedding-3-large"
+# Reduced (Matryoshka) dimensions for a new index, e.g. 1024 or 256; unset keeps the model's
+# full 3072. An existing index is converted with reindex.py --dimensions.
+EMBEDDING_DIMENSIONS = int(os.getenv("EMBEDDING_DIMENSIONS", "0")) or None
 CHAT_MODEL = "gpt-4o"
-TOP_K = 5  # Number of chunks to retrieve
+TOP_K = 5  # Maximum number of chunks packed into the context
+RERANK_CANDIDATES = 20  # Chunks over-fetched for reranking before packing
+MMR_LAMBDA = 0.7  # Relevance vs. diversity trade-off when reranking (1.0 = relevance only)
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "3000"))  # Tokens of context sent to the chat model
+
+# Hybrid retrieval: BM25 (SQLite FTS5) fused with vector search by reciprocal rank fusion
+HYBRID_SEARCH_ENABLED = os.getenv("HYBRID_SEARCH_ENABLED", "true").lower() == "true"
+LEXICAL_DB = "lexical.db"
+HYBRID_CANDIDATES = 20  # Candidates taken from each retriever before fusion
+RRF_K = 60  # Rank offset in 1 / (k + rank)
+
+# Vector search engine: "chroma" (HNSW) or "numpy" (exact search over a memory-mapped matrix,
+# see numpy_index.py), which avoids Chroma's per-query overhead for small and medium corpora
+RETRIEVAL_ENGINE = os.getenv("RETRIEVAL_ENGINE", "chroma")
+NUMPY_INDEX_DIR = "numpy_index"
+
+# Chunking of partitioned documents
+CHUNK_MAX_TOKENS = int(os.getenv("CHUNK_MAX_TOKENS", "800"))  # Upper bound on tokens per chunk
+CHUNK_OVERLAP_TOKENS = int(os.getenv("CHUNK_OVERLAP_TOKENS", "100"))  # Tokens repeated between consecutive chunks
+
+# Batching limits for embedding requests and Chroma writes
+EMBEDDING_BATCH_MAX_TOKENS = int(os.getenv("EMBEDDING_BATCH_MAX_TOKENS", "100000"))  # Tokens per embeddings request
+EMBEDDING_BATCH_MAX_ITEMS = int(os.getenv("EMBEDDING_BATCH_MAX_ITEMS", "256"))  # Inputs per embeddings request
+CHROMA_ADD_BATCH_SIZE = int(os.getenv("CHROMA_ADD_BATCH_SIZE", "500"))  # Chunks per collection.add call
+
+# Persistent embedding cache keyed by (model, normalized text)
+EMBEDDING_CACHE_DB = "embedding_cache.db"
+EMBEDDING_CACHE_MAX_ENTRIES = int(os.getenv("EMBEDDING_CACHE_MAX_ENTRIES", "200000"))  # LRU-evicted above this
+
+# Matrix format of the NumPy index (float32, float16 or int8); only used with RETRIEVAL_ENGINE=numpy
+EMBEDDING_STORAGE = os.getenv("EMBEDDING_STORAGE", "float32")
+
+# Ingest-time chunk deduplication: exact content hash, then MinHash over word shingles
+DEDUP_ENABLED = os.getenv("DEDUP_ENABLED", "true").lower() == "true"
+DEDUP_DB = "dedup.db"
+# Estimated Jaccard similarity at which a stored chunk joins a near-duplicate group (collapsed at retrieval)
+DEDUP_SIMILARITY = float(os.getenv("DEDUP_SIMILARITY", "0.9"))
+MINHASH_PERMUTATIONS = 64  # Signature length
+MINHASH_BANDS = 16  # LSH bands (of MINHASH_PERMUTATIONS / MINHASH_BANDS rows) used to find candidates
+SHINGLE_WORDS = 5  # Words per shingle
+
+# Partitioned elements cached on disk by file content hash
+PARTITION_CACHE_DIR = "partition_cache"
+# unstructured strategy for PDFs: "hi_res" (layout model, downloaded on first use, finds tables) or "fast" (text layer only)
+PDF_PARTITION_STRATEGY = os.getenv("PDF_PARTITION_STRATEGY", "hi_res")
+
+# Images extracted from PDF and DOCX uploads, stored downscaled by content hash
+IMAGE_STORE_DIR = "image_store"
+IMAGE_SUMMARY_DB = "image_summaries.db"  # Image summaries cached by image content hash
+IMAGE_MAX_SIDE = 512  # Longest side, in pixels, of the stored (and summarized) copy
+IMAGE_MIN_SIDE = 48  # Smaller images (bullets, spacers, rules) are skipped
+IMAGE_WORKERS = int(os.getenv("IMAGE_WORKERS", "4"))  # Threads decoding and downscaling images per document
+
+# Concurrent table/image summary requests per document (total in flight is at most
+# INGEST_WORKERS * SUMMARY_CONCURRENCY per process)
+SUMMARY_CONCURRENCY = int(os.getenv("SUMMARY_CONCURRENCY", "4"))
+
+# Background ingestion workers
+INGEST_WORKERS = int(os.getenv("INGEST_WORKERS", "2"))  # Concurrent ingestion jobs per process
+JOB_POLL_INTERVAL = 2.0  # Seconds an idle worker waits before checking the queue again
+JOBS_DIR = "ingest_jobs"  # Directory for per-stage job checkpoints
+
+# Query-side caches
+QUERY_EMBEDDING_CACHE_SIZE = int(os.getenv("QUERY_EMBEDDING_CACHE_SIZE", "1024"))  # Question embeddings kept in memory
+ANSWER_CACHE_ENABLED = os.getenv("ANSWER_CACHE_ENABLED", "false").lower() == "true"
+ANSWER_CACHE_SIZE = int(os.getenv("ANSWER_CACHE_SIZE", "256"))  # Answers kept per process
+ANSWER_CACHE_SIMILARITY = float(os.getenv("ANSWER_CACHE_SIMILARITY", "0.95"))  # Cosine similarity needed for a hit
+CORPUS_VERSION_FILE = "corpus_version"  # Rewritten on every document or wiki change
+
+# Load the tokenizer, OpenAI clients and the Chroma index when the app starts instead of
+# on the first request (see warmup.py)
+WARM_UP = os.getenv("WARM_UP", "false").lower() == "true"
+
+# Print a JSON line with per-stage timings for every answer, upload and wiki save
+TRACE_LOGS = os.getenv("TRACE_LOGS", "false").lower() == "true"
+
+# Server-side retrieval state (last query, sources and answer); the session cookie only holds its key
+RETRIEVAL_STATE_DB = "retrieval_state.db"
+RETRIEVAL_STATE_TTL = int(os.getenv("RETRIEVAL_STATE_TTL", str(24 * 3600)))  # Seconds an idle session's state is kept
@@ -1,11 +1,184 @@
-import chromadb
-from chromadb.utils.embedding_functions import OpenAIEmbeddingFunction
-from config import OPENAI_API_KEY, EMBEDDINGS_MODEL
+import os
+import json
+import uuid
+import fcntl
+import threading
+from typing import List
+from contextlib import contextmanager
+from config import OPENAI_API_KEY, EMBEDDINGS_MODEL, EMBEDDING_DIMENSIONS
+from embedding_cache import cached_embed
+from metrics import record_openai
 
 DB_DIR = "chroma_db"  # Directory for Chroma persistence
-
-# Use the OpenAI embedding function with text-embedding-3-large
-embedding_function = OpenAIEmbeddingFunction(model_name=EMBEDDINGS_MODEL, api_key=OPENAI_API_KEY)
-chroma_client = chromadb.PersistentClient(path=DB_DIR)
 COLLECTION_NAME = "rag_chunks"
-collection = chroma_client.get_or_create_collection(name=COLLECTION_NAME, embedding_function=embedding_function)
+# Names the collection serving reads and writes, with the embedding model it was built with.
+# reindex.py rewrites it to switch every process over to a freshly built collection.
+ACTIVE_INDEX_FILE = os.path.join(DB_DIR, "active_index.json")
+
+# Writers hold it shared; reindex.py holds it exclusively while it catches up and switches collections
+WRITE_LOCK_FILE = os.path.join(DB_DIR, "write.lock")
+
+def embedding_model_key(model: str, dimensions: int = None) -> str:
+    """Identifies an embedding space, e.g. in the embedding cache: the model plus any reduced dimensions."""
+    return f"{model}@{dimensions}" if dimensions else model
+
+class CachedEmbeddingFunction:
+    """
+    Wraps an embedding function so texts already in the embedding cache are not re-embedded.
+    It follows Chroma's EmbeddingFunction protocol without importing chromadb.
+    """
+
+    def __init__(self, inner, model_name: str):
+        self._inner = inner
+        self._model_name = model_name
+
+    @property
+    def model_key(self) -> str:
+        """The embedding space of the vectors it returns, see embedding_model_key."""
+        return self._model_name
+
+    def __call__(self, input: List[str]) -> List[List[float]]:
+        return cached_embed(self._model_name, list(input), self._embed_uncached)
+
+    def _embed_uncached(self, texts):
+        record_openai("query_embedding", self._model_name, inputs=len(texts))
+        return list(self._inner(texts))
+
+def make_embedding_function(model: str, dimensions: int = None) -> CachedEmbeddingFunction:
+    """OpenAI embeddings for the given model (and optional reduced dimensions), behind the persistent cache."""
+    from chromadb.utils.embedding_functions import OpenAIEmbeddingFunction
+    inner = OpenAIEmbeddingFunction(model_name=model, api_key=OPENAI_API_KEY, dimensions=dimensions)
+    return CachedEmbeddingFunction(inner, embedding_model_key(model, dimensions))
+
+def read_active_index() -> dict:
+    """Returns {"collection", "model", "dimensions", ...} for the active collection."""
+    try:
+        with open(ACTIVE_INDEX_FILE, "r") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        # Until the first re-index, the original collection with the configured model is active
+        return {"collection": COLLECTION_NAME, "model": EMBEDDINGS_MODEL, "dimensions": EMBEDDING_DIMENSIONS}
+
+def write_active_index(info: dict):
+    """Atomically points every process at another collection."""
+    os.makedirs(DB_DIR, exist_ok=True)
+    tmp_path = f"{ACTIVE_INDEX_FILE}.{uuid.uuid4().hex}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(info, f, indent=2)
+    os.replace(tmp_path, ACTIVE_INDEX_FILE)
+
+@contextmanager
+def collection_write_lock(exclusive: bool = False):
+    """
+    Cross-process lock around writes to the active collection. Writes share it, so
+    they run concurrently; a collection switch takes it exclusively, so no write
+    lands in the old collection after its last catch-up pass.
+    """
+    os.makedirs(DB_DIR, exist_ok=True)
+    with open(WRITE_LOCK_FILE, "a") as f:
+        fcntl.flock(f, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+_chroma_client = None
+_chroma_client_lock = threading.Lock()
+
+def get_chroma_client():
+    """The persistent Chroma client. chromadb is imported and the client opened on first use."""
+    global _chroma_client
+    if _chroma_client is None:
+        with _chroma_client_lock:
+            if _chroma_client is None:
+                import chromadb
+                _chroma_client = chromadb.PersistentClient(path=DB_DIR)
+    return _chroma_client
+
+def check_dimensions(collection, info: dict):
+    """
+    Fails early when a collection holds vectors of another size than its configured
+    dimensions, e.g. EMBEDDING_DIMENSIONS set on a deployment with a full-size index.
+    """
+    dimensions = info.get("dimensions")
+    if not dimensions:
+        return
+    sample = collection.get(limit=1, include=["embeddings"])
+    if sample.get("embeddings") is not None and len(sample["embeddings"]) and len(sample["embeddings"][0]) != dimensions:
+        raise RuntimeError(
+            f"Collection '{collection.name}' holds {len(sample['embeddings'][0])}-dimensional vectors, "
+            f"not {dimensions}. Convert it with: python reindex.py --dimensions {dimensions}"
+        )
+
+class ActiveIndex:
+    """
+    The collection and embedding function currently serving the app. The pointer file
+    is checked on each access (one stat call), so a switch made by reindex.py in another
+    process is picked up without a restart.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._mtime = None
+        self.info = None
+        self.collection = None
+        self.embedding_function = None
+
+    def _pointer_mtime(self):
+        try:
+            return os.stat(ACTIVE_INDEX_FILE).st_mtime_ns
+        except FileNotFoundError:
+            return 0
+
+    def refresh(self):
+        mtime = self._pointer_mtime()
+        if mtime == self._mtime and self.collection is not None:
+            return self
+        with self._lock:
+            if mtime != self._mtime or self.collection is None:
+                info = read_active_index()
+                embedding_function = make_embedding_function(info["model"], info.get("dimensions"))
+                collection = get_chroma_client().get_or_create_collection(
+                    name=info["collection"], embedding_function=embedding_function
+                )
+                check_dimensions(collection, info)
+                self.collection = collection
+                self.embedding_function = embedding_function
+                self.info = info
+                self._mtime = mtime
+        return self
+
+active_index = ActiveIndex()
+
+def check_active_dimensions():
+    """
+    Called at startup: fails when EMBEDDING_DIMENSIONS is set and the active collection
+    uses another size, then opens a collection with reduced dimensions so check_dimensions
+    compares them with its stored vectors. Otherwise chromadb is still only imported on first use.
+    """
+    info = read_active_index()
+    if EMBEDDING_DIMENSIONS and info.get("dimensions") != EMBEDDING_DIMENSIONS:
+        raise RuntimeError(
+            f"EMBEDDING_DIMENSIONS is {EMBEDDING_DIMENSIONS}, but the active collection '{info['collection']}' "
+            f"uses {info.get('dimensions') or 'the full size'}. "
+            f"Convert it with: python reindex.py --dimensions {EMBEDDING_DIMENSIONS}"
+        )
+    if info.get("dimensions"):
+        active_index.refresh()
+
+def get_collection():
+    """The Chroma collection reads and writes go to."""
+    return active_index.refresh().collection
+
+def get_embedding_function() -> CachedEmbeddingFunction:
+    """The embedding function matching the active collection's model."""
+    return active_index.refresh().embedding_function
+
+def get_active_index() -> dict:
+    """Pointer data of the active collection (name, embedding model and dimensions)."""
+    return active_index.refresh().info
+
+def get_embedding_model_key() -> str:
+    """The embedding space of the active collection, see embedding_model_key."""
+    info = get_active_index()
+    return embedding_model_key(info["model"], info.get("dimensions"))
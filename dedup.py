@@ -0,0 +1,279 @@
+#!/usr/bin/env python
+# Ingest-time chunk deduplication. Every stored chunk has a content hash and a MinHash
+# signature over word shingles. A new chunk with exactly the same text as a stored one is
+# not stored again but recorded as another reference to it; chunks are deleted from Chroma
+# only when the last document referring to them is deleted. A chunk whose estimated
+# Jaccard similarity to a stored one reaches DEDUP_SIMILARITY is stored anyway, since a
+# changed figure or name barely moves the estimate, and joins that chunk's near-duplicate
+# group instead; retrieval keeps only the best-ranked chunk of a group.
+import json
+import hashlib
+from typing import List, Optional
+import numpy as np
+
+from config import DEDUP_DB, DEDUP_SIMILARITY, MINHASH_PERMUTATIONS, MINHASH_BANDS, SHINGLE_WORDS
+from embedding_cache import normalize_text
+from lexical_index import where_sql
+from metrics import Counter
+from sqlite_pool import get_connection
+
+# Fixed seeds, so signatures stay comparable across processes and restarts
+_MERSENNE_PRIME = np.uint64((1 << 61) - 1)
+_MAX_HASH = np.uint64((1 << 32) - 1)
+_rng = np.random.RandomState(1)
+_PERM_A = _rng.randint(1, (1 << 32) - 1, size=MINHASH_PERMUTATIONS, dtype=np.uint64)
+_PERM_B = _rng.randint(0, (1 << 32) - 1, size=MINHASH_PERMUTATIONS, dtype=np.uint64)
+ROWS_PER_BAND = MINHASH_PERMUTATIONS // MINHASH_BANDS
+
+# A reference to a chunk that at least one other document refers to as well
+SHARED_REF = (
+    "EXISTS (SELECT 1 FROM chunk_refs AS other "
+    "WHERE other.chunk_id = chunk_refs.chunk_id AND other.doc_id != chunk_refs.doc_id)"
+)
+
+dedup_chunks = Counter("rag_dedup_chunks_total", "Chunks seen at ingest time by deduplication result.", ["result"])
+
+def init_dedup_db():
+    with get_connection(DEDUP_DB) as conn:
+        cur = conn.cursor()
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS chunk_fingerprints (
+                chunk_id TEXT PRIMARY KEY,
+                text_hash TEXT NOT NULL,
+                signature BLOB NOT NULL
+            )
+        """)
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_fingerprints_hash ON chunk_fingerprints (text_hash)")
+        # The first stored chunk of a chunk's near-duplicate group; NULL for a chunk that started its own
+        cur.execute("PRAGMA table_info(chunk_fingerprints)")
+        if "near_group" not in [row[1] for row in cur.fetchall()]:
+            cur.execute("ALTER TABLE chunk_fingerprints ADD COLUMN near_group TEXT")
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS lsh_buckets (
+                band INTEGER NOT NULL,
+                bucket TEXT NOT NULL,
+                chunk_id TEXT NOT NULL
+            )
+        """)
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_lsh_band_bucket ON lsh_buckets (band, bucket)")
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_lsh_chunk ON lsh_buckets (chunk_id)")
+        # One row per (chunk, document) it appears in, with the metadata the chunk would have
+        # had in that document, used when the document owning the stored copy is deleted
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS chunk_refs (
+                chunk_id TEXT NOT NULL,
+                doc_id TEXT NOT NULL,
+                metadata TEXT NOT NULL,
+                PRIMARY KEY (chunk_id, doc_id)
+            )
+        """)
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_chunk_refs_doc ON chunk_refs (doc_id)")
+        conn.commit()
+
+def text_hash(text: str) -> str:
+    return hashlib.sha256(normalize_text(text).encode("utf-8")).hexdigest()
+
+def shingles(text: str, size: int = SHINGLE_WORDS) -> set:
+    words = normalize_text(text).lower().split()
+    if len(words) <= size:
+        return {" ".join(words)}
+    return {" ".join(words[i:i + size]) for i in range(len(words) - size + 1)}
+
+def minhash(text: str) -> np.ndarray:
+    """MinHash signature of the text's word shingles (MINHASH_PERMUTATIONS 32-bit values)."""
+    hashes = np.array(
+        [int.from_bytes(hashlib.blake2b(s.encode("utf-8"), digest_size=4).digest(), "little")
+         for s in shingles(text)],
+        dtype=np.uint64
+    )
+    permuted = (np.outer(hashes, _PERM_A) + _PERM_B) % _MERSENNE_PRIME & _MAX_HASH
+    return permuted.min(axis=0).astype(np.uint32)
+
+def band_buckets(signature: np.ndarray) -> List[str]:
+    return [
+        hashlib.sha1(signature[band * ROWS_PER_BAND:(band + 1) * ROWS_PER_BAND].tobytes()).hexdigest()[:16]
+        for band in range(MINHASH_BANDS)
+    ]
+
+def similarity(a: np.ndarray, b: np.ndarray) -> float:
+    """Estimated Jaccard similarity of the shingle sets behind two signatures."""
+    return float(np.mean(a == b))
+
+def _find_match(cur, digest: str, signature: np.ndarray, buckets: List[str]):
+    """
+    Returns (chunk_id, "exact" | "near") for a stored chunk with the same text, or else
+    the most similar stored near duplicate, or (None, None).
+    """
+    cur.execute("SELECT chunk_id FROM chunk_fingerprints WHERE text_hash = ? LIMIT 1", (digest,))
+    row = cur.fetchone()
+    if row:
+        return row[0], "exact"
+    candidates = set()
+    for band, bucket in enumerate(buckets):
+        cur.execute("SELECT chunk_id FROM lsh_buckets WHERE band = ? AND bucket = ?", (band, bucket))
+        candidates.update(chunk_id for (chunk_id,) in cur.fetchall())
+    best_id, best = None, DEDUP_SIMILARITY
+    for chunk_id in candidates:
+        cur.execute("SELECT signature FROM chunk_fingerprints WHERE chunk_id = ?", (chunk_id,))
+        row = cur.fetchone()
+        if not row:
+            continue
+        score = similarity(signature, np.frombuffer(row[0], dtype=np.uint32))
+        if score >= best:
+            best_id, best = chunk_id, score
+    return (best_id, "near") if best_id else (None, None)
+
+def assign_chunks(doc_id: str, texts: List[str], chunk_ids: List[str], metadatas: List[dict]) -> List[Optional[str]]:
+    """
+    Records doc_id's chunks. For each chunk, returns the id of an already stored
+    chunk with the same text it now refers to, or None if the chunk must be stored
+    under its own id. Repeats within the document itself are folded as well.
+    Near duplicates are stored and added to the group of the chunk they match.
+    """
+    prepared = []
+    for text in texts:
+        signature = minhash(text)
+        prepared.append((text_hash(text), signature, band_buckets(signature)))
+
+    matches = []
+    with get_connection(DEDUP_DB) as conn:
+        cur = conn.cursor()
+        # Serializes concurrent ingestion, so two workers never both store the same boilerplate
+        cur.execute("BEGIN IMMEDIATE")
+        for chunk_id, metadata, (digest, signature, buckets) in zip(chunk_ids, metadatas, prepared):
+            match_id, result = _find_match(cur, digest, signature, buckets)
+            dedup_chunks.inc(result=result or "new")
+            if result != "exact":
+                group = None
+                if result == "near":
+                    cur.execute("SELECT COALESCE(near_group, chunk_id) FROM chunk_fingerprints WHERE chunk_id = ?",
+                                (match_id,))
+                    group = cur.fetchone()[0]
+                    match_id = None
+                cur.execute(
+                    "INSERT OR REPLACE INTO chunk_fingerprints (chunk_id, text_hash, signature, near_group) "
+                    "VALUES (?, ?, ?, ?)",
+                    (chunk_id, digest, signature.tobytes(), group)
+                )
+                cur.executemany(
+                    "INSERT INTO lsh_buckets (band, bucket, chunk_id) VALUES (?, ?, ?)",
+                    [(band, bucket, chunk_id) for band, bucket in enumerate(buckets)]
+                )
+            cur.execute(
+                "INSERT OR IGNORE INTO chunk_refs (chunk_id, doc_id, metadata) VALUES (?, ?, ?)",
+                (match_id or chunk_id, doc_id, json.dumps(metadata))
+            )
+            matches.append(match_id)
+        conn.commit()
+    return matches
+
+def _forget(cur, chunk_ids: List[str]):
+    for start in range(0, len(chunk_ids), 500):
+        batch = chunk_ids[start:start + 500]
+        placeholders = ", ".join("?" for _ in batch)
+        for table in ("chunk_fingerprints", "lsh_buckets", "chunk_refs"):
+            cur.execute(f"DELETE FROM {table} WHERE chunk_id IN ({placeholders})", batch)
+
+def release_document(doc_id: str):
+    """
+    Drops doc_id's references. Returns (orphaned, reassigned): the ids of chunks no
+    other document refers to, which should be deleted, and {chunk_id: metadata} for
+    shared chunks whose stored copy belonged to doc_id and now belongs to another document.
+    """
+    with get_connection(DEDUP_DB) as conn:
+        cur = conn.cursor()
+        cur.execute("BEGIN IMMEDIATE")
+        cur.execute("SELECT chunk_id FROM chunk_refs WHERE doc_id = ?", (doc_id,))
+        chunk_ids = [chunk_id for (chunk_id,) in cur.fetchall()]
+        cur.execute("DELETE FROM chunk_refs WHERE doc_id = ?", (doc_id,))
+        orphaned, reassigned = [], {}
+        for chunk_id in chunk_ids:
+            cur.execute("SELECT metadata FROM chunk_refs WHERE chunk_id = ? ORDER BY rowid LIMIT 1", (chunk_id,))
+            row = cur.fetchone()
+            if row is None:
+                orphaned.append(chunk_id)
+            else:
+                reassigned[chunk_id] = json.loads(row[0])
+        _forget(cur, orphaned)
+        conn.commit()
+    return orphaned, reassigned
+
+def near_duplicate_groups(chunk_ids: List[str]) -> dict:
+    """Maps each of chunk_ids to its near-duplicate group; chunks unknown to the index are their own group."""
+    groups = {chunk_id: chunk_id for chunk_id in chunk_ids}
+    with get_connection(DEDUP_DB) as conn:
+        cur = conn.cursor()
+        for start in range(0, len(chunk_ids), 500):
+            batch = chunk_ids[start:start + 500]
+            placeholders = ", ".join("?" for _ in batch)
+            cur.execute(
+                f"SELECT chunk_id, near_group FROM chunk_fingerprints "
+                f"WHERE chunk_id IN ({placeholders}) AND near_group IS NOT NULL", batch
+            )
+            groups.update(cur.fetchall())
+    return groups
+
+def shared_chunks_in_scope(where: dict) -> List[str]:
+    """
+    Ids of chunks shared between documents that a document matching where refers
+    to. The stored copy of a shared chunk only carries the metadata of the document
+    that owns it, so a scope filter on it misses the chunk for the other documents.
+    """
+    params = []
+    condition = where_sql(where, params, "chunk_refs.metadata")
+    with get_connection(DEDUP_DB) as conn:
+        cur = conn.cursor()
+        cur.execute(
+            f"SELECT DISTINCT chunk_id FROM chunk_refs WHERE {SHARED_REF} AND {condition}", params
+        )
+        return sorted(chunk_id for (chunk_id,) in cur.fetchall())
+
+def chunk_references(chunk_ids: List[str], where: dict = None) -> dict:
+    """
+    {chunk_id: [metadata, ...]} for the shared chunks among chunk_ids: the metadata
+    each referring document gives the chunk, restricted to documents matching where.
+    """
+    references = {}
+    with get_connection(DEDUP_DB) as conn:
+        cur = conn.cursor()
+        for start in range(0, len(chunk_ids), 500):
+            batch = chunk_ids[start:start + 500]
+            params = list(batch)
+            condition = f"AND {where_sql(where, params, 'chunk_refs.metadata')}" if where else ""
+            cur.execute(
+                f"SELECT chunk_id, metadata FROM chunk_refs WHERE chunk_id IN ({', '.join('?' for _ in batch)}) "
+                f"AND {SHARED_REF} {condition} ORDER BY rowid", params
+            )
+            for chunk_id, metadata in cur.fetchall():
+                references.setdefault(chunk_id, []).append(json.loads(metadata))
+    return references
+
+def tracked_chunks(chunk_ids: List[str]) -> set:
+    """The subset of chunk_ids known to the deduplication index (chunks stored before it existed are not)."""
+    found = set()
+    with get_connection(DEDUP_DB) as conn:
+        cur = conn.cursor()
+        for start in range(0, len(chunk_ids), 500):
+            batch = chunk_ids[start:start + 500]
+            placeholders = ", ".join("?" for _ in batch)
+            cur.execute(f"SELECT chunk_id FROM chunk_fingerprints WHERE chunk_id IN ({placeholders})", batch)
+            found.update(chunk_id for (chunk_id,) in cur.fetchall())
+    return found
+
+def forget_chunks(chunk_ids: List[str]):
+    """Removes fingerprints and references of chunks deleted from the index."""
+    if not chunk_ids:
+        return
+    with get_connection(DEDUP_DB) as conn:
+        cur = conn.cursor()
+        _forget(cur, list(chunk_ids))
+        conn.commit()
+
+def clear_dedup_index():
+    with get_connection(DEDUP_DB) as conn:
+        cur = conn.cursor()
+        for table in ("chunk_fingerprints", "lsh_buckets", "chunk_refs"):
+            cur.execute(f"DELETE FROM {table}")
+        conn.commit()
+
+init_dedup_db()
@@ -0,0 +1,132 @@
+import re
+import time
+import hashlib
+import threading
+import unicodedata
+from array import array
+from typing import List, Optional
+
+from config import EMBEDDING_CACHE_DB, EMBEDDING_CACHE_MAX_ENTRIES
+from metrics import CallbackMetric
+from sqlite_pool import get_connection
+
+# In-process counters; they reset when the process restarts
+_stats = {"hits": 0, "misses": 0}
+_stats_lock = threading.Lock()
+
+def init_embedding_cache():
+    with get_connection(EMBEDDING_CACHE_DB) as conn:
+        cur = conn.cursor()
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS embeddings (
+                key TEXT PRIMARY KEY,
+                model TEXT NOT NULL,
+                vector BLOB NOT NULL,
+                last_used REAL NOT NULL
+            )
+        """)
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_embeddings_last_used ON embeddings (last_used)")
+        conn.commit()
+
+def normalize_text(text: str) -> str:
+    """Normalizes unicode and collapses whitespace so trivially different inputs share an entry."""
+    return re.sub(r"\s+", " ", unicodedata.normalize("NFC", text)).strip()
+
+def cache_key(model: str, text: str) -> str:
+    return hashlib.sha256(f"{model}\x00{normalize_text(text)}".encode("utf-8")).hexdigest()
+
+def get_cached_embeddings(model: str, texts: List[str]) -> List[Optional[List[float]]]:
+    """Returns the cached vector for each text, or None where the cache has no entry."""
+    keys = [cache_key(model, text) for text in texts]
+    found = {}
+    with get_connection(EMBEDDING_CACHE_DB) as conn:
+        cur = conn.cursor()
+        unique_keys = list(set(keys))
+        # Stay well under SQLite's host parameter limit
+        for start in range(0, len(unique_keys), 500):
+            batch = unique_keys[start:start + 500]
+            placeholders = ", ".join("?" for _ in batch)
+            cur.execute(f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders})", batch)
+            for key, blob in cur.fetchall():
+                found[key] = array("f", blob).tolist()
+        if found:
+            now = time.time()
+            cur.executemany("UPDATE embeddings SET last_used = ? WHERE key = ?", [(now, key) for key in found])
+            conn.commit()
+
+    hits = sum(1 for key in keys if key in found)
+    with _stats_lock:
+        _stats["hits"] += hits
+        _stats["misses"] += len(keys) - hits
+    return [found.get(key) for key in keys]
+
+def put_cached_embeddings(model: str, texts: List[str], vectors: List[List[float]]):
+    """Stores vectors for texts and evicts the least recently used entries above the size limit."""
+    now = time.time()
+    rows = [
+        (cache_key(model, text), model, array("f", vector).tobytes(), now)
+        for text, vector in zip(texts, vectors)
+    ]
+    with get_connection(EMBEDDING_CACHE_DB) as conn:
+        cur = conn.cursor()
+        cur.executemany(
+            "INSERT OR REPLACE INTO embeddings (key, model, vector, last_used) VALUES (?, ?, ?, ?)",
+            rows
+        )
+        cur.execute("SELECT COUNT(*) FROM embeddings")
+        overflow = cur.fetchone()[0] - EMBEDDING_CACHE_MAX_ENTRIES
+        if overflow > 0:
+            cur.execute(
+                "DELETE FROM embeddings WHERE key IN "
+                "(SELECT key FROM embeddings ORDER BY last_used LIMIT ?)",
+                (overflow,)
+            )
+        conn.commit()
+
+def cached_embed(model: str, texts: List[str], embed_fn) -> List[List[float]]:
+    """
+    Returns embeddings for texts, calling embed_fn(missing_texts) only for texts
+    that are not in the cache. Duplicate texts within a call are embedded once.
+    """
+    vectors = get_cached_embeddings(model, texts)
+    missing = {}
+    for text, vector in zip(texts, vectors):
+        if vector is None:
+            missing.setdefault(cache_key(model, text), text)
+    if missing:
+        missing_texts = list(missing.values())
+        new_vectors = embed_fn(missing_texts)
+        put_cached_embeddings(model, missing_texts, new_vectors)
+        by_key = {cache_key(model, text): vector for text, vector in zip(missing_texts, new_vectors)}
+        vectors = [
+            vector if vector is not None else by_key[cache_key(model, text)]
+            for text, vector in zip(texts, vectors)
+        ]
+    return vectors
+
+def embedding_cache_stats() -> dict:
+    with get_connection(EMBEDDING_CACHE_DB) as conn:
+        cur = conn.cursor()
+        cur.execute("SELECT COUNT(*) FROM embeddings")
+        entries = cur.fetchone()[0]
+    with _stats_lock:
+        hits, misses = _stats["hits"], _stats["misses"]
+    lookups = hits + misses
+    return {
+        "hits": hits,
+        "misses": misses,
+        "hit_rate": round(hits / lookups, 4) if lookups else 0.0,
+        "entries": entries,
+        "max_entries": EMBEDDING_CACHE_MAX_ENTRIES
+    }
+
+init_embedding_cache()
+
+CallbackMetric(
+    "rag_embedding_cache_lookups_total", "Persistent embedding cache lookups by result.", "counter", ["result"],
+    lambda: {("hit",): _stats["hits"], ("miss",): _stats["misses"]}
+)
+CallbackMetric(
+    "rag_embedding_cache_entries", "Vectors stored in the persistent embedding cache.", "gauge", [],
+    lambda: {(): embedding_cache_stats()["entries"]}
+)
@@ -0,0 +1,180 @@
+#!/usr/bin/env python
+# Images embedded in uploaded documents. They are pulled out of PDFs (pypdf, page by page)
+# and DOCX files (word/media in the zip), decoded and downscaled in a thread pool, and
+# stored once per content hash under IMAGE_STORE_DIR. Image summaries are cached by the
+# same hash, so a logo or chart repeated across the corpus is summarized only once.
+import io
+import os
+import re
+import time
+import uuid
+import base64
+import hashlib
+import zipfile
+import threading
+from typing import List, Optional
+from concurrent.futures import ThreadPoolExecutor
+
+from config import IMAGE_STORE_DIR, IMAGE_MAX_SIDE, IMAGE_MIN_SIDE, IMAGE_WORKERS, IMAGE_SUMMARY_DB
+from metrics import Counter, timed
+from sqlite_pool import get_connection
+
+image_summary_lookups = Counter(
+    "rag_image_summary_cache_lookups_total", "Image summary cache lookups by result.", ["result"]
+)
+
+def init_image_summary_cache():
+    with get_connection(IMAGE_SUMMARY_DB) as conn:
+        cur = conn.cursor()
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS image_summaries (
+                image_hash TEXT PRIMARY KEY,
+                summary TEXT NOT NULL,
+                model TEXT NOT NULL,
+                created_at REAL NOT NULL
+            )
+        """)
+        conn.commit()
+
+def _pdf_images(file_path: str) -> List[tuple]:
+    """
+    Stores every image XObject in a PDF and returns their (page_number, image_hash).
+    pypdf decodes each image with Pillow and re-encodes it when its bytes are read,
+    so whole pages go to the thread pool. A PdfReader is not safe to share between
+    threads, so each worker thread opens the file with a reader of its own.
+    """
+    from pypdf import PdfReader
+    page_count = len(PdfReader(file_path).pages)
+    if not page_count:
+        return []
+    local = threading.local()
+
+    def page_images(page_number):
+        if not hasattr(local, "reader"):
+            local.reader = PdfReader(file_path)
+        try:
+            page_images = list(local.reader.pages[page_number - 1].images)
+        except Exception as e:
+            print(f"Could not list images on page {page_number} of {file_path}: {e}")
+            return []
+        stored = []
+        for image in page_images:
+            try:
+                data = image.data
+            except Exception as e:
+                print(f"Could not read image {image.name} on page {page_number} of {file_path}: {e}")
+                continue
+            stored.append((page_number, store_image(data)))
+        return stored
+
+    with ThreadPoolExecutor(max_workers=min(IMAGE_WORKERS, page_count)) as pool:
+        return [found for page in pool.map(page_images, range(1, page_count + 1)) for found in page]
+
+def _store_images(found: List[tuple]) -> List[tuple]:
+    """Stores (page_number, image_bytes) pairs in the thread pool; returns their (page_number, image_hash)."""
+    if not found:
+        return []
+    # Decoding and resizing happen in Pillow's C code, which releases the GIL
+    with ThreadPoolExecutor(max_workers=min(IMAGE_WORKERS, len(found))) as pool:
+        hashes = list(pool.map(store_image, [data for _, data in found]))
+    return [(page, image_hash) for (page, _), image_hash in zip(found, hashes)]
+
+def _docx_images(file_path: str):
+    """Yields (None, image_bytes) for the media files of a DOCX, in their numbered order."""
+    with zipfile.ZipFile(file_path) as z:
+        names = [name for name in z.namelist() if name.startswith("word/media/")]
+        names.sort(key=lambda name: [int(part) if part.isdigit() else part for part in re.split(r"(\d+)", name)])
+        for name in names:
+            yield None, z.read(name)
+
+def image_path(image_hash: str) -> str:
+    return os.path.join(IMAGE_STORE_DIR, f"{image_hash}.jpg")
+
+def store_image(data: bytes) -> Optional[str]:
+    """
+    Downscales an image to at most IMAGE_MAX_SIDE pixels per side and stores it as JPEG
+    under its content hash. Returns the hash, or None for unreadable or tiny images
+    (spacers, bullets and rules).
+    """
+    image_hash = hashlib.sha256(data).hexdigest()
+    path = image_path(image_hash)
+    if os.path.exists(path):
+        return image_hash
+    from PIL import Image
+    try:
+        img = Image.open(io.BytesIO(data))
+        if min(img.size) < IMAGE_MIN_SIDE:
+            return None
+        img.thumbnail((IMAGE_MAX_SIDE, IMAGE_MAX_SIDE))
+        if img.mode not in ("RGB", "L"):
+            img = img.convert("RGB")
+        buffer = io.BytesIO()
+        img.save(buffer, format="JPEG", quality=70)
+    except Exception as e:
+        print(f"Skipping unreadable image {image_hash[:12]}: {e}")
+        return None
+    os.makedirs(IMAGE_STORE_DIR, exist_ok=True)
+    tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(buffer.getvalue())
+    os.replace(tmp_path, path)
+    return image_hash
+
+def extract_images(file_path: str) -> List[dict]:
+    """
+    Returns {"category": "Image", "text": "", "page", "image_hash"} elements for the
+    images in a PDF, DOCX or standalone image file, in document order.
+    """
+    file_ext = os.path.splitext(file_path)[1].lower()
+    try:
+        with timed("image_extract"):
+            if file_ext == ".pdf":
+                stored = _pdf_images(file_path)
+            elif file_ext == ".docx":
+                stored = _store_images(list(_docx_images(file_path)))
+            elif file_ext in (".png", ".jpg", ".jpeg"):
+                with open(file_path, "rb") as f:
+                    stored = _store_images([(None, f.read())])
+            else:
+                return []
+    except Exception as e:
+        print(f"Could not extract images from {file_path}: {e}")
+        return []
+    elements, seen = [], set()
+    for page, image_hash in stored:
+        # The same image repeated in one document (a logo on every page) is kept once
+        if image_hash is None or image_hash in seen:
+            continue
+        seen.add(image_hash)
+        elements.append({"category": "Image", "text": "", "page": page, "image_hash": image_hash})
+    return elements
+
+def image_base64(image_hash: str) -> str:
+    with open(image_path(image_hash), "rb") as f:
+        return base64.b64encode(f.read()).decode("utf-8")
+
+def get_cached_summaries(image_hashes: List[str]) -> dict:
+    """Returns {image_hash: summary} for the hashes already summarized."""
+    found = {}
+    unique = list(set(image_hashes))
+    with get_connection(IMAGE_SUMMARY_DB) as conn:
+        cur = conn.cursor()
+        for start in range(0, len(unique), 500):
+            batch = unique[start:start + 500]
+            placeholders = ", ".join("?" for _ in batch)
+            cur.execute(f"SELECT image_hash, summary FROM image_summaries WHERE image_hash IN ({placeholders})", batch)
+            found.update(cur.fetchall())
+    for image_hash in unique:
+        image_summary_lookups.inc(result="hit" if image_hash in found else "miss")
+    return found
+
+def put_cached_summary(image_hash: str, summary: str, model: str):
+    with get_connection(IMAGE_SUMMARY_DB) as conn:
+        cur = conn.cursor()
+        cur.execute(
+            "INSERT OR REPLACE INTO image_summaries (image_hash, summary, model, created_at) VALUES (?, ?, ?, ?)",
+            (image_hash, summary, model, time.time())
+        )
+        conn.commit()
+
+init_image_summary_cache()
@@ -0,0 +1,156 @@
+#!/usr/bin/env python
+# BM25 lexical index (SQLite FTS5) over every chunk stored in Chroma. It catches exact
+# matches such as fund names, ISIN codes and policy numbers that vector search misses.
+import re
+import json
+from typing import List
+
+from config import LEXICAL_DB
+from sqlite_pool import get_connection
+
+# Common words that would match nearly every chunk and only slow the query down
+STOPWORDS = {
+    "a", "an", "and", "are", "as", "at", "be", "by", "can", "do", "does", "for", "from",
+    "has", "have", "how", "i", "in", "is", "it", "me", "my", "of", "on", "or", "our",
+    "that", "the", "this", "to", "was", "we", "what", "when", "where", "which", "who",
+    "why", "with", "you", "your"
+}
+MAX_QUERY_TERMS = 32
+
+def init_lexical_index():
+    with get_connection(LEXICAL_DB) as conn:
+        cur = conn.cursor()
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS chunks (
+                rowid INTEGER PRIMARY KEY,
+                chunk_id TEXT UNIQUE NOT NULL,
+                metadata TEXT NOT NULL
+            )
+        """)
+        cur.execute("""
+            CREATE VIRTUAL TABLE IF NOT EXISTS chunks_fts
+            USING fts5(text, tokenize = 'unicode61 remove_diacritics 2')
+        """)
+        conn.commit()
+
+def _delete_rows(cur, chunk_ids: List[str]):
+    for start in range(0, len(chunk_ids), 500):
+        batch = chunk_ids[start:start + 500]
+        placeholders = ", ".join("?" for _ in batch)
+        cur.execute(f"SELECT rowid FROM chunks WHERE chunk_id IN ({placeholders})", batch)
+        rowids = [(row[0],) for row in cur.fetchall()]
+        cur.executemany("DELETE FROM chunks_fts WHERE rowid = ?", rowids)
+        cur.executemany("DELETE FROM chunks WHERE rowid = ?", rowids)
+
+def add_to_lexical_index(chunk_ids: List[str], documents: List[str], metadatas: List[dict]):
+    """Indexes chunks, replacing any existing entries with the same ids."""
+    with get_connection(LEXICAL_DB) as conn:
+        cur = conn.cursor()
+        _delete_rows(cur, list(chunk_ids))
+        for chunk_id, text, metadata in zip(chunk_ids, documents, metadatas):
+            cur.execute(
+                "INSERT INTO chunks (chunk_id, metadata) VALUES (?, ?)",
+                (chunk_id, json.dumps(metadata))
+            )
+            cur.execute("INSERT INTO chunks_fts (rowid, text) VALUES (?, ?)", (cur.lastrowid, text))
+        conn.commit()
+
+def delete_from_lexical_index(chunk_ids: List[str]):
+    with get_connection(LEXICAL_DB) as conn:
+        cur = conn.cursor()
+        _delete_rows(cur, list(chunk_ids))
+        conn.commit()
+
+def clear_lexical_index():
+    with get_connection(LEXICAL_DB) as conn:
+        cur = conn.cursor()
+        cur.execute("DELETE FROM chunks_fts")
+        cur.execute("DELETE FROM chunks")
+        conn.commit()
+
+def build_match_query(text: str) -> str:
+    """Turns free text into an FTS5 query that ORs the quoted, de-duplicated terms."""
+    terms = []
+    for term in re.findall(r"\w+", text.lower()):
+        if term in STOPWORDS or term in terms:
+            continue
+        terms.append(term)
+        if len(terms) >= MAX_QUERY_TERMS:
+            break
+    return " OR ".join(f'"{term}"' for term in terms)
+
+def where_sql(where: dict, params: list, column: str = "chunks.metadata") -> str:
+    """
+    Translates the subset of Chroma's `where` syntax used for retrieval scopes
+    ($and, $or, $eq, $ne, $in, $nin) into a condition on the metadata JSON stored
+    in column, appending its parameters to params. As in Chroma, $ne and $nin
+    match chunks that lack the key.
+    """
+    if "$and" in where or "$or" in where:
+        operator = "$and" if "$and" in where else "$or"
+        joined = f" {operator[1:].upper()} ".join(where_sql(part, params, column) for part in where[operator])
+        return f"({joined})"
+    conditions = []
+    for key, condition in where.items():
+        if not re.fullmatch(r"\w+", key):
+            raise ValueError(f"Unsupported metadata key: {key!r}")
+        field = f"json_extract({column}, '$.{key}')"
+        operator, value = next(iter(condition.items())) if isinstance(condition, dict) else ("$eq", condition)
+        if operator in ("$in", "$nin"):
+            placeholders = ", ".join("?" for _ in value)
+            if operator == "$in":
+                conditions.append(f"{field} IN ({placeholders})")
+            else:
+                conditions.append(f"({field} IS NULL OR {field} NOT IN ({placeholders}))")
+            params.extend(value)
+        elif operator in ("$eq", "$ne"):
+            conditions.append(f"{field} {'=' if operator == '$eq' else 'IS NOT'} ?")
+            params.append(value)
+        else:
+            raise ValueError(f"Unsupported metadata operator: {operator}")
+    return " AND ".join(conditions)
+
+def lexical_search(text: str, n_results: int, where: dict = None) -> List[dict]:
+    """
+    Returns up to n_results {"id", "doc_text", "meta", "bm25"} matches, best first,
+    optionally restricted by a `where` metadata filter.
+    """
+    match_query = build_match_query(text)
+    if not match_query:
+        return []
+    params = [match_query]
+    condition = f"AND {where_sql(where, params)} " if where else ""
+    params.append(n_results)
+    with get_connection(LEXICAL_DB) as conn:
+        cur = conn.cursor()
+        cur.execute(
+            "SELECT chunks.chunk_id, chunks_fts.text, chunks.metadata, bm25(chunks_fts) AS score "
+            "FROM chunks_fts JOIN chunks ON chunks.rowid = chunks_fts.rowid "
+            f"WHERE chunks_fts MATCH ? {condition}ORDER BY score LIMIT ?",
+            params
+        )
+        rows = cur.fetchall()
+    return [
+        {"id": chunk_id, "doc_text": text, "meta": json.loads(metadata), "bm25": score}
+        for chunk_id, text, metadata, score in rows
+    ]
+
+def rebuild_lexical_index(batch_size: int = 1000):
+    """Re-creates the lexical index from the chunks currently stored in Chroma."""
+    from database import get_collection
+    collection = get_collection()
+    clear_lexical_index()
+    offset = 0
+    while True:
+        batch = collection.get(include=["documents", "metadatas"], limit=batch_size, offset=offset)
+        if not batch["ids"]:
+            break
+        add_to_lexical_index(batch["ids"], batch["documents"], batch["metadatas"])
+        offset += len(batch["ids"])
+    return offset
+
+init_lexical_index()
+
+if __name__ == "__main__":
+    total = rebuild_lexical_index()
+    print(f"Lexical index rebuilt with {total} chunks.")
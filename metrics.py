@@ -0,0 +1,178 @@
+#!/usr/bin/env python
+# In-process metrics (latency histograms, counters and callback gauges) rendered in the
+# Prometheus text format at /metrics, plus optional per-request trace logs. Values are
+# per process; with several server workers each one reports its own.
+import json
+import time
+import uuid
+import threading
+import contextvars
+from contextlib import contextmanager
+
+from config import TRACE_LOGS
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+_registry = []
+_registry_lock = threading.Lock()
+
+def _format_labels(labelnames, values, extra=()):
+    pairs = list(zip(labelnames, values)) + list(extra)
+    if not pairs:
+        return ""
+    escaped = (str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, v in pairs)
+    return "{" + ",".join(f'{k}="{v}"' for (k, _), v in zip(pairs, escaped)) + "}"
+
+class Counter:
+    def __init__(self, name, help_text, labelnames=()):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+        with _registry_lock:
+            _registry.append(self)
+
+    def inc(self, amount=1, **labels):
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {value}")
+        return lines
+
+class Histogram:
+    def __init__(self, name, help_text, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._values = {}  # labels -> [bucket counts..., sum, count]
+        self._lock = threading.Lock()
+        with _registry_lock:
+            _registry.append(self)
+
+    def observe(self, value, **labels):
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        with self._lock:
+            state = self._values.setdefault(key, [0] * len(self.buckets) + [0.0, 0])
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[i] += 1
+            state[-2] += value
+            state[-1] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for key, state in sorted(self._values.items()):
+                for bound, count in zip(self.buckets, state):
+                    labels = _format_labels(self.labelnames, key, [("le", bound)])
+                    lines.append(f"{self.name}_bucket{labels} {count}")
+                labels = _format_labels(self.labelnames, key, [("le", "+Inf")])
+                lines.append(f"{self.name}_bucket{labels} {state[-1]}")
+                lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {round(state[-2], 6)}")
+                lines.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {state[-1]}")
+        return lines
+
+class CallbackMetric:
+    """A metric whose samples are read at scrape time, e.g. cache statistics kept elsewhere."""
+
+    def __init__(self, name, help_text, metric_type, labelnames, callback):
+        self.name = name
+        self.help = help_text
+        self.type = metric_type
+        self.labelnames = tuple(labelnames)
+        self.callback = callback
+        with _registry_lock:
+            _registry.append(self)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.type}"]
+        try:
+            samples = self.callback()
+        except Exception as e:
+            print(f"Warning: could not collect metric {self.name}: {e}")
+            return lines
+        for key, value in sorted(samples.items()):
+            lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {value}")
+        return lines
+
+stage_seconds = Histogram(
+    "rag_stage_duration_seconds", "Time spent in each ingestion and query stage.", ["stage"]
+)
+openai_requests = Counter(
+    "rag_openai_requests_total", "OpenAI API requests by operation and model.", ["operation", "model"]
+)
+openai_tokens = Counter(
+    "rag_openai_tokens_total", "OpenAI tokens reported by the API, by operation, model and kind.",
+    ["operation", "model", "kind"]
+)
+openai_inputs = Counter(
+    "rag_openai_embedding_inputs_total", "Texts sent to the embeddings API.", ["model"]
+)
+
+def render_metrics() -> str:
+    """Returns every registered metric in the Prometheus text exposition format."""
+    with _registry_lock:
+        metrics = list(_registry)
+    lines = []
+    for metric in metrics:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+def record_openai(operation: str, model: str, usage=None, inputs: int = None):
+    """Counts one OpenAI request and, when the response reports usage, its tokens."""
+    openai_requests.inc(operation=operation, model=model)
+    if inputs is not None:
+        openai_inputs.inc(inputs, model=model)
+    if usage is None:
+        return
+    prompt_tokens = getattr(usage, "prompt_tokens", None)
+    completion_tokens = getattr(usage, "completion_tokens", None)
+    if prompt_tokens:
+        openai_tokens.inc(prompt_tokens, operation=operation, model=model, kind="prompt")
+    if completion_tokens:
+        openai_tokens.inc(completion_tokens, operation=operation, model=model, kind="completion")
+
+# The active trace of the current request or job, if trace logs are enabled
+_current_trace = contextvars.ContextVar("rag_trace", default=None)
+
+@contextmanager
+def timed(stage: str):
+    """Times a block into the stage histogram and the active trace."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        stage_seconds.observe(elapsed, stage=stage)
+        active = _current_trace.get()
+        if active is not None:
+            active["stages"].append({"stage": stage, "ms": round(elapsed * 1000, 2)})
+
+@contextmanager
+def trace(name: str, **fields):
+    """
+    Collects the stages timed inside the block and prints them as one JSON log line
+    when TRACE_LOGS is enabled. Nested traces are folded into the outer one.
+    """
+    if not TRACE_LOGS or _current_trace.get() is not None:
+        yield
+        return
+    active = {"trace": name, "trace_id": uuid.uuid4().hex[:16], **fields, "stages": []}
+    token = _current_trace.set(active)
+    start = time.perf_counter()
+    try:
+        yield
+    except Exception as e:
+        active["error"] = str(e)
+        raise
+    finally:
+        _current_trace.reset(token)
+        active["total_ms"] = round((time.perf_counter() - start) * 1000, 2)
+        print(json.dumps(active))
@@ -0,0 +1,464 @@
+#!/usr/bin/env python
+# In-process exact vector search for small and medium corpora (RETRIEVAL_ENGINE=numpy).
+# Every chunk embedding of a collection lives in one contiguous matrix, memory-mapped from
+# NUMPY_INDEX_DIR/<collection>/vectors.<f32|f16|i8> in the EMBEDDING_STORAGE format (int8 rows
+# with a per-row scale in scales.f32), with a parallel row table (id, text, metadata,
+# tombstone) in SQLite. A query is one matrix-vector product masked by the `where` filter,
+# without going through Chroma. Chunk writes append rows or set tombstones; every process
+# catches up with the rows written since its last query, so the index is never reloaded in
+# full. Build (and compact) it from the active collection with:
+#
+#   python numpy_index.py
+import os
+import json
+import threading
+from typing import List, Optional
+import numpy as np
+
+from config import NUMPY_INDEX_DIR, EMBEDDING_STORAGE
+from quantization import STORAGE_DTYPES, quantize_int8
+from sqlite_pool import get_connection
+
+INITIAL_CAPACITY = 1024  # Rows allocated in a new vectors file; it doubles when full
+VECTOR_FILES = {"float32": "vectors.f32", "float16": "vectors.f16", "int8": "vectors.i8"}
+SCORE_BLOCK_VALUES = 1 << 24  # Quantized rows are converted to float32 this many values at a time
+
+class NumpyIndex:
+    """The exact-search index of one Chroma collection."""
+
+    def __init__(self, collection_name: str):
+        self.directory = os.path.join(NUMPY_INDEX_DIR, collection_name)
+        self.db_path = os.path.join(self.directory, "index.db")
+        self.scales_path = os.path.join(self.directory, "scales.f32")
+        self._lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        self.generation = None
+        self.last_seq = 0
+        self.count = 0
+        self.ids = []
+        self.rows_by_id = {}
+        self.documents = []
+        self.metadatas = []
+        self.alive = np.zeros(0, dtype=bool)
+        self.norms = np.zeros(0, dtype=np.float32)
+        self.dtype = "float32"
+        self.vectors = None
+        self.scales = None
+        self._columns = {}
+
+    def vectors_path(self, dtype: str) -> str:
+        return os.path.join(self.directory, VECTOR_FILES[dtype])
+
+    def exists(self) -> bool:
+        return os.path.exists(self.db_path)
+
+    def _init_db(self):
+        os.makedirs(self.directory, exist_ok=True)
+        with get_connection(self.db_path) as conn:
+            cur = conn.cursor()
+            cur.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+            cur.execute("""
+                CREATE TABLE IF NOT EXISTS rows (
+                    row INTEGER PRIMARY KEY,
+                    chunk_id TEXT NOT NULL,
+                    document TEXT,
+                    metadata TEXT NOT NULL,
+                    deleted INTEGER NOT NULL DEFAULT 0,
+                    seq INTEGER NOT NULL
+                )
+            """)
+            cur.execute("CREATE INDEX IF NOT EXISTS idx_rows_seq ON rows (seq)")
+            cur.execute("CREATE INDEX IF NOT EXISTS idx_rows_chunk ON rows (chunk_id)")
+            conn.commit()
+
+    @staticmethod
+    def _meta(cur) -> dict:
+        cur.execute("SELECT key, value FROM meta")
+        return dict(cur.fetchall())
+
+    # Writes. Each runs in one BEGIN IMMEDIATE transaction, which serializes writers
+    # across processes, and does nothing until the index has been built.
+
+    def _begin_write(self, cur, require_complete=True):
+        cur.execute("BEGIN IMMEDIATE")
+        meta = self._meta(cur)
+        if require_complete and meta.get("complete") != "1":
+            cur.execute("ROLLBACK")
+            return None
+        cur.execute("SELECT COALESCE(MAX(seq), 0) + 1 FROM rows")
+        return meta, cur.fetchone()[0]
+
+    def _tombstone(self, cur, chunk_ids, seq):
+        for start in range(0, len(chunk_ids), 500):
+            batch = chunk_ids[start:start + 500]
+            placeholders = ", ".join("?" for _ in batch)
+            cur.execute(
+                f"UPDATE rows SET deleted = 1, seq = ? WHERE deleted = 0 AND chunk_id IN ({placeholders})",
+                [seq] + list(batch)
+            )
+
+    @staticmethod
+    def _write_rows(path: str, first_row: int, rows: np.ndarray):
+        row_bytes = rows[0].nbytes
+        needed = (first_row + len(rows)) * row_bytes
+        mode = "r+b" if os.path.exists(path) else "w+b"
+        with open(path, mode) as f:
+            f.seek(0, os.SEEK_END)
+            size = f.tell()
+            if size < needed:
+                # Grow by doubling; the file never shrinks, so open memory maps stay valid
+                capacity = max(size, INITIAL_CAPACITY * row_bytes)
+                while capacity < needed:
+                    capacity *= 2
+                f.truncate(capacity)
+            f.seek(first_row * row_bytes)
+            f.write(rows.tobytes())
+
+    def _write_vectors(self, first_row: int, matrix: np.ndarray, dtype: str):
+        """Stores float32 vectors in the index's format, starting at first_row."""
+        if dtype == "int8":
+            codes, scales = quantize_int8(matrix)
+            self._write_rows(self.scales_path, first_row, scales)
+            self._write_rows(self.vectors_path(dtype), first_row, codes)
+        else:
+            self._write_rows(self.vectors_path(dtype), first_row, matrix.astype(dtype))
+
+    def add(self, ids: List[str], documents: List[str], vectors, metadatas: List[dict], require_complete=True):
+        """Appends chunks; ids already in the index are replaced (the old row becomes a tombstone)."""
+        if not ids or not self.exists():
+            return
+        matrix = np.ascontiguousarray(vectors, dtype=np.float32)
+        with get_connection(self.db_path) as conn:
+            cur = conn.cursor()
+            begun = self._begin_write(cur, require_complete)
+            if begun is None:
+                return
+            meta, seq = begun
+            dimensions = int(meta.get("dimensions") or matrix.shape[1])
+            if matrix.shape[1] != dimensions:
+                cur.execute("ROLLBACK")
+                raise ValueError(f"Vectors have {matrix.shape[1]} dimensions, the index {dimensions}.")
+            cur.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('dimensions', ?)", (str(dimensions),))
+            self._tombstone(cur, list(ids), seq)
+            cur.execute("SELECT COALESCE(MAX(row), -1) + 1 FROM rows")
+            first_row = cur.fetchone()[0]
+            # Vectors are on disk before the rows that point to them are committed
+            self._write_vectors(first_row, matrix, meta.get("dtype", "float32"))
+            cur.executemany(
+                "INSERT INTO rows (row, chunk_id, document, metadata, deleted, seq) VALUES (?, ?, ?, ?, 0, ?)",
+                [
+                    (first_row + i, chunk_id, document, json.dumps(metadata or {}), seq)
+                    for i, (chunk_id, document, metadata) in enumerate(zip(ids, documents, metadatas))
+                ]
+            )
+            conn.commit()
+
+    def update_metadata(self, ids: List[str], metadatas: List[dict]):
+        if not ids or not self.exists():
+            return
+        with get_connection(self.db_path) as conn:
+            cur = conn.cursor()
+            begun = self._begin_write(cur)
+            if begun is None:
+                return
+            _, seq = begun
+            cur.executemany(
+                "UPDATE rows SET metadata = ?, seq = ? WHERE deleted = 0 AND chunk_id = ?",
+                [(json.dumps(metadata or {}), seq, chunk_id) for chunk_id, metadata in zip(ids, metadatas)]
+            )
+            conn.commit()
+
+    def delete(self, ids: List[str], require_complete=True):
+        if not ids or not self.exists():
+            return
+        with get_connection(self.db_path) as conn:
+            cur = conn.cursor()
+            begun = self._begin_write(cur, require_complete)
+            if begun is None:
+                return
+            self._tombstone(cur, list(ids), begun[1])
+            conn.commit()
+
+    def clear(self, complete: bool = True):
+        """Drops every row and starts a new generation, which makes readers reload."""
+        if not self.exists():
+            return
+        with get_connection(self.db_path) as conn:
+            cur = conn.cursor()
+            cur.execute("BEGIN IMMEDIATE")
+            generation = int(self._meta(cur).get("generation") or 0) + 1
+            cur.execute("DELETE FROM rows")
+            cur.executemany(
+                "INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)",
+                [("generation", str(generation)), ("complete", "1" if complete else "0")]
+            )
+            if complete:
+                cur.execute("DELETE FROM meta WHERE key = 'dimensions'")
+            conn.commit()
+
+    def build(self, collection, batch_size: int = 1000) -> int:
+        """
+        Re-creates the index from a Chroma collection in the EMBEDDING_STORAGE format,
+        dropping tombstones; returns the chunk count.
+        """
+        if EMBEDDING_STORAGE not in STORAGE_DTYPES:
+            raise ValueError(f"EMBEDDING_STORAGE must be one of {', '.join(STORAGE_DTYPES)}, not {EMBEDDING_STORAGE!r}.")
+        self._init_db()
+        self.clear(complete=False)
+        with get_connection(self.db_path) as conn:
+            cur = conn.cursor()
+            cur.executemany("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", [
+                ("space", (collection.metadata or {}).get("hnsw:space", "l2")),
+                ("collection", collection.name),
+                ("dtype", EMBEDDING_STORAGE),
+            ])
+            cur.execute("DELETE FROM meta WHERE key = 'dimensions'")
+            conn.commit()
+        # Files of a format the index was built in before; readers still mapping them keep their copy
+        stale = [self.vectors_path(dtype) for dtype in STORAGE_DTYPES if dtype != EMBEDDING_STORAGE]
+        if EMBEDDING_STORAGE != "int8":
+            stale.append(self.scales_path)
+        for path in stale:
+            if os.path.exists(path):
+                os.remove(path)
+        offset = 0
+        while True:
+            batch = collection.get(include=["embeddings", "documents", "metadatas"], limit=batch_size, offset=offset)
+            if not batch["ids"]:
+                break
+            self.add(batch["ids"], batch["documents"], batch["embeddings"], batch["metadatas"], require_complete=False)
+            offset += len(batch["ids"])
+        # Chunks written to the collection while the build ran
+        self.catch_up(collection, batch_size)
+        with get_connection(self.db_path) as conn:
+            cur = conn.cursor()
+            cur.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('complete', '1')")
+            conn.commit()
+        return offset
+
+    def catch_up(self, collection, batch_size: int = 1000):
+        """Adds chunks missing from the index and tombstones chunks gone from the collection."""
+        stored = set()
+        offset = 0
+        while True:
+            batch = collection.get(include=[], limit=batch_size, offset=offset)
+            if not batch["ids"]:
+                break
+            stored.update(batch["ids"])
+            offset += len(batch["ids"])
+        with get_connection(self.db_path) as conn:
+            cur = conn.cursor()
+            cur.execute("SELECT chunk_id FROM rows WHERE deleted = 0")
+            indexed = {chunk_id for (chunk_id,) in cur.fetchall()}
+        self.delete(sorted(indexed - stored), require_complete=False)
+        missing = sorted(stored - indexed)
+        for start in range(0, len(missing), batch_size):
+            batch = collection.get(ids=missing[start:start + batch_size], include=["embeddings", "documents", "metadatas"])
+            self.add(batch["ids"], batch["documents"], batch["embeddings"], batch["metadatas"], require_complete=False)
+
+    # Reads
+
+    def refresh(self) -> bool:
+        """Applies rows written since the last call; returns False while the index is not built."""
+        if not self.exists():
+            return False
+        with self._lock:
+            with get_connection(self.db_path) as conn:
+                cur = conn.cursor()
+                # One snapshot for the meta and row reads
+                cur.execute("BEGIN")
+                meta = self._meta(cur)
+                if meta.get("complete") != "1":
+                    cur.execute("ROLLBACK")
+                    return False
+                if meta.get("generation") != self.generation:
+                    self._reset()
+                    self.generation = meta.get("generation")
+                cur.execute(
+                    "SELECT row, chunk_id, document, metadata, deleted, seq FROM rows WHERE seq > ? ORDER BY row",
+                    (self.last_seq,)
+                )
+                changed = cur.fetchall()
+                cur.execute("ROLLBACK")
+            self.space = meta.get("space", "l2")
+            self.dtype = meta.get("dtype", "float32")
+            if changed:
+                self._apply(changed, int(meta["dimensions"]))
+        return True
+
+    def _apply(self, changed, dimensions: int):
+        count = max(self.count, changed[-1][0] + 1)
+        if count > len(self.alive):
+            capacity = max(count, 2 * len(self.alive), INITIAL_CAPACITY)
+            self.alive = np.concatenate([self.alive, np.zeros(capacity - len(self.alive), dtype=bool)])
+            self.norms = np.concatenate([self.norms, np.zeros(capacity - len(self.norms), dtype=np.float32)])
+        path = self.vectors_path(self.dtype)
+        rows_in_file = os.path.getsize(path) // (dimensions * np.dtype(self.dtype).itemsize)
+        if self.vectors is None or len(self.vectors) != rows_in_file:
+            self.vectors = np.memmap(path, dtype=self.dtype, mode="r", shape=(rows_in_file, dimensions))
+        if self.dtype == "int8":
+            scales_in_file = os.path.getsize(self.scales_path) // 4
+            if self.scales is None or len(self.scales) != scales_in_file:
+                self.scales = np.memmap(self.scales_path, dtype=np.float32, mode="r", shape=(scales_in_file,))
+        while len(self.ids) < count:
+            self.ids.append(None)
+            self.documents.append(None)
+            self.metadatas.append({})
+        new_rows = []
+        for row, chunk_id, document, metadata, deleted, seq in changed:
+            if self.ids[row] is None:
+                new_rows.append(row)
+            self.ids[row], self.documents[row] = chunk_id, document
+            self.metadatas[row] = json.loads(metadata)
+            self.alive[row] = not deleted
+            if deleted:
+                if self.rows_by_id.get(chunk_id) == row:
+                    del self.rows_by_id[chunk_id]
+            else:
+                self.rows_by_id[chunk_id] = row
+            self.last_seq = max(self.last_seq, seq)
+        if new_rows:
+            rows = np.asarray(new_rows)
+            self.norms[rows] = np.linalg.norm(self._decode(rows), axis=1)
+        self.count = count
+        self._columns = {}
+
+    def _column(self, key: str, count: int) -> np.ndarray:
+        column = self._columns.get(key)
+        if column is None or len(column) < count:
+            column = np.empty(count, dtype=object)
+            column[:] = [metadata.get(key) for metadata in self.metadatas[:count]]
+            self._columns[key] = column
+        return column[:count]
+
+    def where_mask(self, where: Optional[dict], count: int) -> np.ndarray:
+        """
+        Evaluates the subset of Chroma's `where` syntax used for retrieval scopes
+        ($and, $or, $eq, $ne, $in, $nin) over the metadata rows. As in Chroma,
+        $ne and $nin match rows that lack the key.
+        """
+        if not where:
+            return np.ones(count, dtype=bool)
+        if "$and" in where:
+            return np.logical_and.reduce([self.where_mask(part, count) for part in where["$and"]])
+        if "$or" in where:
+            return np.logical_or.reduce([self.where_mask(part, count) for part in where["$or"]])
+        mask = np.ones(count, dtype=bool)
+        for key, condition in where.items():
+            column = self._column(key, count)
+            operator, value = next(iter(condition.items())) if isinstance(condition, dict) else ("$eq", condition)
+            if operator in ("$eq", "$ne"):
+                values = [value]
+            elif operator in ("$in", "$nin"):
+                values = list(value)
+            else:
+                raise ValueError(f"Unsupported metadata operator: {operator}")
+            # One pass over the column, however many values (e.g. shared chunk ids, see scopes.search_filter)
+            values = set(values)
+            matches = np.fromiter((v in values for v in column), dtype=bool, count=count)
+            mask &= ~matches if operator in ("$ne", "$nin") else matches
+        return mask
+
+    def _distances(self, scores: np.ndarray, rows, query: np.ndarray) -> np.ndarray:
+        """Converts dot products to the collection's distance, as Chroma reports it."""
+        if self.space == "cosine":
+            norms = self.norms[rows] * (np.linalg.norm(query) or 1.0)
+            return 1.0 - scores / np.where(norms == 0, 1.0, norms)
+        if self.space == "ip":
+            return 1.0 - scores
+        return self.norms[rows] ** 2 + float(query @ query) - 2.0 * scores
+
+    def _decode(self, rows) -> np.ndarray:
+        """The given rows (a slice or row indices) as float32 vectors."""
+        if self.dtype == "int8":
+            return self.vectors[rows].astype(np.float32) * self.scales[rows][:, np.newaxis]
+        return np.asarray(self.vectors[rows], dtype=np.float32)
+
+    def _dot(self, rows, query: np.ndarray) -> np.ndarray:
+        """Dot products of the query with the given rows; quantized rows are decoded a block at a time."""
+        if self.dtype == "float32":
+            return self.vectors[rows] @ query
+        if isinstance(rows, slice):
+            rows = np.arange(rows.start, rows.stop)
+        block = max(1, SCORE_BLOCK_VALUES // len(query))
+        return np.concatenate([
+            self._decode(rows[start:start + block]) @ query for start in range(0, len(rows), block)
+        ]) if len(rows) else np.zeros(0, dtype=np.float32)
+
+    def _item(self, row: int, distance: float) -> dict:
+        return {
+            "id": self.ids[row],
+            "doc_text": self.documents[row],
+            "meta": self.metadatas[row],
+            "distance": float(distance),
+            "embedding": self._decode([row])[0],
+        }
+
+    def query(self, vector: List[float], n_results: int, where: dict = None) -> List[dict]:
+        """Exact nearest chunks, as vector_search returns them, closest first."""
+        # No lock: refresh only appends rows and replaces arrays, and count is read once
+        count = self.count
+        if not count:
+            return []
+        query = np.asarray(vector, dtype=np.float32)
+        rows = np.flatnonzero(self.alive[:count] & self.where_mask(where, count))
+        if not len(rows):
+            return []
+        if len(rows) * 4 < count:
+            # Narrow scopes gather only their rows
+            distances = self._distances(self._dot(rows, query), rows, query)
+        else:
+            distances = self._distances(self._dot(slice(0, count), query), slice(0, count), query)[rows]
+        k = min(n_results, len(rows))
+        best = np.argpartition(distances, k - 1)[:k]
+        best = best[np.argsort(distances[best])]
+        return [self._item(int(rows[i]), distances[i]) for i in best]
+
+    def distances(self, vector: List[float], chunk_ids: List[str]) -> dict:
+        """Returns {chunk_id: (distance, embedding)} for indexed chunks, like retrieval.vector_distances."""
+        rows = [self.rows_by_id[chunk_id] for chunk_id in chunk_ids if chunk_id in self.rows_by_id]
+        if not rows:
+            return {}
+        query = np.asarray(vector, dtype=np.float32)
+        rows = np.asarray(rows)
+        distances = self._distances(self._dot(rows, query), rows, query)
+        vectors = self._decode(rows)
+        return {self.ids[row]: (float(d), vector) for row, d, vector in zip(rows, distances, vectors)}
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+_warned = set()
+
+def index_for(collection_name: str) -> NumpyIndex:
+    with _indexes_lock:
+        if collection_name not in _indexes:
+            _indexes[collection_name] = NumpyIndex(collection_name)
+        return _indexes[collection_name]
+
+def active_numpy_index() -> NumpyIndex:
+    """The index of the active collection (built or not)."""
+    from database import get_active_index
+    return index_for(get_active_index()["collection"])
+
+def get_numpy_index() -> Optional[NumpyIndex]:
+    """The up-to-date index of the active collection, or None (with a warning) when it is not built."""
+    index = active_numpy_index()
+    if index.refresh():
+        return index
+    name = os.path.basename(index.directory)
+    if name not in _warned:
+        _warned.add(name)
+        print(f"No NumPy index for '{name}' yet; searching Chroma. Build it with: python numpy_index.py")
+    return None
+
+def rebuild_numpy_index() -> int:
+    """Builds (or compacts) the index of the active collection from Chroma."""
+    from database import get_collection
+    collection = get_collection()
+    return index_for(collection.name).build(collection)
+
+if __name__ == "__main__":
+    total = rebuild_numpy_index()
+    print(f"NumPy index built with {total} chunks.")
@@ -0,0 +1,136 @@
+#!/usr/bin/env python
+# Document partitioning with unstructured, cached on disk by file content hash. It has no
+# Chroma or OpenAI dependencies, so it can run in worker processes (see bulk_ingest.py).
+import os
+import json
+import uuid
+import hashlib
+import datetime
+from typing import List, Tuple
+
+from metrics import Counter, timed
+from images import extract_images
+from config import PARTITION_CACHE_DIR, PDF_PARTITION_STRATEGY
+
+# Bump when the shape of partitioned elements changes, so stale cache entries are ignored
+PARTITION_CACHE_VERSION = 3
+
+partition_cache_lookups = Counter(
+    "rag_partition_cache_lookups_total", "Partition cache lookups by result.", ["result"]
+)
+
+def file_hash(file_path: str) -> str:
+    sha = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            sha.update(block)
+    return sha.hexdigest()
+
+def partition_file(file_path: str) -> List[dict]:
+    """
+    Partitions a file into a list of {"category", "text"} elements.
+    Results are cached on disk by file content hash, so retries and re-indexing
+    of the same file skip partitioning entirely. The plain-text PDF fallback is not
+    cached, so the next run of the same file tries the full partition again.
+    """
+    file_ext = os.path.splitext(file_path)[1].lower()
+    # PDFs partitioned with another strategy than hi_res are cached separately
+    strategy = f"-{PDF_PARTITION_STRATEGY}" if file_ext == ".pdf" and PDF_PARTITION_STRATEGY != "hi_res" else ""
+    cache_path = os.path.join(
+        PARTITION_CACHE_DIR, f"{file_hash(file_path)}-v{PARTITION_CACHE_VERSION}{strategy}{file_ext}.json"
+    )
+    if os.path.exists(cache_path):
+        partition_cache_lookups.inc(result="hit")
+        with open(cache_path, "r") as f:
+            return json.load(f)
+    partition_cache_lookups.inc(result="miss")
+
+    with timed("partition"):
+        elements, complete = _partition_uncached(file_path)
+        elements = merge_images(elements, extract_images(file_path))
+    if not complete:
+        return elements
+
+    os.makedirs(PARTITION_CACHE_DIR, exist_ok=True)
+    tmp_path = f"{cache_path}.{uuid.uuid4().hex}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(elements, f)
+    os.replace(tmp_path, cache_path)
+    return elements
+
+def _partition_uncached(file_path: str) -> Tuple[List[dict], bool]:
+    """
+    Returns (elements, complete), where complete is False for the PyPDF2 fallback.
+    The elements are plain JSON-serializable data so they can be cached and checkpointed.
+    Each unstructured partitioner is imported on first use; together they take seconds
+    to import and processes that only answer questions never need them.
+    """
+    file_ext = os.path.splitext(file_path)[1].lower()
+    elements = []
+
+    if file_ext == ".pdf":
+        try:
+            from unstructured.partition.pdf import partition_pdf
+            elements = partition_pdf(
+                file_path,
+                infer_table_structure=True,
+                strategy=PDF_PARTITION_STRATEGY,
+                max_characters=20000,
+                combine_text_under_n_chars=10000,
+                new_after_n_chars=16000
+            )
+        except Exception as e:
+            # Log fallback usage
+            print(f"[{datetime.datetime.utcnow().isoformat()}] FALLBACK triggered for PDF: unstructured partition failed with error: {e}")
+            try:
+                from PyPDF2 import PdfReader
+                reader = PdfReader(file_path)
+                fallback_elements = []
+                for page_number, page in enumerate(reader.pages, start=1):
+                    page_text = page.extract_text()
+                    if page_text:
+                        fallback_elements.append({"category": "Text", "text": page_text, "page": page_number})
+                return fallback_elements, False
+            except Exception as e2:
+                raise Exception("Error processing PDF using both methods: " + str(e) + " | " + str(e2))
+
+    elif file_ext == ".docx":
+        from unstructured.partition.docx import partition_docx
+        elements = partition_docx(file_path)
+
+    elif file_ext == ".xlsx":
+        from unstructured.partition.xlsx import partition_xlsx
+        elements = partition_xlsx(file_path)
+
+    elif file_ext == ".txt":
+        from unstructured.partition.text import partition_text
+        elements = partition_text(file_path)
+
+    elif file_ext in [".png", ".jpg", ".jpeg"]:
+        # The image itself is added by extract_images
+        return [], True
+
+    return [
+        {
+            "category": getattr(el, "category", "Text"),
+            "text": el.text or "",
+            "page": getattr(getattr(el, "metadata", None), "page_number", None)
+        }
+        for el in elements
+    ], True
+
+def merge_images(elements: List[dict], images: List[dict]) -> List[dict]:
+    """
+    Replaces unstructured's Image placeholders with the extracted images. An image
+    with a page number goes after the last element of its page, others at the end.
+    """
+    elements = [el for el in elements if el["category"] != "Image"]
+    paged = sorted((img for img in images if img.get("page") is not None), key=lambda img: img["page"])
+    merged = []
+    for el in elements:
+        while paged and el.get("page") is not None and el["page"] > paged[0]["page"]:
+            merged.append(paged.pop(0))
+        merged.append(el)
+    merged.extend(paged)
+    merged.extend(img for img in images if img.get("page") is None)
+    return merged
@@ -1,16 +1,38 @@
-from openai import OpenAI
-from database import collection
-from config import OPENAI_API_KEY, CHAT_MODEL, TOP_K
-from flask import session  # To store sources and last query
-import tiktoken
+import time
+import asyncio
+from retrieval import hybrid_search, mmr_rerank, collapse_near_duplicates, pack_context
+from config import OPENAI_API_KEY, CHAT_MODEL, RERANK_CANDIDATES, ANSWER_CACHE_ENABLED
+from query_cache import embed_question, answer_cache, corpus_version
+from scopes import scope_filter, search_filter, scope_key
+from dedup import chunk_references
+from retrieval_state import state_key, save_state
+from metrics import timed, trace, record_openai, stage_seconds
+from flask import session  # Holds the key of the server-side retrieval state
+from tokenizer import get_encoder
 
-client = OpenAI(api_key=OPENAI_API_KEY)
+_client = None
+_async_client = None
 
-DISALLOWED_KEYWORDS = ["salary", "salaries", "wage", "wages", "private HR"]
+def get_client():
+    """The OpenAI client for chat completions, created on first use."""
+    global _client
+    if _client is None:
+        from openai import OpenAI
+        _client = OpenAI(api_key=OPENAI_API_KEY)
+    return _client
+
+def get_async_client():
+    """The AsyncOpenAI client used by the ASGI endpoints, created on first use."""
+    global _async_client
+    if _async_client is None:
+        from openai import AsyncOpenAI
+        _async_client = AsyncOpenAI(api_key=OPENAI_API_KEY)
+    return _async_client
 
-encoder = tiktoken.get_encoding("cl100k_base")
+DISALLOWED_KEYWORDS = ["salary", "salaries", "wage", "wages", "private HR"]
 
 def truncate_to_8100_tokens(text: str) -> str:
+    encoder = get_encoder()
     tokens = encoder.encode(text)
     if len(tokens) > 8100:
         tokens = tokens[:8100]
@@ -23,39 +45,34 @@ def is_disallowed_query(query: str) -> bool:
             return True
     return False
 
-def generate_answer(question: str):
-    # Truncate the user question to avoid overly large input
-    question = truncate_to_8100_tokens(question)
-
-    if is_disallowed_query(question):
-        return "I’m sorry, but I cannot answer that."
-
-    results = collection.query(
-        query_texts=[question],
-        n_results=TOP_K
-    )
+NO_INFORMATION_ANSWER = "I don't have that information at this time."
+REFUSAL_ANSWER = "I’m sorry, but I cannot answer that."
 
-    # If no results or empty
-    if not results.get("documents") or not results["documents"] or not results["documents"][0]:
-        session["last_query"] = question
-        session["last_sources"] = []
-        session["last_answer"] = "I don't have that information at this time."
-        return "I don't have that information at this time."
+SYSTEM_PROMPT = (
+    "You are TheFulcrum's Chat, a helpful assistant for Fulcrum Asset Management. "
+    "Provide the best possible answer. If you feel like you really do not have sufficient context, respond: "
+    "'I don't have that information at this time.'"
+    "If you think you have just a bit of information, you can respond with that without going to much in detail and at the end tell them to check the source button."
+)
 
-    docs = results["documents"][0]
-    metas = results["metadatas"][0]
-    distances = results["distances"][0]
-
-    # Combine them so we can sort by distance (ascending)
-    items = []
-    for doc_text, meta, dist in zip(docs, metas, distances):
-        items.append({"doc_text": doc_text, "meta": meta, "distance": dist})
-
-    # Sort by ascending distance => highest similarity first
-    items.sort(key=lambda x: x["distance"])
+def retrieve_context(question: str, question_vector, where: dict = None, engine: str = None):
+    """
+    Retrieves candidates with hybrid vector + lexical search, reranks them and packs
+    whole chunks into the context token budget. Returns (context_text, unique_sources),
+    or None when nothing matches. where restricts the search to a retrieval scope;
+    engine selects the vector search engine (default RETRIEVAL_ENGINE).
+    """
+    candidates = hybrid_search(question, question_vector, RERANK_CANDIDATES, search_filter(where), engine)
+    if not candidates:
+        return None
+    with timed("rerank"):
+        reranked = collapse_near_duplicates(mmr_rerank(question_vector, candidates))
+    with timed("pack"):
+        items = pack_context(reranked)
 
     context_text = ""
     unique_sources = []
+    references = chunk_references([item["id"] for item in items if item["meta"].get("type") != "wiki"], where)
 
     for item in items:
         doc_text = item["doc_text"]
@@ -81,53 +98,236 @@ def generate_answer(question: str):
             if not any(s.get("wiki_id") == wiki_id for s in unique_sources):
                 unique_sources.append(source)
         else:
-            doc_id = meta.get("doc_id")
-            title = meta.get("title", "Unknown")
-            folder = meta.get("folder")
-            filename = meta.get("filename")
-            link = f"/uploads/{folder}/{filename}" if (folder and filename) else "No file link"
-            source = {
-                "type": "document",
-                "doc_id": doc_id,
-                "title": title,
-                "folder": folder,
-                "filename": filename,
-                "link": link,
-                "score": round(similarity_score, 2)
-            }
-            # Avoid duplicates by doc_id
-            if not any(s.get("doc_id") == doc_id for s in unique_sources):
-                unique_sources.append(source)
+            # A chunk shared between documents is cited for each referring document in scope
+            for doc_meta in references.get(item["id"], [meta]):
+                doc_id = doc_meta.get("doc_id")
+                title = doc_meta.get("title", "Unknown")
+                folder = doc_meta.get("folder")
+                filename = doc_meta.get("filename")
+                link = f"/uploads/{folder}/{filename}" if (folder and filename) else "No file link"
+                source = {
+                    "type": "document",
+                    "doc_id": doc_id,
+                    "title": title,
+                    "folder": folder,
+                    "filename": filename,
+                    "link": link,
+                    "score": round(similarity_score, 2)
+                }
+                # Avoid duplicates by doc_id
+                if not any(s.get("doc_id") == doc_id for s in unique_sources):
+                    unique_sources.append(source)
 
         # Append text for final context
         context_text += doc_text + "\n\n"
 
-    # Store the query and the sources in session
-    session["last_query"] = question
-    session["last_sources"] = unique_sources
+    return context_text, unique_sources
+
+def prepare_answer(question: str, scopes: dict = None, engine: str = None) -> dict:
+    """
+    Runs everything that happens before the chat completion: the disallowed-topic
+    check, the answer cache lookup and retrieval, limited to the chunks in scopes
+    (as returned by scopes.parse_scopes) when given. The returned dict always has
+    "question" and "sources"; it has "answer" when no LLM call is needed, and
+    "messages" for the chat model otherwise.
+    """
+    # Truncate the user question to avoid overly large input
+    question = truncate_to_8100_tokens(question)
+
+    if is_disallowed_query(question):
+        return {"question": question, "sources": None, "answer": REFUSAL_ANSWER, "refused": True}
 
-    # Truncate context again to be safe
-    context_text = truncate_to_8100_tokens(context_text)
+    # Read before anything is retrieved, so an answer built from an older corpus is never cached
+    version = corpus_version()
+    where = scope_filter(scopes) if scopes else None
+    if where is None and scopes:
+        # Nothing is in scope, e.g. no document was uploaded in the date range
+        return {"question": question, "sources": [], "answer": NO_INFORMATION_ANSWER}
+    scope = scope_key(scopes)
 
-    system_prompt = (
-        "You are TheFulcrum's Chat, a helpful assistant for Fulcrum Asset Management. "
-        "Provide the best possible answer. If you feel like you really do not have sufficient context, respond: "
-        "'I don't have that information at this time.'"
-        "If you think you have just a bit of information, you can respond with that without going to much in detail and at the end tell them to check the source button."
-    )
+    with timed("embed_question"):
+        question_vector = embed_question(question)
+
+    # Reuse the answer to a near-identical question if the corpus has not changed since
+    if ANSWER_CACHE_ENABLED:
+        with timed("answer_cache_lookup"):
+            cached = answer_cache.lookup(question_vector, scope)
+        if cached:
+            return {"question": question, "sources": cached["sources"], "answer": cached["answer"]}
+
+    with timed("retrieve"):
+        retrieved = retrieve_context(question, question_vector, where, engine)
+    if retrieved is None:
+        return {"question": question, "sources": [], "answer": NO_INFORMATION_ANSWER}
+
+    context_text, unique_sources = retrieved
     user_prompt = f"Question: {question}\n\nContext:\n{context_text}\n\nAnswer:"
+    return {
+        "question": question,
+        "vector": question_vector,
+        "scope": scope,
+        "version": version,
+        "sources": unique_sources,
+        "messages": [
+            {"role": "system", "content": SYSTEM_PROMPT},
+            {"role": "user", "content": user_prompt},
+        ]
+    }
+
+def record_answer(prepared: dict, final_answer: str):
+    """Stores a freshly generated answer in the semantic answer cache."""
+    if ANSWER_CACHE_ENABLED and "messages" in prepared:
+        answer_cache.store(
+            prepared["vector"], prepared["question"], final_answer, prepared["sources"], prepared["scope"],
+            prepared["version"]
+        )
+
+# Retrieval state that used to live in the cookie session
+LEGACY_SESSION_KEYS = ("last_query", "last_sources", "last_answer")
+
+def remember_query(prepared: dict, store=session):
+    """
+    Stores the query and its sources in the server-side retrieval state of the
+    session (or another session-like mapping); the session only keeps the key.
+    """
+    if prepared.get("refused"):
+        return
+    for legacy_key in LEGACY_SESSION_KEYS:
+        store.pop(legacy_key, None)
+    save_state(state_key(store), last_query=prepared["question"], last_sources=prepared["sources"], last_answer=None)
+
+def remember_answer(prepared: dict, final_answer: str, store=session):
+    """Stores the last answer in the server-side retrieval state of the session."""
+    if prepared.get("refused"):
+        return
+    save_state(state_key(store), last_answer=final_answer)
+
+def generate_answer(question: str, scopes: dict = None, engine: str = None):
+    with trace("answer"):
+        prepared = prepare_answer(question, scopes, engine)
+        remember_query(prepared)
+        if "answer" in prepared:
+            remember_answer(prepared, prepared["answer"])
+            return prepared["answer"]
+
+        with timed("llm"):
+            response = get_client().chat.completions.create(
+                model=CHAT_MODEL,
+                messages=prepared["messages"],
+                temperature=0.0
+            )
+        record_openai("chat", CHAT_MODEL, response.usage)
+        final_answer = response.choices[0].message.content.strip()
+
+        remember_answer(prepared, final_answer)
+        record_answer(prepared, final_answer)
+        return final_answer
+
+class StreamTimer:
+    """Records time to first token and total generation time of a streamed completion."""
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.first_token = False
+        self.usage = None
 
-    response = client.chat.completions.create(
+    def chunk(self, chunk):
+        """Notes one streamed chunk; returns its text delta, if any."""
+        if getattr(chunk, "usage", None):
+            self.usage = chunk.usage
+        if not chunk.choices:
+            return None
+        delta = chunk.choices[0].delta.content
+        if delta and not self.first_token:
+            self.first_token = True
+            stage_seconds.observe(time.perf_counter() - self.start, stage="llm_first_token")
+        return delta
+
+    def finish(self):
+        stage_seconds.observe(time.perf_counter() - self.start, stage="llm")
+        record_openai("chat_stream", CHAT_MODEL, self.usage)
+
+def stream_answer(prepared: dict):
+    """
+    Streaming variant of generate_answer for a prepared question: yields the
+    answer text piece by piece as the chat model produces it, then stores the
+    final answer in the retrieval state and in the answer cache.
+    """
+    if "answer" in prepared:
+        remember_answer(prepared, prepared["answer"])
+        yield prepared["answer"]
+        return
+
+    timer = StreamTimer()
+    stream = get_client().chat.completions.create(
         model=CHAT_MODEL,
-        messages=[
-            {"role": "system", "content": system_prompt},
-            {"role": "user", "content": user_prompt},
-        ],
-        temperature=0.0
+        messages=prepared["messages"],
+        temperature=0.0,
+        stream=True,
+        stream_options={"include_usage": True}
     )
-    final_answer = response.choices[0].message.content.strip()
+    parts = []
+    for chunk in stream:
+        delta = timer.chunk(chunk)
+        if delta:
+            parts.append(delta)
+            yield delta
+    timer.finish()
+
+    final_answer = "".join(parts).strip()
+    remember_answer(prepared, final_answer)
+    record_answer(prepared, final_answer)
+
+async def prepare_answer_async(question: str, scopes: dict = None, engine: str = None) -> dict:
+    """Runs prepare_answer in a worker thread, since embedding lookups and Chroma calls block."""
+    return await asyncio.to_thread(prepare_answer, question, scopes, engine)
 
-    # Store the last answer in session
-    session["last_answer"] = final_answer
+async def generate_answer_async(question: str, store, scopes: dict = None, engine: str = None) -> str:
+    """Async version of generate_answer; session state is written to store."""
+    with trace("answer"):
+        prepared = await prepare_answer_async(question, scopes, engine)
+        # The state store and answer cache write to SQLite and Chroma, which block
+        await asyncio.to_thread(remember_query, prepared, store)
+        if "answer" in prepared:
+            await asyncio.to_thread(remember_answer, prepared, prepared["answer"], store)
+            return prepared["answer"]
+
+        with timed("llm"):
+            response = await get_async_client().chat.completions.create(
+                model=CHAT_MODEL,
+                messages=prepared["messages"],
+                temperature=0.0
+            )
+        record_openai("chat", CHAT_MODEL, response.usage)
+        final_answer = response.choices[0].message.content.strip()
+
+        await asyncio.to_thread(remember_answer, prepared, final_answer, store)
+        await asyncio.to_thread(record_answer, prepared, final_answer)
+        return final_answer
+
+async def stream_answer_async(prepared: dict, store):
+    """Async version of stream_answer; session state is written to store."""
+    if "answer" in prepared:
+        await asyncio.to_thread(remember_answer, prepared, prepared["answer"], store)
+        yield prepared["answer"]
+        return
+
+    timer = StreamTimer()
+    stream = await get_async_client().chat.completions.create(
+        model=CHAT_MODEL,
+        messages=prepared["messages"],
+        temperature=0.0,
+        stream=True,
+        stream_options={"include_usage": True}
+    )
+    parts = []
+    async for chunk in stream:
+        delta = timer.chunk(chunk)
+        if delta:
+            parts.append(delta)
+            yield delta
+    timer.finish()
 
-    return final_answer
+    final_answer = "".join(parts).strip()
+    await asyncio.to_thread(remember_answer, prepared, final_answer, store)
+    await asyncio.to_thread(record_answer, prepared, final_answer)
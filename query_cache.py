@@ -0,0 +1,155 @@
+import os
+import uuid
+import threading
+from collections import OrderedDict
+from typing import List, Optional
+import numpy as np
+
+from database import get_embedding_function
+from metrics import CallbackMetric
+from config import (
+    QUERY_EMBEDDING_CACHE_SIZE, ANSWER_CACHE_SIZE, ANSWER_CACHE_SIMILARITY, CORPUS_VERSION_FILE
+)
+
+class LRUCache:
+    """A small thread-safe least-recently-used cache."""
+
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self._lock:
+            if key in self._data:
+                self._data.move_to_end(key)
+                self.hits += 1
+                return self._data[key]
+            self.misses += 1
+            return None
+
+    def put(self, key, value):
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def __len__(self):
+        return len(self._data)
+
+question_embeddings = LRUCache(QUERY_EMBEDDING_CACHE_SIZE)
+
+def embed_question(question: str) -> List[float]:
+    """Embeds a question, checking the in-process LRU before the persistent embedding cache."""
+    embedding_function = get_embedding_function()
+    # Keyed by model too, so a re-index to another embedding model never reuses old vectors
+    key = (embedding_function.model_key, question)
+    vector = question_embeddings.get(key)
+    if vector is None:
+        vector = [float(x) for x in embedding_function([question])[0]]
+        question_embeddings.put(key, vector)
+    return vector
+
+def corpus_version() -> str:
+    """
+    Returns a token that changes whenever documents or wiki pages are written or deleted.
+    It lives in a file so every process serving queries sees the same version.
+    """
+    try:
+        with open(CORPUS_VERSION_FILE, "r") as f:
+            return f.read()
+    except FileNotFoundError:
+        return ""
+
+def invalidate_answer_cache():
+    """Marks the corpus as changed; cached answers from earlier versions are discarded."""
+    tmp_path = f"{CORPUS_VERSION_FILE}.{uuid.uuid4().hex}.tmp"
+    with open(tmp_path, "w") as f:
+        f.write(uuid.uuid4().hex)
+    os.replace(tmp_path, CORPUS_VERSION_FILE)
+
+class SemanticAnswerCache:
+    """
+    Caches answers by question embedding. A new question whose cosine similarity to
+    a cached question reaches the threshold gets the cached answer and sources,
+    as long as the corpus has not changed since the answer was generated. Answers are
+    only reused for questions asked with the same retrieval scope (see scopes.scope_key).
+    """
+
+    def __init__(self, maxsize: int, threshold: float):
+        self.maxsize = maxsize
+        self.threshold = threshold
+        self._entries = []
+        self._matrix = None
+        self._version = None
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _sync_version(self):
+        version = corpus_version()
+        if version != self._version:
+            self._entries = []
+            self._matrix = None
+            self._version = version
+
+    def lookup(self, vector: List[float], scope: str = None) -> Optional[dict]:
+        query = np.asarray(vector, dtype=np.float32)
+        query /= np.linalg.norm(query) or 1.0
+        with self._lock:
+            self._sync_version()
+            if self._matrix is not None and self._matrix.shape[1] == query.shape[0]:
+                similarities = self._matrix @ query
+                other_scope = [entry["scope"] != scope for entry in self._entries]
+                similarities[other_scope] = -1.0
+                best = int(np.argmax(similarities))
+                if similarities[best] >= self.threshold:
+                    self.hits += 1
+                    return self._entries[best]
+            self.misses += 1
+            return None
+
+    def store(self, vector: List[float], question: str, answer: str, sources: list, scope: str = None,
+              version: str = None):
+        """
+        Caches an answer. version is the corpus version read before its context was
+        retrieved; an answer to a corpus that has changed since is not stored.
+        """
+        row = np.asarray(vector, dtype=np.float32)
+        row /= np.linalg.norm(row) or 1.0
+        with self._lock:
+            self._sync_version()
+            if version is not None and version != self._version:
+                return
+            if self._matrix is not None and self._matrix.shape[1] != row.shape[0]:
+                # Embedded with another model before a re-index switched collections
+                self._entries = []
+                self._matrix = None
+            self._entries.append({"question": question, "answer": answer, "sources": sources, "scope": scope})
+            rows = row[np.newaxis, :] if self._matrix is None else np.vstack([self._matrix, row])
+            if len(self._entries) > self.maxsize:
+                self._entries = self._entries[-self.maxsize:]
+                rows = rows[-self.maxsize:]
+            self._matrix = rows
+
+    def __len__(self):
+        return len(self._entries)
+
+answer_cache = SemanticAnswerCache(ANSWER_CACHE_SIZE, ANSWER_CACHE_SIMILARITY)
+
+QUERY_CACHES = {"question_embedding": question_embeddings, "answer": answer_cache}
+CallbackMetric(
+    "rag_query_cache_lookups_total", "Query-side cache lookups by cache and result.", "counter", ["cache", "result"],
+    lambda: {
+        (name, result): getattr(cache, attr)
+        for name, cache in QUERY_CACHES.items()
+        for result, attr in (("hit", "hits"), ("miss", "misses"))
+    }
+)
+CallbackMetric(
+    "rag_query_cache_entries", "Entries held by each query-side cache.", "gauge", ["cache"],
+    lambda: {(name,): len(cache) for name, cache in QUERY_CACHES.items()}
+)
@@ -0,0 +1,286 @@
+#!/usr/bin/env python
+# Blue/green re-indexing. A new versioned collection is built from the chunk text already
+# stored in the active one, optionally with another embedding model or dimension count,
+# while the app keeps serving from the active collection. Once both collections hold the
+# same chunks with the same text and metadata, the active-index pointer is switched
+# atomically; the previous collection is kept so the switch can be rolled back.
+#
+#   python reindex.py --model text-embedding-3-small
+#   python reindex.py --rollback
+import re
+import sys
+import json
+import hashlib
+import argparse
+import datetime
+from collections import Counter
+
+from config import RETRIEVAL_ENGINE
+from database import (
+    get_chroma_client, COLLECTION_NAME, make_embedding_function, read_active_index,
+    write_active_index, get_active_index, embedding_model_key, collection_write_lock
+)
+from chunk_and_embed import embed_texts
+from query_cache import invalidate_answer_cache
+from numpy_index import index_for, rebuild_numpy_index
+
+BATCH_SIZE = 500  # Chunks read, embedded and written per step
+MAX_CATCH_UP_PASSES = 5  # Passes copying chunks written to the active collection during the build
+
+def collection_names():
+    # Chroma 0.6 returns name strings from list_collections
+    return sorted(str(name) for name in get_chroma_client().list_collections())
+
+def next_collection_name():
+    versions = [
+        int(match.group(1)) for name in collection_names()
+        if (match := re.fullmatch(rf"{COLLECTION_NAME}_v(\d+)", name))
+    ]
+    return f"{COLLECTION_NAME}_v{max(versions, default=1) + 1}"
+
+def open_collection(name, model, dimensions=None, metadata=None):
+    return get_chroma_client().get_or_create_collection(
+        name=name, embedding_function=make_embedding_function(model, dimensions), metadata=metadata
+    )
+
+def iter_batches(collection, include, batch_size=BATCH_SIZE):
+    offset = 0
+    while True:
+        batch = collection.get(include=include, limit=batch_size, offset=offset)
+        if not batch["ids"]:
+            return
+        yield batch
+        offset += len(batch["ids"])
+
+def fingerprints(collection) -> dict:
+    """Maps each chunk id to (hash of its text, its metadata as sorted JSON)."""
+    entries = {}
+    for batch in iter_batches(collection, ["documents", "metadatas"]):
+        for chunk_id, document, meta in zip(batch["ids"], batch["documents"], batch["metadatas"]):
+            entries[chunk_id] = (
+                hashlib.sha256((document or "").encode("utf-8")).hexdigest(),
+                json.dumps(meta or {}, sort_keys=True)
+            )
+    return entries
+
+def differences(source, target) -> tuple:
+    """
+    Returns (missing, relabeled, stale) chunk ids: chunks target lacks or holds with
+    other text, chunks whose metadata alone differs (e.g. a renamed wiki page or a
+    shared chunk handed over to another document), and chunks no longer in source.
+    """
+    source_entries, target_entries = fingerprints(source), fingerprints(target)
+    missing, relabeled = [], []
+    for chunk_id, (text, meta) in source_entries.items():
+        if chunk_id not in target_entries or target_entries[chunk_id][0] != text:
+            missing.append(chunk_id)
+        elif target_entries[chunk_id][1] != meta:
+            relabeled.append(chunk_id)
+    stale = set(target_entries) - set(source_entries)
+    return sorted(missing), sorted(relabeled), sorted(stale)
+
+def chunks_per_document(collection) -> Counter:
+    """Chunk counts keyed by uploaded document or wiki page."""
+    counts = Counter()
+    for batch in iter_batches(collection, ["metadatas"]):
+        for meta in batch["metadatas"]:
+            meta = meta or {}
+            if meta.get("doc_id"):
+                counts[f"doc:{meta['doc_id']}"] += 1
+            elif meta.get("wiki_id") is not None:
+                counts[f"wiki:{meta['wiki_id']}"] += 1
+            else:
+                counts["other"] += 1
+    return counts
+
+def copy_chunks(source, target, ids, model, dimensions, batch_size=BATCH_SIZE):
+    """Re-embeds the stored text of the given chunks with the target model and writes them under the same ids."""
+    for start in range(0, len(ids), batch_size):
+        batch = source.get(ids=ids[start:start + batch_size], include=["documents", "metadatas"])
+        if not batch["ids"]:
+            continue
+        token_counts = [(meta or {}).get("n_tokens") for meta in batch["metadatas"]]
+        vectors = embed_texts(batch["documents"], token_counts, model=model, dimensions=dimensions)
+        target.upsert(ids=batch["ids"], documents=batch["documents"], embeddings=vectors, metadatas=batch["metadatas"])
+        print(f"  {min(start + batch_size, len(ids))}/{len(ids)} chunks")
+
+def copy_metadata(source, target, ids, batch_size=BATCH_SIZE):
+    """Overwrites the metadata of the given chunks in target with the source's, without re-embedding."""
+    for start in range(0, len(ids), batch_size):
+        batch = source.get(ids=ids[start:start + batch_size], include=["metadatas"])
+        if batch["ids"]:
+            target.update(ids=batch["ids"], metadatas=batch["metadatas"])
+
+def sync(source, target, model, dimensions):
+    """
+    Makes target match source: copies missing or changed chunks, refreshes changed
+    metadata and removes chunks no longer in source. Returns (copied, updated, removed).
+    """
+    missing, relabeled, stale = differences(source, target)
+    copy_chunks(source, target, missing, model, dimensions)
+    copy_metadata(source, target, relabeled)
+    for start in range(0, len(stale), BATCH_SIZE):
+        target.delete(ids=stale[start:start + BATCH_SIZE])
+    return len(missing), len(relabeled), len(stale)
+
+def sync_until_stable(source, target, model, dimensions):
+    """Repeats sync until a pass finds nothing to do, so uploads made during the build are included."""
+    for n in range(1, MAX_CATCH_UP_PASSES + 1):
+        copied, updated, removed = sync(source, target, model, dimensions)
+        print(f"Pass {n}: copied {copied} chunks, updated metadata of {updated}, removed {removed}.")
+        if n > 1 and not copied and not updated and not removed:
+            return
+    print("Warning: the active collection kept changing; the last pass may have missed recent writes.")
+
+def verify(source, target) -> list:
+    """
+    Returns a list of differences in per-document chunk counts, chunk text and
+    metadata (empty when both collections match).
+    """
+    expected, actual = chunks_per_document(source), chunks_per_document(target)
+    problems = [
+        f"{key}: {expected.get(key, 0)} chunks in {source.name}, {actual.get(key, 0)} in {target.name}"
+        for key in sorted(set(expected) | set(actual)) if expected.get(key, 0) != actual.get(key, 0)
+    ]
+    if source.count() != target.count():
+        problems.append(f"total: {source.count()} chunks in {source.name}, {target.count()} in {target.name}")
+    missing, relabeled, stale = differences(source, target)
+    if missing or relabeled or stale:
+        problems.append(f"contents: {len(missing)} chunks missing or with other text, "
+                        f"{len(relabeled)} with other metadata, {len(stale)} extra in {target.name}")
+    return problems
+
+def switch_to(info, previous):
+    """Atomically makes info the active collection, remembering the previous one for rollback."""
+    write_active_index({
+        "collection": info["collection"],
+        "model": info["model"],
+        "dimensions": info.get("dimensions"),
+        "activated_at": datetime.datetime.utcnow().isoformat(),
+        "previous": {key: previous.get(key) for key in ("collection", "model", "dimensions")},
+    })
+    invalidate_answer_cache()
+    print(f"Active collection is now '{info['collection']}' "
+          f"({embedding_model_key(info['model'], info.get('dimensions'))}).")
+
+def catch_up_and_switch(source, target, info, previous):
+    """
+    Runs a last sync and switches while writers wait on the write lock, so no chunk
+    lands in the old collection after its last pass; they then write to the new one.
+    """
+    with collection_write_lock(exclusive=True):
+        copied, updated, removed = sync(source, target, info["model"], info.get("dimensions"))
+        print(f"Final pass: copied {copied} chunks, updated metadata of {updated}, removed {removed}.")
+        # sync writes to the collection directly, so an index built for it earlier is stale;
+        # until it is rebuilt, queries fall back to Chroma
+        numpy_index = index_for(info["collection"])
+        numpy_index.clear(complete=False)
+        switch_to(info, previous)
+    if RETRIEVAL_ENGINE == "numpy" or numpy_index.exists():
+        print(f"Built the NumPy index with {rebuild_numpy_index()} chunks.")
+
+def reindex(model, dimensions=None, switch=True):
+    active = read_active_index()
+    source = open_collection(active["collection"], active["model"], active.get("dimensions"))
+    target_info = {"collection": next_collection_name(), "model": model, "dimensions": dimensions}
+    # Keep the distance function and other settings of the active collection, and record
+    # the embedding model so the collection can be activated later by name alone
+    metadata = dict(source.metadata or {}, embedding_model=model)
+    if dimensions:
+        metadata["embedding_dimensions"] = dimensions
+    target = open_collection(target_info["collection"], model, dimensions, metadata=metadata)
+    print(f"Building '{target.name}' from {source.count()} chunks in '{source.name}' "
+          f"with {embedding_model_key(model, dimensions)}...")
+
+    sync_until_stable(source, target, model, dimensions)
+    problems = verify(source, target)
+    if problems:
+        print("The collections do not match; the active collection was not switched:")
+        for problem in problems:
+            print(f"  {problem}")
+        print(f"Inspect or drop '{target.name}' (python reindex.py --drop {target.name}).")
+        return False
+    if not switch:
+        print(f"'{target.name}' is built and verified; switch to it with --activate {target.name}.")
+        return True
+    catch_up_and_switch(source, target, target_info, active)
+    print(f"The previous collection '{source.name}' is kept; undo with --rollback.")
+    return True
+
+def activate(name, model=None, dimensions=None):
+    """Switches to an already built collection after bringing it up to date with the active one."""
+    active = read_active_index()
+    if name not in collection_names():
+        sys.exit(f"No collection named '{name}'.")
+    if model is None:
+        metadata = get_chroma_client().get_collection(name).metadata or {}
+        model, dimensions = metadata.get("embedding_model"), metadata.get("embedding_dimensions")
+        if model is None:
+            sys.exit(f"'{name}' does not record its embedding model; pass --model (and --dimensions).")
+    source = open_collection(active["collection"], active["model"], active.get("dimensions"))
+    target = open_collection(name, model, dimensions)
+    sync_until_stable(source, target, model, dimensions)
+    problems = verify(source, target)
+    if problems:
+        print("The collections do not match; the active collection was not switched:")
+        for problem in problems:
+            print(f"  {problem}")
+        return False
+    catch_up_and_switch(source, target, {"collection": name, "model": model, "dimensions": dimensions}, active)
+    return True
+
+def rollback():
+    """Switches back to the previous collection, first copying chunks added since the switch."""
+    previous = read_active_index().get("previous")
+    if not previous or previous["collection"] not in collection_names():
+        sys.exit("There is no previous collection to roll back to.")
+    print(f"Rolling back to '{previous['collection']}'...")
+    return activate(previous["collection"], previous["model"], previous.get("dimensions"))
+
+def drop(name):
+    active = get_active_index()
+    previous = active.get("previous") or {}
+    if name == active["collection"]:
+        sys.exit(f"'{name}' is the active collection and cannot be dropped.")
+    get_chroma_client().delete_collection(name)
+    if name == previous.get("collection"):
+        write_active_index({key: value for key, value in active.items() if key != "previous"})
+    print(f"Dropped '{name}'.")
+
+def show():
+    active = read_active_index()
+    previous = (active.get("previous") or {}).get("collection")
+    for name in collection_names():
+        marker = " (active)" if name == active["collection"] else " (previous)" if name == previous else ""
+        count = get_chroma_client().get_collection(name).count()
+        print(f"{name}: {count} chunks{marker}")
+    print(f"Active embedding model: {embedding_model_key(active['model'], active.get('dimensions'))}")
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Rebuild the Chroma index into a new collection and switch to it.")
+    parser.add_argument("--model", help="Embedding model for the new collection (default: the active one)")
+    parser.add_argument("--dimensions", type=int, default=None,
+                        help="Reduced embedding dimensions (text-embedding-3 models only; "
+                             "default: those of the active collection, 0 for the model's full size)")
+    parser.add_argument("--no-switch", action="store_true", help="Build and verify, but keep the active collection")
+    parser.add_argument("--activate", metavar="NAME", help="Switch to an already built collection")
+    parser.add_argument("--rollback", action="store_true", help="Switch back to the previous collection")
+    parser.add_argument("--drop", metavar="NAME", help="Delete an inactive collection")
+    parser.add_argument("--list", action="store_true", help="List collections and their chunk counts")
+    return parser.parse_args(argv)
+
+if __name__ == "__main__":
+    args = parse_args()
+    if args.list:
+        show()
+    elif args.rollback:
+        sys.exit(0 if rollback() else 1)
+    elif args.drop:
+        drop(args.drop)
+    elif args.activate:
+        sys.exit(0 if activate(args.activate, args.model, args.dimensions) else 1)
+    else:
+        active = read_active_index()
+        model = args.model or active["model"]
+        dimensions = (args.dimensions if args.dimensions is not None else active.get("dimensions")) or None
+        sys.exit(0 if reindex(model, dimensions, switch=not args.no_switch) else 1)
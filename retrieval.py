@@ -0,0 +1,193 @@
+from typing import List
+import numpy as np
+
+from database import get_collection
+from lexical_index import lexical_search
+from numpy_index import get_numpy_index
+from dedup import near_duplicate_groups
+from metrics import timed
+from tokenizer import get_encoder, char_boundary
+from config import (
+    TOP_K, HYBRID_SEARCH_ENABLED, HYBRID_CANDIDATES, RRF_K, CONTEXT_TOKEN_BUDGET, MMR_LAMBDA, RETRIEVAL_ENGINE
+)
+
+def numpy_engine(engine: str = None):
+    """The NumPy index when the numpy engine is selected (per call or by RETRIEVAL_ENGINE) and built."""
+    if (engine or RETRIEVAL_ENGINE) != "numpy":
+        return None
+    return get_numpy_index()
+
+def vector_search(question_vector: List[float], n_results: int, where: dict = None, engine: str = None) -> List[dict]:
+    """
+    Returns the nearest chunks as {"id", "doc_text", "meta", "distance", "embedding"}
+    dicts, closest first, optionally restricted by a `where` metadata filter. engine
+    ("chroma" or "numpy") overrides RETRIEVAL_ENGINE.
+    """
+    index = numpy_engine(engine)
+    if index is not None:
+        return index.query(question_vector, n_results, where)
+    results = get_collection().query(
+        query_embeddings=[question_vector],
+        n_results=n_results,
+        where=where or None,
+        include=["documents", "metadatas", "distances", "embeddings"]
+    )
+    if not results.get("documents") or not results["documents"] or not results["documents"][0]:
+        return []
+    items = []
+    for chunk_id, doc_text, meta, dist, embedding in zip(
+        results["ids"][0], results["documents"][0], results["metadatas"][0],
+        results["distances"][0], results["embeddings"][0]
+    ):
+        items.append({"id": chunk_id, "doc_text": doc_text, "meta": meta, "distance": dist, "embedding": embedding})
+    items.sort(key=lambda x: x["distance"])
+    return items
+
+def vector_distances(question_vector: List[float], chunk_ids: List[str], engine: str = None) -> dict:
+    """
+    Computes the collection's distance between the question and the given chunks,
+    for lexical-only hits that did not come back from the vector query.
+    Returns {chunk_id: (distance, embedding)}.
+    """
+    if not chunk_ids:
+        return {}
+    index = numpy_engine(engine)
+    if index is not None:
+        return index.distances(question_vector, chunk_ids)
+    collection = get_collection()
+    stored = collection.get(ids=chunk_ids, include=["embeddings"])
+    if stored.get("embeddings") is None or len(stored["embeddings"]) == 0:
+        return {}
+    query = np.asarray(question_vector, dtype=np.float32)
+    vectors = np.asarray(stored["embeddings"], dtype=np.float32)
+    space = (collection.metadata or {}).get("hnsw:space", "l2")
+    if space == "cosine":
+        norms = np.linalg.norm(vectors, axis=1) * (np.linalg.norm(query) or 1.0)
+        distances = 1.0 - (vectors @ query) / np.where(norms == 0, 1.0, norms)
+    elif space == "ip":
+        distances = 1.0 - vectors @ query
+    else:
+        distances = np.sum((vectors - query) ** 2, axis=1)
+    return {
+        chunk_id: (float(d), vector)
+        for chunk_id, d, vector in zip(stored["ids"], distances, vectors)
+    }
+
+def reciprocal_rank_fusion(result_lists: List[List[dict]], k: int = RRF_K) -> List[dict]:
+    """Merges ranked lists by summing 1 / (k + rank) for every list an item appears in."""
+    scores = {}
+    items = {}
+    for results in result_lists:
+        for rank, item in enumerate(results, start=1):
+            scores[item["id"]] = scores.get(item["id"], 0.0) + 1.0 / (k + rank)
+            items.setdefault(item["id"], {}).update(item)
+    fused = []
+    for chunk_id in sorted(scores, key=scores.get, reverse=True):
+        item = items[chunk_id]
+        item["rrf_score"] = scores[chunk_id]
+        fused.append(item)
+    return fused
+
+def hybrid_search(question: str, question_vector: List[float], n_results: int, where: dict = None,
+                  engine: str = None) -> List[dict]:
+    """
+    Returns the n_results best chunks for a question, fusing vector and BM25 results
+    with reciprocal rank fusion. Every item carries a vector "distance" and its "embedding".
+    Both retrievers apply the same `where` metadata filter (see scopes.scope_filter).
+    """
+    if not HYBRID_SEARCH_ENABLED:
+        with timed("vector_search"):
+            return vector_search(question_vector, n_results, where, engine)
+
+    candidates = max(n_results, HYBRID_CANDIDATES)
+    with timed("vector_search"):
+        vector_items = vector_search(question_vector, candidates, where, engine)
+    with timed("lexical_search"):
+        lexical_items = lexical_search(question, candidates, where)
+    fused = reciprocal_rank_fusion([vector_items, lexical_items])[:n_results]
+
+    missing = [item["id"] for item in fused if item.get("distance") is None]
+    distances = vector_distances(question_vector, missing, engine)
+    for item in fused:
+        if item.get("distance") is None and item["id"] in distances:
+            item["distance"], item["embedding"] = distances[item["id"]]
+    # Chunks gone from Chroma since they were indexed are dropped
+    return [item for item in fused if item.get("distance") is not None]
+
+def _unit_rows(vectors) -> np.ndarray:
+    matrix = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(matrix, axis=-1, keepdims=True)
+    return matrix / np.where(norms == 0, 1.0, norms)
+
+def mmr_rerank(question_vector: List[float], items: List[dict], lambda_: float = MMR_LAMBDA) -> List[dict]:
+    """
+    Reorders candidates by maximal marginal relevance on their stored embeddings:
+    each pick balances relevance against similarity to the chunks already picked,
+    so near-duplicate chunks do not crowd out other relevant text. Relevance is the
+    fused rank score when present, otherwise cosine similarity to the question.
+    """
+    if len(items) <= 1:
+        return list(items)
+    vectors = _unit_rows([item["embedding"] for item in items])
+    query = _unit_rows(question_vector)
+    if all("rrf_score" in item for item in items):
+        relevance = np.array([item["rrf_score"] for item in items], dtype=np.float32)
+        relevance /= relevance.max()
+    else:
+        relevance = vectors @ query
+    pairwise = vectors @ vectors.T
+
+    selected = []
+    remaining = list(range(len(items)))
+    redundancy = np.zeros(len(items), dtype=np.float32)
+    while remaining:
+        scores = lambda_ * relevance[remaining] - (1.0 - lambda_) * redundancy[remaining]
+        pick = remaining.pop(int(np.argmax(scores)))
+        selected.append(pick)
+        redundancy = np.maximum(redundancy, pairwise[pick])
+    return [items[i] for i in selected]
+
+def collapse_near_duplicates(items: List[dict]) -> List[dict]:
+    """
+    Keeps only the first (best-ranked) chunk of each near-duplicate group found at
+    ingest time (see dedup.assign_chunks), e.g. one version of a paragraph repeated
+    with small edits across report versions.
+    """
+    groups = near_duplicate_groups([item["id"] for item in items])
+    seen, kept = set(), []
+    for item in items:
+        group = groups.get(item["id"], item["id"])
+        if group not in seen:
+            seen.add(group)
+            kept.append(item)
+    return kept
+
+def pack_context(items: List[dict], token_budget: int = CONTEXT_TOKEN_BUDGET, max_chunks: int = TOP_K) -> List[dict]:
+    """
+    Fills the token budget with whole chunks in the given order. A chunk that does
+    not fit is skipped (never split) and smaller later chunks may still fit. Token
+    counts come from the chunk metadata written at ingest; chunks without one are
+    encoded once here.
+    """
+    encoder = get_encoder()
+    separator_tokens = len(encoder.encode("\n\n"))
+    packed = []
+    used = 0
+    for item in items:
+        meta = item.get("meta") or {}
+        n_tokens = meta.get("n_tokens")
+        if n_tokens is None:
+            n_tokens = len(encoder.encode(item["doc_text"]))
+        cost = n_tokens + separator_tokens
+        if used + cost > token_budget:
+            continue
+        packed.append(item)
+        used += cost
+        if len(packed) >= max_chunks:
+            break
+    if not packed and items:
+        # Nothing fits whole: keep the best chunk, cut to the budget
+        tokens = encoder.encode(items[0]["doc_text"])
+        tokens = tokens[:char_boundary(encoder, tokens, token_budget)]
+        packed.append(dict(items[0], doc_text=encoder.decode(tokens)))
+    return packed
@@ -0,0 +1,65 @@
+#!/usr/bin/env python
+# Server-side store for per-session retrieval state (last query, sources and answer).
+# The Flask session cookie only carries the key, so its size does not grow with answers.
+import json
+import time
+import uuid
+
+from config import RETRIEVAL_STATE_DB, RETRIEVAL_STATE_TTL
+from sqlite_pool import get_connection
+
+def init_retrieval_state():
+    with get_connection(RETRIEVAL_STATE_DB) as conn:
+        cur = conn.cursor()
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS retrieval_state (
+                key TEXT PRIMARY KEY,
+                data TEXT NOT NULL,
+                expires_at REAL NOT NULL
+            )
+        """)
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_retrieval_state_expires ON retrieval_state (expires_at)")
+        conn.commit()
+
+def state_key(store) -> str:
+    """Returns the retrieval state key of a session-like mapping, creating one if missing."""
+    if "state_key" not in store:
+        store["state_key"] = uuid.uuid4().hex
+    return store["state_key"]
+
+def load_state(key) -> dict:
+    """Returns the stored state for key, or an empty dict if it is missing or expired."""
+    if not key:
+        return {}
+    with get_connection(RETRIEVAL_STATE_DB) as conn:
+        cur = conn.cursor()
+        cur.execute("SELECT data FROM retrieval_state WHERE key = ? AND expires_at > ?", (key, time.time()))
+        row = cur.fetchone()
+    return json.loads(row[0]) if row else {}
+
+def save_state(key, **fields):
+    """
+    Merges fields into the state stored under key and extends its expiry by the TTL.
+    Expired entries of all sessions are evicted on the way.
+    """
+    now = time.time()
+    with get_connection(RETRIEVAL_STATE_DB) as conn:
+        cur = conn.cursor()
+        cur.execute("SELECT data FROM retrieval_state WHERE key = ? AND expires_at > ?", (key, now))
+        row = cur.fetchone()
+        data = json.loads(row[0]) if row else {}
+        data.update(fields)
+        cur.execute(
+            "INSERT OR REPLACE INTO retrieval_state (key, data, expires_at) VALUES (?, ?, ?)",
+            (key, json.dumps(data), now + RETRIEVAL_STATE_TTL)
+        )
+        cur.execute("DELETE FROM retrieval_state WHERE expires_at <= ?", (now,))
+        conn.commit()
+
+def delete_state(key):
+    if not key:
+        return
+    with get_connection(RETRIEVAL_STATE_DB) as conn:
+        cur = conn.cursor()
+        cur.execute("DELETE FROM retrieval_state WHERE key = ?", (key,))
+        conn.commit()
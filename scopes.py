@@ -0,0 +1,145 @@
+#!/usr/bin/env python
+# Retrieval scopes for /query. A scope narrows the chunks a question is answered from by
+# source type, upload folder, upload date and document id. Scopes become a Chroma `where`
+# filter on the metadata every chunk already carries, so a scoped query only scores the
+# chunks in scope. The date range is resolved through the document catalog, whose
+# upload_time is sortable, into the documents uploaded in that range. A chunk stored once
+# for several documents (see dedup.py) is added by id when any of them is in scope.
+import json
+import datetime
+from typing import Optional
+
+from app.database_setup import DOCS_DB
+from sqlite_pool import get_connection
+from dedup import shared_chunks_in_scope
+
+SOURCE_TYPES = ("document", "wiki")
+SCOPE_KEYS = ("types", "folders", "date_from", "date_to", "doc_ids")
+
+class ScopeError(ValueError):
+    """Raised for malformed scopes; the query routes answer it with a 400."""
+
+def _string_list(scopes: dict, key: str) -> list:
+    value = scopes.get(key)
+    if value is None:
+        return []
+    if isinstance(value, str):
+        value = [value]
+    if not isinstance(value, list) or not all(isinstance(item, str) and item for item in value):
+        raise ScopeError(f"'{key}' must be a string or a list of strings.")
+    return sorted(set(value))
+
+def _date(scopes: dict, key: str) -> Optional[str]:
+    """Parses an ISO date or datetime; returns it in the catalog's upload_time format."""
+    value = scopes.get(key)
+    if value is None or value == "":
+        return None
+    if not isinstance(value, str):
+        raise ScopeError(f"'{key}' must be an ISO date such as 2024-05-31.")
+    try:
+        if len(value) == 10:
+            day = datetime.date.fromisoformat(value)
+            # A bare date_to includes the whole day
+            if key == "date_to":
+                day += datetime.timedelta(days=1)
+            return datetime.datetime.combine(day, datetime.time()).isoformat()
+        return datetime.datetime.fromisoformat(value).replace(tzinfo=None).isoformat()
+    except ValueError:
+        raise ScopeError(f"'{key}' must be an ISO date such as 2024-05-31.")
+
+def parse_scopes(scopes) -> Optional[dict]:
+    """
+    Validates the "scopes" object of a query request and returns it normalized
+    ({"types", "folders", "date_from", "date_to", "doc_ids"}), or None when it is
+    absent or sets nothing.
+    """
+    if scopes is None:
+        return None
+    if not isinstance(scopes, dict):
+        raise ScopeError("'scopes' must be an object.")
+    unknown = set(scopes) - set(SCOPE_KEYS)
+    if unknown:
+        raise ScopeError(f"Unknown scope(s): {', '.join(sorted(unknown))}.")
+    parsed = {
+        "types": _string_list(scopes, "types"),
+        "folders": _string_list(scopes, "folders"),
+        "date_from": _date(scopes, "date_from"),
+        "date_to": _date(scopes, "date_to"),
+        "doc_ids": _string_list(scopes, "doc_ids"),
+    }
+    bad_types = set(parsed["types"]) - set(SOURCE_TYPES)
+    if bad_types:
+        raise ScopeError(f"Unknown source type(s): {', '.join(sorted(bad_types))}.")
+    if parsed["date_from"] and parsed["date_to"] and parsed["date_from"] >= parsed["date_to"]:
+        raise ScopeError("'date_from' must be before 'date_to'.")
+    if not any(parsed.values()):
+        return None
+    return parsed
+
+def scope_key(scopes: Optional[dict]) -> Optional[str]:
+    """A stable string identifying a normalized scope, e.g. for the answer cache."""
+    return json.dumps(scopes, sort_keys=True) if scopes else None
+
+def documents_uploaded_between(date_from: Optional[str], date_to: Optional[str]) -> list:
+    """Ids of catalog documents uploaded in [date_from, date_to)."""
+    conditions, params = [], []
+    if date_from:
+        conditions.append("upload_time >= ?")
+        params.append(date_from)
+    if date_to:
+        conditions.append("upload_time < ?")
+        params.append(date_to)
+    with get_connection(DOCS_DB) as conn:
+        cur = conn.cursor()
+        cur.execute(f"SELECT doc_id FROM documents WHERE {' AND '.join(conditions)}", params)
+        return [doc_id for (doc_id,) in cur.fetchall()]
+
+def scope_filter(scopes: dict) -> Optional[dict]:
+    """
+    Builds the Chroma `where` filter for a normalized scope. Returns None when no
+    chunk can be in scope (e.g. no document was uploaded in the date range).
+    Folders, dates and document ids only match uploaded documents; wiki pages
+    carry none of them.
+    """
+    conditions = []
+    types = set(scopes["types"])
+    if types == {"wiki"}:
+        conditions.append({"type": "wiki"})
+    elif types == {"document"}:
+        # Document chunks stored before they were tagged with a type have none
+        conditions.append({"type": {"$ne": "wiki"}})
+    if scopes["folders"]:
+        conditions.append({"folder": {"$in": scopes["folders"]}})
+
+    doc_ids = set(scopes["doc_ids"]) if scopes["doc_ids"] else None
+    if scopes["date_from"] or scopes["date_to"]:
+        in_range = set(documents_uploaded_between(scopes["date_from"], scopes["date_to"]))
+        doc_ids = in_range if doc_ids is None else doc_ids & in_range
+    if doc_ids is not None:
+        if not doc_ids:
+            return None
+        conditions.append({"doc_id": {"$in": sorted(doc_ids)}})
+
+    if types == {"wiki"} and len(conditions) > 1:
+        # Wiki chunks have no folder or document id
+        return None
+    if not conditions:
+        return {}
+    return conditions[0] if len(conditions) == 1 else {"$and": conditions}
+
+def _filters_documents(where: dict) -> bool:
+    parts = where.get("$and") or where.get("$or")
+    if parts:
+        return any(_filters_documents(part) for part in parts)
+    return bool({"folder", "doc_id"} & set(where))
+
+def search_filter(where: Optional[dict]) -> Optional[dict]:
+    """
+    The filter to search chunks with for a scope filter. Shared chunks that a
+    document in scope refers to are added by id, since their stored copy carries
+    the folder and doc_id of another document.
+    """
+    if not where or not _filters_documents(where):
+        return where
+    shared = shared_chunks_in_scope(where)
+    return {"$or": [where, {"chunk_id": {"$in": shared}}]} if shared else where
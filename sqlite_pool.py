@@ -0,0 +1,41 @@
+import os
+import sqlite3
+import threading
+
+# Compiled statements kept per connection; the helpers reuse a small set of queries
+CACHED_STATEMENTS = 256
+BUSY_TIMEOUT = 30  # Seconds a writer waits for the database lock
+
+_local = threading.local()
+
+def _open(path):
+    conn = sqlite3.connect(path, timeout=BUSY_TIMEOUT, cached_statements=CACHED_STATEMENTS)
+    # WAL lets readers continue while a write is in progress; NORMAL sync is safe in WAL mode
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    return conn
+
+def get_connection(path):
+    """
+    Returns this thread's connection to the database at path, opening it on first use.
+    Use it as `with get_connection(path) as conn:`; the block commits or rolls back
+    but leaves the connection open, so its prepared statements are reused by later calls.
+    """
+    connections = getattr(_local, "connections", None)
+    # A forked child must not reuse its parent's connections
+    if connections is None or _local.pid != os.getpid():
+        connections = _local.connections = {}
+        _local.pid = os.getpid()
+    conn = connections.get(path)
+    if conn is None:
+        conn = connections[path] = _open(path)
+    return conn
+
+def close_connections():
+    """Closes the calling thread's cached connections."""
+    connections = getattr(_local, "connections", None) or {}
+    if getattr(_local, "pid", None) == os.getpid():
+        for conn in connections.values():
+            conn.close()
+    _local.connections = {}
+    _local.pid = os.getpid()
@@ -0,0 +1,31 @@
+# The tiktoken encoder shared by chunking, context packing and question truncation.
+# Loading it reads (and on first use downloads) its BPE ranks, so it is created on first use.
+import codecs
+import threading
+
+ENCODING_NAME = "cl100k_base"
+
+_encoder = None
+_lock = threading.Lock()
+
+def get_encoder():
+    global _encoder
+    if _encoder is None:
+        with _lock:
+            if _encoder is None:
+                import tiktoken
+                _encoder = tiktoken.get_encoding(ENCODING_NAME)
+    return _encoder
+
+def char_boundary(encoder, tokens: list, index: int) -> int:
+    """
+    Moves a cut in a token list back, by at most three tokens, to where the text
+    before it ends on a whole UTF-8 character. A multibyte character can span
+    several tokens, and cutting between them would decode to U+FFFD on both sides.
+    """
+    for cut in range(index, max(index - 4, 0), -1):
+        decoder = codecs.getincrementaldecoder("utf-8")(errors="ignore")
+        decoder.decode(encoder.decode_bytes(tokens[max(cut - 4, 0):cut]))
+        if not decoder.getstate()[0]:
+            return cut
+    return index
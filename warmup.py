@@ -0,0 +1,65 @@
+#!/usr/bin/env python
+# Warm-up for a freshly started worker. Heavy dependencies (chromadb, the OpenAI SDK,
+# tiktoken, unstructured) are imported on first use, so without a warm-up the first
+# request a worker serves pays for them. Enable with WARM_UP=true, or call warm_up()
+# from a server hook such as gunicorn's post_worker_init.
+import time
+
+def _load_chroma_index():
+    """Opens the active collection and runs one query so its vector index is read into memory."""
+    from database import get_collection
+    collection = get_collection()
+    sample = collection.get(limit=1, include=["embeddings"])
+    if sample["ids"]:
+        collection.query(query_embeddings=[sample["embeddings"][0]], n_results=1, include=[])
+    return collection.count()
+
+def _load_numpy_index():
+    """Reads the NumPy index rows into memory when it is the retrieval engine."""
+    from config import RETRIEVAL_ENGINE
+    if RETRIEVAL_ENGINE == "numpy":
+        from numpy_index import get_numpy_index
+        get_numpy_index()
+
+def _load_openai_clients():
+    from query import get_client, get_async_client
+    from chunk_and_embed import get_client as get_ingest_client
+    get_client()
+    get_async_client()
+    get_ingest_client()
+
+def _load_tokenizer():
+    from tokenizer import get_encoder
+    get_encoder().encode("warm up")
+
+def _load_partitioners():
+    # Only worth it in processes that ingest documents
+    import unstructured.partition.pdf
+    import unstructured.partition.docx
+    import unstructured.partition.text
+    import unstructured.partition.xlsx
+
+STEPS = [
+    ("tokenizer", _load_tokenizer),
+    ("openai_clients", _load_openai_clients),
+    ("chroma_index", _load_chroma_index),
+    ("numpy_index", _load_numpy_index),
+]
+
+def warm_up(partitioners: bool = False) -> dict:
+    """Runs each warm-up step and returns {step: seconds}. A failing step is reported and skipped."""
+    steps = STEPS + ([("partitioners", _load_partitioners)] if partitioners else [])
+    timings = {}
+    for name, step in steps:
+        start = time.perf_counter()
+        try:
+            step()
+        except Exception as e:
+            print(f"Warm-up step {name} failed: {e}")
+            continue
+        timings[name] = round(time.perf_counter() - start, 3)
+    print(f"Warm-up done: {timings}")
+    return timings
+
+if __name__ == "__main__":
+    warm_up(partitioners=True)